@@ -1,10 +1,125 @@
+import logging as log
 import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
 
+import httpx
 from supabase import create_client, Client
 
+# Most clients one process holds at once:
+CLIENT_POOL_SIZE = int(os.getenv("CLIENT_POOL_SIZE", 2))
+# Seconds a client can sit idle before it is health-checked on borrow:
+CLIENT_MAX_IDLE = float(os.getenv("CLIENT_MAX_IDLE", 60))
+
 
 def connect():
     url: str = os.environ.get("SUPABASE_URL")
     key: str = os.environ.get("SUPABASE_KEY")
     supabase: Client = create_client(supabase_url=url, supabase_key=key)
-    return supabase
\ No newline at end of file
+    return supabase
+
+
+class ClientPool:
+    """
+    Bounded pool of Supabase clients for one process, so tasks reuse the
+    clients' HTTP sessions instead of building a new client each time.
+
+    :param size: Most clients in use or idle at once
+    :param factory: Builds a new client
+    :param max_idle: Seconds idle after which a client is checked before reuse
+    :param timeout: Seconds to wait for a free client
+    """
+
+    def __init__(
+            self,
+            size: int = CLIENT_POOL_SIZE,
+            factory: Callable[[], Client] = connect,
+            max_idle: float = CLIENT_MAX_IDLE,
+            timeout: float = 60):
+        self.size = size
+        self.factory = factory
+        self.max_idle = max_idle
+        self.timeout = timeout
+        # Most recently used first, so spare clients go idle and get checked:
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def borrow(self) -> Iterator[Client]:
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No client free after {self.timeout}s")
+        client = None
+        try:
+            client = self._checkout()
+            yield client
+        except httpx.TransportError:
+            # The connection broke, so the next borrower gets a new client:
+            self._discard(client)
+            client = None
+            raise
+        finally:
+            if client is not None:
+                self._idle.put((client, time.monotonic()))
+            self._slots.release()
+
+    def _checkout(self) -> Client:
+        try:
+            client, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            return self.factory()
+        if (time.monotonic() - last_used > self.max_idle) and not self._healthy(client):
+            self._discard(client)
+            return self.factory()
+        return client
+
+    def _healthy(self, client: Client) -> bool:
+        try:
+            if client.postgrest.session.is_closed:
+                return False
+            client.table("sources").select("id").limit(1).execute()
+            return True
+        except Exception as e:
+            log.warning(f"Replacing unhealthy client: {e}")
+            return False
+
+    def _discard(self, client: Optional[Client]) -> None:
+        if client is None:
+            return
+        try:
+            client.postgrest.session.close()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        while True:
+            try:
+                client, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(client)
+
+
+_pool: Optional[ClientPool] = None
+_pool_lock = threading.Lock()
+
+
+def init_pool(size: int = CLIENT_POOL_SIZE) -> ClientPool:
+    """ (Re)create this process's pool, e.g. on worker process start. """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ClientPool(size=size)
+    return _pool
+
+
+def client_pool() -> ClientPool:
+    """ Per-process pool, created on first use if not initialized. """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ClientPool()
+    return _pool
@@ -0,0 +1,84 @@
+# Compact encoding for payloads passed between the fetch, parse and upload
+# stages: compact JSON, zlib-compressed above a size threshold. The first
+# two bytes record the format and the compression, so the format can
+# change without breaking payloads already in flight.
+import json
+import os
+import zlib
+
+PACKED_CONTENT_TYPE = "application/x-ultrasearch-packed"
+# Send inter-stage payloads packed, rather than as JSON text:
+PACKED_PAYLOADS = os.getenv("PACKED_PAYLOADS", "false").lower() == "true"
+# Payloads at least this many bytes are compressed:
+COMPRESS_THRESHOLD = int(os.getenv("PACK_COMPRESS_THRESHOLD", 1024))
+COMPRESS_LEVEL = 6
+
+FORMAT_JSON = b"j"
+COMPRESSED = b"z"
+UNCOMPRESSED = b"-"
+
+
+def _default(o):
+    # Events and EventLists encode as their plain rows:
+    if hasattr(o, "todicts"):
+        return o.todicts()
+    if hasattr(o, "todict"):
+        return o.todict()
+    raise TypeError(f"Cannot pack object of type {type(o)}")
+
+
+def packb(obj) -> bytes:
+    body = json.dumps(obj, default=_default, separators=(",", ":")).encode("utf-8")
+    if len(body) >= COMPRESS_THRESHOLD:
+        return FORMAT_JSON + COMPRESSED + zlib.compress(body, COMPRESS_LEVEL)
+    return FORMAT_JSON + UNCOMPRESSED + body
+
+
+def unpackb(data: bytes):
+    if isinstance(data, str):
+        data = data.encode("latin-1")
+    fmt, compression, body = data[:1], data[1:2], data[2:]
+    if compression == COMPRESSED:
+        body = zlib.decompress(body)
+    if fmt == FORMAT_JSON:
+        return json.loads(body)
+    raise ValueError(f"Unknown payload format: {fmt!r}")
+
+
+def benchmark(n_events: int = 2000, repeat: int = 20) -> None:
+    """ Compare payload size and encode/decode time with the JSON path. """
+    import timeit
+
+    from events import (
+        Event, EventList, event_list_dumps, event_list_loads, event_list_packb, event_list_unpackb)
+
+    events = EventList([
+        Event(
+            source_id=2,
+            name=f"Trail Race {i}",
+            event_foreign_id=100000 + i,
+            url=f"https://example.com/races/{i}",
+            start_date="2023-06-01",
+            distances=[{"length": 50.0, "unit": "km"}, {"length": 100.0, "unit": "mile"}],
+            country="France",
+            city="Chamonix",
+            state=None,
+            latitude=45.92,
+            longitude=6.87,
+            virtual=False)
+        for i in range(n_events)])
+    as_json = event_list_dumps(events)
+    packed = event_list_packb(events)
+    print(f"{n_events} events")
+    for name, size, encode, decode in [
+            ("json", len(as_json.encode("utf-8")),
+             lambda: event_list_dumps(events), lambda: event_list_loads(as_json)),
+            ("packed", len(packed),
+             lambda: event_list_packb(events), lambda: event_list_unpackb(packed))]:
+        t_encode = timeit.timeit(encode, number=repeat) / repeat * 1000
+        t_decode = timeit.timeit(decode, number=repeat) / repeat * 1000
+        print(f"{name:>8}: {size:>9} bytes, encode {t_encode:7.2f}ms, decode {t_decode:7.2f}ms")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,98 +1,170 @@
 import json
 from json import JSONEncoder
-from typing import List
+from typing import Dict, Iterator, List, Optional, Union
+
+from codec import packb, unpackb
 
 
 class Event:
 
+    # Columns to present in public schema:
+    SCHEMA = (
+        "source_id",
+        "name",
+        "start_date",
+        "city",
+        "state",
+        "country",
+        "url",
+        "virtual",
+        "latitude",
+        "longitude"
+    )
+    # All fields produced by the parsers:
+    FIELDS = SCHEMA + ("event_foreign_id", "distances")
+    _FIELD_SET = frozenset(FIELDS)
+
+    # Unset fields are left empty and omitted from todict(). Anything else
+    # passed in is kept in _extra:
+    __slots__ = FIELDS + ("_extra",)
+
     def __init__(self, **params):
-        # Columns to present in public schema:
-        self.__schema = [
-            "source_id",
-            "name",
-            "start_date",
-            "city",
-            "state",
-            "country",
-            "url",
-            "virtual",
-            "latitude",
-            "longitude"
-        ]
-        self.__dict__.update(params)
+        # Payloads serialized by the old __dict__-based Event carry this:
+        params.pop("_Event__schema", None)
+        self._extra = None
+        for key, value in params.items():
+            if key in self._FIELD_SET:
+                object.__setattr__(self, key, value)
+            else:
+                if self._extra is None:
+                    self._extra = {}
+                self._extra[key] = value
 
         # Validation:
-        self.latitude = float(self.latitude) if (self.latitude is not None) else None
-        self.longitude = float(self.longitude) if (self.longitude is not None) else None
+        latitude = params.get("latitude")
+        longitude = params.get("longitude")
+        self.latitude = float(latitude) if (latitude is not None) else None
+        self.longitude = float(longitude) if (longitude is not None) else None
         if self.latitude is not None:
             if self.latitude < -90 or self.latitude > 90:
-                self.__dict__["latitude"] = self.__dict__["latitude"] % 90
+                self.latitude = self.latitude % 90
         if self.longitude is not None:
             if self.longitude < -180 or self.longitude > 180:
-                self.__dict__["longitude"] = self.__dict__["longitude"] % 180
-
-    @property
-    def city(self):
-        return self.__dict__.get("city")
-
-    @property
-    def country(self):
-        return self.__dict__.get("country")
-
-    @property
-    def state(self):
-        return self.__dict__.get("state")
-
-    @property
-    def start_date(self):
-        return self.__dict__.get("start_date")
-
-    @property
-    def name(self):
-        return self.__dict__.get("name")
-
-    @property
-    def distances(self):
-        return self.__dict__.get("distances")
-
-    @property
-    def latitude(self):
-        return self.__dict__.get("latitude")
+                self.longitude = self.longitude % 180
+
+    def __getattr__(self, name):
+        # Only called when normal lookup fails, i.e. for unset fields:
+        if name in Event._FIELD_SET:
+            return None
+        if name.startswith("_"):
+            raise AttributeError(name)
+        extra = self._extra
+        if extra is not None and name in extra:
+            return extra[name]
+        raise AttributeError(name)
+
+    def todict(self, schema: bool = False) -> Dict:
+        out = {}
+        for key in (self.SCHEMA if schema else self.FIELDS):
+            try:
+                out[key] = object.__getattribute__(self, key)
+            except AttributeError:
+                pass
+        if (not schema) and (self._extra is not None):
+            out.update(self._extra)
+        return out
 
     @property
-    def longitude(self):
-        return self.__dict__.get("longitude")
-
-    @latitude.setter
-    def latitude(self, latitude):
-        self.__dict__["latitude"] = latitude
+    def __dict__(self):
+        # Kept for callers (and encoders) written against the old Event:
+        return self.todict()
 
-    @longitude.setter
-    def longitude(self, longitude):
-        self.__dict__["longitude"] = longitude
+    def __getstate__(self):
+        return self.todict()
 
-    def todict(self, schema: bool = False):
-        return self.__dict__ if not schema else {k: v for k, v in self.__dict__.items() if k in self.__schema}
+    def __setstate__(self, state):
+        self.__init__(**state)
 
     def __eq__(self, other):
         if not isinstance(other, Event):
             return False
-        return self.__dict__ == other.__dict__
+        return self.todict() == other.todict()
+
+    def __repr__(self):
+        return f"Event({self.todict()!r})"
 
 
 class EventList:
+    """
+    A batch of events, held either as a list of ``Event`` objects or
+    column-wise as a dict of equal-length lists (see ``from_columns``).
+    Column-wise lists build each ``Event`` only when it is accessed.
+    """
+
+    def __init__(self, events: Optional[List[Event]] = None):
+        self._events = events if events is not None else []
+        self._columns: Optional[Dict[str, List]] = None
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, List]) -> "EventList":
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns have different lengths: {sorted(lengths)}")
+        out = cls()
+        out._events = None
+        out._columns = columns
+        return out
+
+    @property
+    def columnar(self) -> bool:
+        return self._columns is not None
 
-    def __init__(self, events: List[Event]):
-        self.events = events
+    @property
+    def events(self) -> List[Event]:
+        if self._columns is not None:
+            return list(self)
+        return self._events
+
+    def to_columns(self) -> Dict[str, List]:
+        if self._columns is not None:
+            return self._columns
+        rows = [event.todict() for event in self._events]
+        keys = list(dict.fromkeys(key for row in rows for key in row))
+        return {key: [row.get(key) for row in rows] for key in keys}
+
+    def todicts(self) -> List[Dict]:
+        """ Rows as dicts, without building Events for column-wise lists. """
+        if self._columns is not None:
+            keys = list(self._columns)
+            return [dict(zip(keys, row)) for row in zip(*self._columns.values())]
+        return [event.todict() for event in self._events]
+
+    def _row(self, i) -> Event:
+        return Event(**{key: values[i] for key, values in self._columns.items()})
 
     def __get__(self, i):
-        return self.events[i]
+        return self[i]
 
     def __getitem__(self, i):
-        return self.events[i]
+        if self._columns is None:
+            return self._events[i]
+        if isinstance(i, slice):
+            return [self._row(j) for j in range(len(self))[i]]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("EventList index out of range")
+        return self._row(i)
+
+    def __iter__(self) -> Iterator[Event]:
+        if self._columns is None:
+            return iter(self._events)
+        return (self._row(i) for i in range(len(self)))
 
     def __len__(self):
-        return len(self.events)
+        if self._columns is None:
+            return len(self._events)
+        return len(next(iter(self._columns.values()), []))
 
     def __eq__(self, other):
         if not isinstance(other, EventList):
@@ -103,7 +175,7 @@ class EventList:
 class EventEncoder(JSONEncoder):
 
     def default(self, o):
-        return o.__dict__
+        return o.todict()
 
 
 class EventListEncoder(JSONEncoder):
@@ -113,7 +185,7 @@ class EventListEncoder(JSONEncoder):
             raise TypeError((
                 f"EventListEncoder can only encode EventList objects "
                 f"(received: {type(o)})"))
-        return [event.__dict__ for event in o.events]
+        return o.todicts()
 
 
 def event_dumps(obj):
@@ -138,3 +210,29 @@ def event_list_loads(out):
 
 def celery_event_list_loads(out):
     return _event_list_loader(json.loads(out)[0][0])
+
+
+def event_list_packb(obj):
+    return packb(obj.todicts())
+
+
+def event_list_unpackb(out):
+    return _event_list_loader(unpackb(out))
+
+
+def celery_event_list_unpackb(out):
+    return _event_list_loader(unpackb(out)[0][0])
+
+
+def event_list_load(out: Union[str, bytes, List[Dict]]) -> EventList:
+    """
+    EventList from a parse stage result, in whichever form it arrived.
+
+    :param out: JSON text, packed bytes, or rows already decoded by the
+        task serializer
+    """
+    if isinstance(out, str):
+        return event_list_loads(out)
+    if isinstance(out, (bytes, bytearray)):
+        return event_list_unpackb(out)
+    return _event_list_loader(out)
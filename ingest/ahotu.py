@@ -1,18 +1,26 @@
-import copy
 import logging as log
 import os
 import time
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
 
 import httpx
 from supabase import Client
 
-from client import connect
+from client import client_pool
+from ingest.bulk import bulk_upload
+from codec import PACKED_PAYLOADS
+from ingest.columnar import register_vectorized
+from ingest.mapping import SourceMapping
+from ingest.existence import EventIndex
+from ingest.fetchcache import FetchCache
+from ingest.fingerprint import event_fingerprint, fingerprint_store
 from ingest.ingest import Ingest
-from ingest.parser import distance_extract, identity
+from ingest.ratelimit import RateLimiter
+from ingest.parser import UnitValuePair, distance_normalize, identity
+from ingest.refdata import reference_data
 from ingest.ultrarequest import UltraRequest
 
-from events import Event, EventList, event_list_dumps, event_list_loads
+from events import EventList, event_list_dumps, event_list_load
 
 
 def not_on_site(x: str) -> bool:
@@ -20,7 +28,7 @@ def not_on_site(x: str) -> bool:
 
 
 def has_virtual_tag(x: Optional[List[str]]) -> bool:
-    return "virtual" in x
+    return (x is not None) and ("virtual" in x)
 
 
 def latlon_parser(x: Optional[Dict], ix: int) -> Optional[float]:
@@ -38,11 +46,17 @@ def lon_parser(x: Dict) -> Optional[float]:
     return latlon_parser(x, 0)
 
 
-def activity_parser(x: List) -> Optional[List[str]]:
+register_vectorized(has_virtual_tag, lambda x: x.explode().eq("virtual").groupby(level=0).any())
+register_vectorized(lat_parser, lambda x: x.str.get("coordinates").str.get(1))
+register_vectorized(lon_parser, lambda x: x.str.get("coordinates").str.get(0))
+
+
+def activity_parser(x: List) -> Optional[List[UnitValuePair]]:
+    # Ahotu already gives a numeric distance and unit, so emit a
+    # structured pair rather than a string for distance_extract():
     unit_id_map = {
         1: "km",
-        2: "meters",
-        3: "miles",
+        3: "mile",
         5: "hour"
     }
     if len(x) != 1:
@@ -54,17 +68,35 @@ def activity_parser(x: List) -> Optional[List[str]]:
         unit_id = 1
         length = length / 1000.0
     try:
-        # Janky, but use for consistency
-        return [f"{length} {unit_id_map[unit_id]}"]
+        return [{"length": float(length), "unit": unit_id_map[unit_id]}]
     except KeyError:
         return None
 
 
-def fetch_data(url, request_params, sleep=5) -> Dict:
+def process_response(payload) -> Dict:
+    return payload["races"]
+
+
+def fetch_data(
+        url, request_params, sleep=5, cache: Optional[FetchCache] = None,
+        limiter: Optional[RateLimiter] = None) -> Optional[Dict]:
+    """
+    :param cache: If given, fetch conditionally and return None when the
+        page is unchanged since its last upload.
+    :param limiter: If given, take a token from it instead of sleeping
+    """
     # Be polite:
-    if sleep:
+    if limiter is not None:
+        limiter.acquire()
+    elif sleep:
         time.sleep(sleep)
-    return httpx.get(url, params=request_params).json()["races"]
+    if cache is None:
+        payload = httpx.get(url, params=request_params).json()
+    else:
+        payload = cache.fetch(url, request_params)
+        if payload is None:
+            return None
+    return process_response(payload)
 
 
 def parse_data(batch):
@@ -73,25 +105,26 @@ def parse_data(batch):
     each time, instead of sending as an argument.
 
     :param batch:
-    :return: Needs to be JSON, hence the event_list_dumps() call.
+    :return: JSON text, or plain rows when payloads are packed
     """
-    return event_list_dumps(AhotuIngest().parse(batch))
+    events = AhotuIngest().parse(
+        batch, columnar=os.getenv("COLUMNAR_PARSE", "false").lower() == "true")
+    return events.todicts() if PACKED_PAYLOADS else event_list_dumps(events)
 
 
 def upload_data(event_list):
-    # Since tasks are run parallel potentially across different machines
-    # we open new db connections for each, but control connections
-    # via concurrency of the queue. For the fetch and parse tasks,
-    # we have no restrictions on the queue concurrency.
-    client = connect()
-    return AhotuIngest().upload(
-        event_list_loads(event_list), client=client)
+    # Clients are reused across tasks in a worker process; the number of
+    # connections is still controlled by the upload queue's concurrency.
+    with client_pool().borrow() as client:
+        return AhotuIngest().upload(
+            event_list_load(event_list), client=client,
+            bulk=os.getenv("BULK_UPLOAD", "false").lower() == "true")
 
 
 class AhotuRequest(UltraRequest):
 
-    def __init__(self, params: Dict):
-        super().__init__(params)
+    def __init__(self, params: Dict, payload: Optional[Dict] = None):
+        super().__init__(params, payload=payload)
         self.name = "Ahotu"
         self.url = os.getenv("SOURCE_AHOTU")
         if not self.url:
@@ -99,17 +132,48 @@ class AhotuRequest(UltraRequest):
                 f"'SOURCE_{self.name.upper()}' environment variable must be set")
         self.params = params
 
-    def fetch(self) -> Dict:
+    def fetch(self, limiter: Optional[RateLimiter] = None) -> Dict:
         """
         Later: return AhotuResponse. Error handling left to caller
 
         :return:
         """
-        return fetch_data(url=self.url, request_params=self.params)
+        if self.payload is not None:
+            return process_response(self.payload)
+        return fetch_data(url=self.url, request_params=self.params, limiter=limiter)
+
+    def process(self, payload) -> Dict:
+        return process_response(payload)
+
+
+MAPPING = SourceMapping(
+    schema_mapping={
+        "source_id": (None, identity),
+        "name": ("event_name_en", identity),
+        "event_foreign_id": ("id", identity),
+        "url": ("registration_url", identity),
+        "start_date": ("start_date", identity),
+        "distances": ("activities", activity_parser),
+        "country": ("country", identity),
+        "city": ("city", identity),
+        "state": (None, identity),  # could get this, do later
+        "latitude": ("lonlat", lat_parser),
+        "longitude": ("lonlat", lon_parser),
+        "virtual": ("tags", has_virtual_tag)
+    },
+    unmapped_defaults={
+        "country": None,
+        "state": None,
+        "source_id": 2
+    })
 
 
 class AhotuIngest(Ingest):
 
+    source_name = "Ahotu"
+    mapping = MAPPING
+    event_key = ("name", "start_date", "city", "country")
+
     def __init__(self):
         super().__init__()
         self.name = "Ahotu"
@@ -125,63 +189,47 @@ class AhotuIngest(Ingest):
             "activity": ["run"]
         }
 
-        # Class constants:
-        self.__schema_mapping = {
-            "source_id": (None, identity),
-            "name": ("event_name_en", identity),
-            "event_foreign_id": ("id", identity),
-            "url": ("registration_url", identity),
-            "start_date": ("start_date", identity),
-            "distances": ("activities", activity_parser),
-            "country": ("country", identity),
-            "city": ("city", identity),
-            "state": (None, identity),  # could get this, do later
-            "latitude": ("lonlat", lat_parser),
-            "longitude": ("lonlat", lon_parser),
-            "virtual": ("tags", has_virtual_tag)
-        }
-        self.__unmapped_defaults = {
-            "country": None,
-            "state": None,
-            "source_id": 2
-        }
-
     def fetch(self) -> List[AhotuRequest]:
         """
         :return:
         """
-        # Need to get total number of pages:
-        total_pages = httpx.get(
-            self.url, params=self.params).json()["total_pages"]
-
-        # Return a list of promises/functions that can be executed in parallel:
-        request_list = []
-        for page_ix in range(1, total_pages + 1):
-            tmp_params = copy.deepcopy(self.params)
-            tmp_params["page"] = page_ix
-            request_list.append(AhotuRequest(params=tmp_params))
-        return request_list
-
-    def parse(self, batch: List[Dict]) -> EventList:
+        return list(self.iter_requests())
+
+    def iter_requests(self) -> Iterator[AhotuRequest]:
+        """
+        Plan requests lazily. Page 1 also gives the total number of pages,
+        so its response is kept on its request rather than fetched twice.
+        """
+        first_page = httpx.get(self.url, params={**self.params, "page": 1}).json()
+        yield AhotuRequest(params={**self.params, "page": 1}, payload=first_page)
+        # Shallow copies, as the nested params are never modified:
+        for page_ix in range(2, first_page["total_pages"] + 1):
+            yield AhotuRequest(params={**self.params, "page": page_ix})
+
+    def parse(self, batch: List[Dict], columnar: bool = False) -> EventList:
         log.info("Parsing events...")
-        tmp_parsed_data = []
-        for event in batch:
-            parsed_event = {}
-            for key, value in self.__schema_mapping.items():
-                if value[0] is None:
-                    # Not a mapped field:
-                    parsed_event[key] = self.__unmapped_defaults[key]
-                else:
-                    # Remap the field:
-                    parsed_event[key] = value[1](event[value[0]])
-            tmp_parsed_data.append(parsed_event)
-        log.info(f"Successfully parsed {len(tmp_parsed_data)} events")
-        return EventList([Event(**event) for event in tmp_parsed_data])
-
-    def upload(self, parsed_batch: EventList, client: Client):
-        # Go event-by-event for now:
+        events = self.mapping.parse(batch, columnar=columnar)
+        log.info(f"Successfully parsed {len(events)} events")
+        return events
+
+    def upload(self, parsed_batch: EventList, client: Client, bulk: bool = False):
+        if bulk:
+            # Skip virtual events for now as we need locations:
+            located = [e for e in parsed_batch if (e.city is not None) or (e.country is not None)]
+            log.info(f"Skipping {len(parsed_batch) - len(located)} locationless events...")
+            return bulk_upload(
+                located, client=client, key=self.event_key,
+                source_id=reference_data.source_id(self.source_name, client=client))
+        # Go event-by-event:
         new_events = 0
+        updated_events = 0
         new_distances = 0
+        fingerprints = fingerprint_store()
+        source_id = reference_data.source_id(self.source_name, client=client)
+        # One range query covering the batch instead of two selects per event:
+        index = EventIndex.build(
+            client, parsed_batch, key=self.event_key, source_id=source_id)
+        stored = fingerprints.get_many(source_id, [index.event_key(event) for event in parsed_batch])
         for event in parsed_batch:
             # Check if the event already exists (event_foreign_id is not unique)
             # Skip virtual events for now as we need locations:
@@ -190,61 +238,59 @@ class AhotuIngest(Ingest):
                 continue
             event_distances = event.distances
 
-            # Query for the event distances at the same time, to avoid multiple db queries:
-            echeck = client.table("events").select("id").match(
-                {
-                    "name": event.name,
-                    "start_date": event.start_date,
-                    "city": event.city,
-                    "country": event.country
-                }
-            ).execute()
+            event_id = index.get(event)
+            if (event_id is None) and not index.covers(event):
+                # Outside the indexed window, confirm against the db before inserting:
+                echeck = client.table("events").select("id").match(
+                    {
+                        "name": event.name,
+                        "start_date": event.start_date,
+                        "city": event.city,
+                        "country": event.country
+                    }
+                ).execute()
+                if len(echeck.data):
+                    event_id = echeck.data[0]["id"]
+                    index.add(event, event_id)
 
             # If it does, then diff it, it has changes, then update
-            if not len(echeck.data):
+            fingerprint = event_fingerprint(event)
+            if event_id is None:
                 # If it does not, then insert it
                 log.info(
                     f"Event: {event.name} in {event.city}, "
                     f"{event.country} on {event.start_date} detected")
-                out = client.table("events").insert(event.todict(schema=True)).execute()
+                out = client.table("events").insert(
+                    {**event.todict(schema=True), "source_id": source_id}).execute()
+                event_id = out.data[0]["id"]
+                index.add(event, event_id)
                 new_events += 1
-                # Can we get the id of the inserted event?
-                # event_id = out.data[0]["id"]
             else:
-                # It already exists, pass for now, later check
+                # It already exists, skip it if unchanged since the last ingest:
+                if stored.get(index.event_key(event)) == fingerprint:
+                    log.info(
+                        f"Event: {event.name} in {event.city}, "
+                        f"{event.country} on {event.start_date} unchanged")
+                    continue
                 log.info(
                     f"Event: {event.name} in {event.city}, "
-                    f"{event.country} on {event.start_date} already found")
+                    f"{event.country} on {event.start_date} changed, updating")
+                client.table("events").update(
+                    {**event.todict(schema=True), "source_id": source_id}
+                ).eq("id", event_id).execute()
+                updated_events += 1
 
             # Now, the event exists, time to process the distances:
-            # First, get the event id:
-            # We should already have this... remove it later:
-            event_id_response = client.table("events").select("id").match(
-                {
-                    "name": event.name,
-                    "start_date": event.start_date,
-                    "city": event.city,
-                    "country": event.country
-                }
-            ).execute()
-            event_id = event_id_response.data[0]["id"]
-
-            # Each distance is a separate event
-            # Skip if null:
-            if event_distances is None:
-                continue
-            for event_distance in event_distances:
+            # Each distance is a separate event (none if null)
+            for event_distance in event_distances or []:
                 # Do we have this distance already?
-                dist = distance_extract(event_distance)
+                dist = distance_normalize(event_distance)
                 if dist is None:
                     log.info(f"Unable to process distance: {event_distance}")
                     continue
                 else:
                     log.info(f"Parsed distance: {event_distance}")
-                unit_id = client.table("distance_units").select("id").match({"unit_name": dist["unit"]}).execute()
-                if not len(unit_id.data):
-                    raise ValueError(f"Unknown unit: {dist['unit']}")
-                unit_id = unit_id.data[0]["id"]
+                unit_id = reference_data.unit_id(dist["unit"], client=client)
                 # Query first to see if it exists
                 distance_exists_query = client.table("event_distances").select("id").match({
                     "event_id": event_id,
@@ -264,9 +310,11 @@ class AhotuIngest(Ingest):
                     }).execute()
                     new_distances += 1
                     # Validate the insert
-            # End of event distances handling, loop has been continued
-            # to the next event so no additional handling should be done
+            # End of event distances handling, remember this version
+            # so the next ingest can skip it if unchanged:
+            fingerprints.put(source_id, index.event_key(event), event_id, fingerprint)
         # Summarize:
         log.info(f"Inserted {new_events} new events")
+        log.info(f"Updated {updated_events} changed events")
         log.info(f"Inserted {new_distances} new distances")
         return
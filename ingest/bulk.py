@@ -0,0 +1,133 @@
+import logging as log
+from typing import Dict, List, Sequence, Tuple
+
+from supabase import Client
+
+from events import Event
+from ingest.existence import normalize_key
+from ingest.fingerprint import event_fingerprint, fingerprint_store
+from ingest.ingest import InternalError
+from ingest.parser import distance_extract_many
+from ingest.refdata import reference_data
+
+# One unique index serves every source (see README). Each source's own
+# natural key is this key with the columns it leaves constant dropped:
+EVENT_KEY = ("source_id", "name", "start_date", "city", "state", "country")
+EVENT_DISTANCE_KEY = ("event_id", "distance_unit_id", "distance")
+
+
+def upsert_rows(
+        client: Client,
+        table: str,
+        rows: List[Dict],
+        on_conflict: Sequence[str],
+        ignore_duplicates: bool = False):
+    """
+    Multi-row ``INSERT ... ON CONFLICT`` in a single PostgREST call.
+
+    postgrest-py 0.10 does not expose ``on_conflict``, so it is added
+    to the query parameters directly.
+
+    :param client: Supabase client
+    :param table: Table to upsert into
+    :param rows: Rows to write, all with the same keys
+    :param on_conflict: Columns of the unique constraint to resolve on
+    :param ignore_duplicates: Skip conflicting rows instead of merging
+    :return: PostgREST response; with ``ignore_duplicates`` only the
+        inserted rows are returned.
+    """
+    query = client.table(table).upsert(rows, ignore_duplicates=ignore_duplicates)
+    query.params = query.params.set("on_conflict", ",".join(on_conflict))
+    return query.execute()
+
+
+def natural_key(event: Event, key: Sequence[str]) -> Tuple:
+    row = event.todict(schema=True)
+    return tuple(row.get(k) for k in key)
+
+
+def bulk_upload(
+        parsed_batch: List[Event],
+        client: Client,
+        key: Sequence[str],
+        source_id: int) -> None:
+    """
+    Upload a whole batch with one upsert for ``events`` and one for
+    ``event_distances``.
+
+    Requires unique constraints on ``events`` over ``EVENT_KEY`` and on
+    ``event_distances`` over ``EVENT_DISTANCE_KEY`` (see README). Since
+    ``EVENT_KEY`` includes ``source_id``, an upsert only ever merges into
+    the source's own row, as the row-wise upload's update would.
+
+    :param parsed_batch: Events to upload
+    :param client: Supabase client
+    :param key: Natural key columns of the source's events
+    :param source_id: The source's id, overriding the one set at parse time
+    """
+    # Postgres rejects an upsert that touches the same row twice,
+    # so collapse duplicates within the batch first (last one wins):
+    rows = {}
+    distances = {}
+    prints = {}
+    for event in parsed_batch:
+        k = natural_key(event, key)
+        rows[k] = {**event.todict(schema=True), "source_id": source_id}
+        distances.setdefault(k, []).extend(event.distances or [])
+        prints[k] = event_fingerprint(event)
+
+    # Drop events unchanged since their last ingest:
+    fingerprints = fingerprint_store()
+    stored = fingerprints.get_many(source_id, [normalize_key(row, key) for row in rows.values()])
+    for k in list(rows):
+        if stored.get(normalize_key(rows[k], key)) == prints[k]:
+            del rows[k], distances[k]
+    log.info(f"Skipping {len(prints) - len(rows)} unchanged events")
+    if not rows:
+        log.info("Nothing to upload")
+        return
+
+    # Merging duplicates returns every row, new or existing, but not
+    # necessarily in input order, so match them up on the key. Dates come
+    # back as ISO, hence the normalized keys:
+    out = upsert_rows(client, "events", list(rows.values()), on_conflict=EVENT_KEY)
+    keys = {normalize_key(row, key): k for k, row in rows.items()}
+    event_ids = {}
+    for row in out.data:
+        k = keys.get(normalize_key(row, key))
+        if k is not None:
+            event_ids[k] = row["id"]
+    if len(event_ids) != len(rows):
+        raise InternalError(
+            f"Upserted {len(rows)} events but matched {len(event_ids)} returned ids")
+
+    distance_rows = {}
+    for k, event_distances in distances.items():
+        for event_distance, dist in zip(event_distances, distance_extract_many(event_distances)):
+            if dist is None:
+                log.info(f"Unable to process distance: {event_distance}")
+                continue
+            row = {
+                "event_id": event_ids[k],
+                "distance": dist["length"],
+                "distance_unit_id": reference_data.unit_id(dist["unit"], client=client),
+                "is_relay": False,
+                "is_multiday": False,
+                "is_virtual": False
+            }
+            distance_rows[tuple(row[c] for c in EVENT_DISTANCE_KEY)] = row
+
+    new_distances = 0
+    if distance_rows:
+        out = upsert_rows(
+            client, "event_distances", list(distance_rows.values()),
+            on_conflict=EVENT_DISTANCE_KEY, ignore_duplicates=True)
+        new_distances = len(out.data)
+
+    fingerprints.put_many(source_id, [
+        (normalize_key(rows[k], key), event_ids[k], prints[k]) for k in rows])
+
+    # Summarize:
+    log.info(f"Upserted {len(rows)} events")
+    log.info(f"Inserted {new_distances} new distances")
+    return
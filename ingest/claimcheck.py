@@ -0,0 +1,197 @@
+import json
+import logging as log
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+import redis
+
+from codec import packb, unpackb
+from ingest.store import get_redis
+
+# Where large payloads go instead of the broker: "off", "redis" or "file":
+CLAIM_CHECK = os.getenv("CLAIM_CHECK", "off").lower()
+CLAIM_CHECK_DIR = os.getenv("CLAIM_CHECK_DIR", "/tmp/ultrasearch/claims")
+# Packed payloads at least this many bytes are checked in:
+CLAIM_CHECK_THRESHOLD = int(os.getenv("CLAIM_CHECK_THRESHOLD", 64 * 1024))
+# Seconds to keep a payload nobody released, e.g. from a failed chain:
+CLAIM_CHECK_TTL = int(os.getenv("CLAIM_CHECK_TTL", 24 * 3600))
+
+CLAIM_KEY = "__claim__"
+# Safety factor on approx_size(), for lists whose sample is unrepresentative:
+SIZE_MARGIN = 2
+
+
+class ClaimStore(ABC):
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        pass
+
+    @abstractmethod
+    def get(self, claim_id: str) -> bytes:
+        pass
+
+    @abstractmethod
+    def delete(self, claim_id: str) -> None:
+        pass
+
+
+class RedisClaimStore(ClaimStore):
+
+    def __init__(self, client: redis.Redis, ttl: int = CLAIM_CHECK_TTL):
+        self.client = client
+        self.ttl = ttl
+
+    def put(self, data: bytes) -> str:
+        claim_id = uuid.uuid4().hex
+        self.client.set(f"claim:{claim_id}", data, ex=self.ttl)
+        return claim_id
+
+    def get(self, claim_id: str) -> bytes:
+        data = self.client.get(f"claim:{claim_id}")
+        if data is None:
+            raise KeyError(f"Claim {claim_id} not found (expired or released)")
+        return data
+
+    def delete(self, claim_id: str) -> None:
+        self.client.delete(f"claim:{claim_id}")
+
+
+class FileClaimStore(ClaimStore):
+    """
+    Payloads as files in a directory shared by all workers. Files older
+    than ``ttl`` are swept on put, at most once per ``ttl / 10`` seconds.
+    """
+
+    def __init__(self, path: str = CLAIM_CHECK_DIR, ttl: int = CLAIM_CHECK_TTL):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self._last_sweep = 0.0
+
+    def _file(self, claim_id: str) -> str:
+        return os.path.join(self.path, f"{claim_id}.claim")
+
+    def put(self, data: bytes) -> str:
+        now = time.time()
+        if now - self._last_sweep > self.ttl / 10:
+            self._last_sweep = now
+            self.sweep()
+        claim_id = uuid.uuid4().hex
+        tmp = self._file(claim_id) + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        # Readers never see a partly written payload:
+        os.replace(tmp, self._file(claim_id))
+        return claim_id
+
+    def get(self, claim_id: str) -> bytes:
+        try:
+            with open(self._file(claim_id), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise KeyError(f"Claim {claim_id} not found (expired or released)")
+
+    def delete(self, claim_id: str) -> None:
+        try:
+            os.remove(self._file(claim_id))
+        except FileNotFoundError:
+            pass
+
+    def sweep(self) -> int:
+        """ Remove expired payloads, returning how many were removed. """
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for entry in os.scandir(self.path):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                # Released by another worker meanwhile
+                pass
+        if removed:
+            log.info(f"Removed {removed} expired claim check payloads")
+        return removed
+
+
+_store: Optional[ClaimStore] = None
+
+
+def claim_store() -> Optional[ClaimStore]:
+    """ Per-process store for ``CLAIM_CHECK``, or None when it is off. """
+    global _store
+    if CLAIM_CHECK == "off":
+        return None
+    if _store is None:
+        if CLAIM_CHECK == "redis":
+            _store = RedisClaimStore(get_redis())
+        elif CLAIM_CHECK == "file":
+            _store = FileClaimStore()
+        else:
+            raise ValueError(f"Unknown CLAIM_CHECK mode: {CLAIM_CHECK}")
+    return _store
+
+
+def is_claim(payload: Any) -> bool:
+    return isinstance(payload, dict) and CLAIM_KEY in payload
+
+
+def approx_size(payload: Any, sample: int = 16) -> int:
+    """
+    Rough size of a payload's JSON, from a sample of its items when it
+    is a list, rather than encoding all of it.
+    """
+    if isinstance(payload, (str, bytes)):
+        return len(payload)
+    if isinstance(payload, list) and len(payload) > sample:
+        step = len(payload) / sample
+        items = [payload[int(i * step)] for i in range(sample)]
+        return len(json.dumps(items, default=str)) * len(payload) // sample
+    return len(json.dumps(payload, default=str))
+
+
+def check_in(payload: Any, store: Optional[ClaimStore] = None,
+             threshold: int = CLAIM_CHECK_THRESHOLD) -> Any:
+    """
+    Swap a large payload for a reference to a copy in the store.
+
+    :param payload: A task result to pass to the next stage
+    :param store: Defaults to ``claim_store()``; payloads pass through
+        unchanged when there is none
+    :param threshold: Smallest packed size, in bytes, to check in
+    :return: The payload, or ``{"__claim__": id}``
+    """
+    store = store if store is not None else claim_store()
+    if (store is None) or (payload is None):
+        return payload
+    if approx_size(payload) * SIZE_MARGIN < threshold:
+        # Packing never makes a payload bigger than its JSON (but for the
+        # header), so most payloads skip it entirely:
+        return payload
+    data = packb(payload)
+    if len(data) < threshold:
+        return payload
+    return {CLAIM_KEY: store.put(data)}
+
+
+def check_out(payload: Any, store: Optional[ClaimStore] = None) -> Any:
+    """ The original payload for a reference; anything else is returned as is. """
+    if not is_claim(payload):
+        return payload
+    store = store if store is not None else claim_store()
+    if store is None:
+        raise ValueError("Received a claim check reference, but CLAIM_CHECK is off")
+    return unpackb(store.get(payload[CLAIM_KEY]))
+
+
+def release(payload: Any, store: Optional[ClaimStore] = None) -> None:
+    """ Delete a checked-in payload once its consumer has succeeded. """
+    if not is_claim(payload):
+        return
+    store = store if store is not None else claim_store()
+    if store is not None:
+        store.delete(payload[CLAIM_KEY])
@@ -0,0 +1,113 @@
+import logging as log
+import os
+from typing import Dict, List, Optional, Tuple
+
+import redis
+
+from codec import packb, unpackb
+
+# Buffer parsed pages per source and upload them together:
+COALESCE_UPLOADS = os.getenv("COALESCE_UPLOADS", "false").lower() == "true"
+# Flush once this many events are buffered...
+COALESCE_SIZE = int(os.getenv("COALESCE_SIZE", 500))
+# ...or this many seconds after the first page arrived:
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", 30))
+# Seconds a claimed buffer is kept for its flush's retries, after which
+# it is dropped even if the flush task was lost:
+COALESCE_CLAIM_TTL = int(os.getenv("COALESCE_CLAIM_TTL", 24 * 3600))
+
+# Moves the buffer aside for one flush. A retried flush (same id) gets the
+# same pages back, while pages arriving meanwhile start a new buffer.
+CLAIM_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        redis.call('RENAME', KEYS[1], KEYS[2])
+        redis.call('EXPIRE', KEYS[2], ARGV[1])
+    end
+    redis.call('DEL', KEYS[3], KEYS[4])
+end
+return redis.call('LRANGE', KEYS[2], 0, -1)
+"""
+
+# Puts a claimed buffer back at the head of the buffer, in order, for the
+# next flush. ARGV[1] is its number of events.
+REQUEUE_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[2], 0, -1)
+for i = #items, 1, -1 do
+    redis.call('LPUSH', KEYS[1], items[i])
+end
+if #items > 0 then
+    redis.call('INCRBY', KEYS[3], ARGV[1])
+end
+redis.call('DEL', KEYS[2])
+return #items
+"""
+
+
+class Coalescer:
+    """
+    Redis-backed FIFO buffer of parsed pages for one source.
+
+    :param source: Source name, e.g. "ahotu"
+    :param client: Redis client shared by all upload workers
+    :param window: Seconds before a flush is due, used for the timer key
+    """
+
+    def __init__(self, source: str, client: redis.Redis, window: float = COALESCE_WINDOW):
+        self.source = source
+        self.client = client
+        self.window = window
+        # Hash tag, so all of a source's keys share a cluster slot:
+        prefix = f"coalesce:{{{source}}}"
+        self.buffer_key = f"{prefix}:buffer"
+        self.count_key = f"{prefix}:count"
+        self.timer_key = f"{prefix}:timer"
+        self.processing_prefix = f"{prefix}:processing"
+        self._claim = client.register_script(CLAIM_SCRIPT)
+        self._requeue = client.register_script(REQUEUE_SCRIPT)
+
+    def add(self, rows: List[Dict], fetch_key: Optional[str] = None) -> Tuple[int, bool]:
+        """
+        Append a parsed page.
+
+        :return: Events now buffered, and whether this page started the
+            window, i.e. the caller should schedule the timed flush
+        """
+        pipe = self.client.pipeline()
+        pipe.rpush(self.buffer_key, packb({"rows": rows, "fetch_key": fetch_key}))
+        pipe.incrby(self.count_key, len(rows))
+        # Outlives the window, so a lost flush task is eventually re-scheduled:
+        pipe.set(self.timer_key, 1, nx=True, ex=max(1, int(2 * self.window)))
+        _, buffered, timer_started = pipe.execute()
+        return buffered, bool(timer_started)
+
+    def claim(self, flush_id: str) -> List[Dict]:
+        """ Pages to flush, oldest first, under ``flush_id``. """
+        processing_key = f"{self.processing_prefix}:{flush_id}"
+        items = self._claim(
+            keys=[self.buffer_key, processing_key, self.count_key, self.timer_key],
+            args=[COALESCE_CLAIM_TTL])
+        return [unpackb(item) for item in items]
+
+    def done(self, flush_id: str) -> None:
+        self.client.delete(f"{self.processing_prefix}:{flush_id}")
+
+    def requeue(self, flush_id: str, events: int) -> int:
+        """
+        Return the pages claimed under ``flush_id`` to the buffer, ahead
+        of any added since, e.g. when their flush has failed for good.
+
+        :param events: Events in those pages, to add back to the count
+        :return: Pages requeued
+        """
+        return self._requeue(
+            keys=[self.buffer_key, f"{self.processing_prefix}:{flush_id}", self.count_key],
+            args=[events])
+
+
+def combine(items: List[Dict]) -> Tuple[List[Dict], List[str]]:
+    """ All rows of the claimed pages in arrival order, and their fetch keys. """
+    rows = [row for item in items for row in item["rows"]]
+    fetch_keys = [item["fetch_key"] for item in items if item["fetch_key"] is not None]
+    log.info(f"Coalesced {len(items)} pages into one upload of {len(rows)} events")
+    return rows, fetch_keys
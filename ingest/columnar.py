@@ -0,0 +1,65 @@
+from typing import Callable, Dict, List, Tuple
+
+import pandas as pd
+
+from events import EventList
+from ingest.parser import distance_parser, identity
+
+# Column-at-a-time versions of the per-field parsers, keyed by the
+# per-field function. Fields without one fall back to Series.map().
+VECTORIZED: Dict[Callable, Callable[[pd.Series], pd.Series]] = {
+    identity: lambda x: x,
+    # Missing distances give an empty list, as distance_parser does:
+    distance_parser: lambda x: x.str.strip().str.split(r"\s*,\s*", regex=True).map(
+        lambda v: v if isinstance(v, list) else [])
+}
+
+
+def register_vectorized(fn: Callable, vectorized_fn: Callable[[pd.Series], pd.Series]) -> None:
+    VECTORIZED[fn] = vectorized_fn
+
+
+def to_objects(x: pd.Series) -> List:
+    """ Series to a list of Python objects, with NaN as None. """
+    return x.astype(object).where(x.notna(), None).tolist()
+
+
+def validate_coordinate(x: pd.Series, bound: float) -> pd.Series:
+    # Same wrap-around as Event.__init__, for the whole column at once:
+    x = pd.to_numeric(x, errors="coerce")
+    return x.where(x.between(-bound, bound) | x.isna(), x % bound)
+
+
+def parse_frame(
+        batch: List[Dict],
+        schema_mapping: Dict[str, Tuple],
+        unmapped_defaults: Dict) -> EventList:
+    """
+    Parse a whole fetched batch with column operations.
+
+    :param batch: Raw events, as returned by the fetch stage
+    :param schema_mapping: ``{field: (source_key, fn)}``, as used by the
+        row-wise parsers
+    :param unmapped_defaults: Values for fields with no ``source_key``
+    :return: A column-wise ``EventList``
+    """
+    if not len(batch):
+        return EventList([])
+    # Keep Python objects, so e.g. ids with gaps are not cast to float:
+    df = pd.DataFrame(batch, dtype=object)
+    n = len(df)
+    columns = {}
+    for key, (source_key, fn) in schema_mapping.items():
+        if source_key is None:
+            # Not a mapped field:
+            columns[key] = [unmapped_defaults[key]] * n
+            continue
+        series = df[source_key]
+        vectorized_fn = VECTORIZED.get(fn)
+        series = vectorized_fn(series) if vectorized_fn is not None else series.map(fn)
+        if key == "latitude":
+            series = validate_coordinate(series, 90)
+        elif key == "longitude":
+            series = validate_coordinate(series, 180)
+        columns[key] = to_objects(series)
+    return EventList.from_columns(columns)
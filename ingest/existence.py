@@ -0,0 +1,161 @@
+import logging as log
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from supabase import Client
+
+from events import Event
+
+# Max rows PostgREST returns per request (Supabase default):
+PAGE_SIZE = 1000
+# Max keys remembered per worker process across batches:
+EVENT_INDEX_SIZE = int(os.getenv("EVENT_INDEX_SIZE", 100000))
+
+rdate_iso = re.compile(r"^(\d{4})-(\d{2})-(\d{2})")
+rdate_us = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})")
+
+
+def normalize_date(x) -> Optional[str]:
+    """
+    Normalize a start date to ``YYYY-MM-DD``, as returned by the database.
+
+    :param x: ISO date/datetime or ``M/D/YYYY`` string
+    :return: The ISO date, or None if the format is not recognized
+    """
+    if not isinstance(x, str):
+        return None
+    m = rdate_iso.match(x)
+    if m:
+        return m.group(0)
+    m = rdate_us.match(x)
+    if m:
+        return f"{m.group(3)}-{int(m.group(1)):02d}-{int(m.group(2)):02d}"
+    return None
+
+
+def normalize_key(row: Dict, key: Sequence[str]) -> Optional[Tuple]:
+    values = []
+    for k in key:
+        value = row.get(k)
+        if k == "start_date":
+            value = normalize_date(value)
+            if value is None:
+                return None
+        values.append(value)
+    return tuple(values)
+
+
+class KnownEvents:
+    """ Bounded LRU of natural keys to event ids, shared by a worker process. """
+
+    def __init__(self, maxsize: int = EVENT_INDEX_SIZE):
+        self.maxsize = maxsize
+        self._ids: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[int]:
+        with self._lock:
+            event_id = self._ids.get(key)
+            if event_id is not None:
+                self._ids.move_to_end(key)
+            return event_id
+
+    def add(self, key: Tuple, event_id: int) -> None:
+        with self._lock:
+            self._ids[key] = event_id
+            self._ids.move_to_end(key)
+            while len(self._ids) > self.maxsize:
+                self._ids.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids.clear()
+
+
+known_events = KnownEvents()
+
+
+class EventIndex:
+    """
+    Existing-event lookup for one upload batch.
+
+    Built with a single paged range query over the batch's date window
+    and source, so per-event existence checks become dict lookups. A miss
+    is authoritative when ``covers`` the event; otherwise, e.g. for a key
+    that fails to normalize, callers should fall back to the database.
+    """
+
+    def __init__(self, key: Sequence[str], source_id: int, known: KnownEvents = known_events):
+        self.key = tuple(key)
+        self.source_id = source_id
+        self.known = known
+        self.ids: Dict[Tuple, int] = {}
+        # Start dates queried in full, as ``(first, last)``:
+        self.window: Optional[Tuple[str, str]] = None
+
+    @classmethod
+    def build(
+            cls,
+            client: Client,
+            parsed_batch: List[Event],
+            key: Sequence[str],
+            source_id: int,
+            known: KnownEvents = known_events) -> "EventIndex":
+        index = cls(key, source_id=source_id, known=known)
+        keys = {index.event_key(event) for event in parsed_batch} - {None}
+        if not keys:
+            return index
+
+        # Skip the query entirely if this worker has seen every event:
+        for k in keys:
+            event_id = known.get((source_id,) + k)
+            if event_id is not None:
+                index.ids[k] = event_id
+        if len(index.ids) == len(keys):
+            return index
+
+        dates = [k[index.key.index("start_date")] for k in keys]
+        columns = ",".join(("id",) + index.key)
+        start = 0
+        while True:
+            out = client.table("events").select(columns) \
+                .eq("source_id", source_id) \
+                .gte("start_date", min(dates)) \
+                .lte("start_date", max(dates)) \
+                .order("id") \
+                .range(start, start + PAGE_SIZE - 1) \
+                .execute()
+            for row in out.data:
+                k = normalize_key(row, index.key)
+                if k is not None:
+                    index.ids[k] = row["id"]
+                    known.add((source_id,) + k, row["id"])
+            if len(out.data) < PAGE_SIZE:
+                break
+            start += PAGE_SIZE
+        index.window = (min(dates), max(dates))
+        log.info(f"Indexed {len(index.ids)} existing events")
+        return index
+
+    def event_key(self, event: Event) -> Optional[Tuple]:
+        return normalize_key(event.todict(schema=True), self.key)
+
+    def covers(self, event: Event) -> bool:
+        """ Whether the index was built over all the source's events with this event's date. """
+        k = self.event_key(event)
+        if (k is None) or (self.window is None):
+            return False
+        return self.window[0] <= k[self.key.index("start_date")] <= self.window[1]
+
+    def get(self, event: Event) -> Optional[int]:
+        k = self.event_key(event)
+        return self.ids.get(k) if k is not None else None
+
+    def add(self, event: Event, event_id: int) -> None:
+        k = self.event_key(event)
+        if k is not None:
+            self.ids[k] = event_id
+            self.known.add((self.source_id,) + k, event_id)
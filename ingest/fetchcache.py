@@ -0,0 +1,103 @@
+import hashlib
+import json
+import logging as log
+import os
+from typing import Dict, Optional
+
+import httpx
+import redis
+
+# Seconds to remember an uploaded page:
+FETCH_CACHE_TTL = int(os.getenv("FETCH_CACHE_TTL", 90 * 24 * 3600))
+# Seconds a fetched page waits for its upload to succeed:
+PENDING_TTL = 24 * 3600
+# Seconds to keep per-run counters:
+STATS_TTL = 7 * 24 * 3600
+
+
+def fetch_key(url: str, params: Dict) -> str:
+    """ Stable cache key for a request, independent of param order. """
+    raw = url + "?" + json.dumps(params, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class FetchCache:
+    """
+    Remembers, per request, the ``ETag``/``Last-Modified`` validators and a
+    hash of the response body from the last successfully uploaded fetch.
+
+    A fetch stores its fingerprint as pending; the uploader commits it
+    once the page is in the database, so a page whose upload failed is
+    never treated as unchanged.
+    """
+
+    def __init__(self, client: redis.Redis, ttl: int = FETCH_CACHE_TTL):
+        self.client = client
+        self.ttl = ttl
+
+    def _load(self, name: str) -> Dict:
+        return {k.decode(): v.decode() for k, v in self.client.hgetall(name).items()}
+
+    def fetch(self, url: str, params: Dict) -> Optional[Dict]:
+        """
+        Conditionally fetch a page.
+
+        :return: The decoded JSON body, or None if the page is unchanged
+            since its last upload.
+        """
+        key = fetch_key(url, params)
+        seen = self._load(f"fetchcache:{key}")
+        headers = {}
+        if "etag" in seen:
+            headers["If-None-Match"] = seen["etag"]
+        if "last_modified" in seen:
+            headers["If-Modified-Since"] = seen["last_modified"]
+
+        response = httpx.get(url, params=params, headers=headers)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        digest = hashlib.sha256(response.content).hexdigest()
+        if seen.get("hash") == digest:
+            return None
+
+        fingerprint = {"hash": digest}
+        if response.headers.get("etag"):
+            fingerprint["etag"] = response.headers["etag"]
+        if response.headers.get("last-modified"):
+            fingerprint["last_modified"] = response.headers["last-modified"]
+        pipe = self.client.pipeline()
+        pipe.delete(f"fetchcache:pending:{key}")
+        pipe.hset(f"fetchcache:pending:{key}", mapping=fingerprint)
+        pipe.expire(f"fetchcache:pending:{key}", PENDING_TTL)
+        pipe.execute()
+        return response.json()
+
+    def commit(self, key: str) -> None:
+        """ Mark the pending fetch for ``key`` as uploaded. """
+        try:
+            self.client.rename(f"fetchcache:pending:{key}", f"fetchcache:{key}")
+            self.client.expire(f"fetchcache:{key}", self.ttl)
+        except redis.ResponseError:
+            # Nothing pending, e.g. fetched with the cache disabled
+            pass
+
+    def record(self, run_id: str, hit: bool) -> Dict:
+        name = f"fetchcache:run:{run_id}"
+        pipe = self.client.pipeline()
+        pipe.hincrby(name, "hits" if hit else "misses", 1)
+        pipe.expire(name, STATS_TTL)
+        pipe.execute()
+        return self.stats(run_id)
+
+    def stats(self, run_id: str) -> Dict:
+        counts = {k: int(v) for k, v in self._load(f"fetchcache:run:{run_id}").items()}
+        hits, misses = counts.get("hits", 0), counts.get("misses", 0)
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
+
+
+def log_stats(run_id: str, stats: Dict) -> None:
+    log.info(
+        f"Fetch cache for run {run_id}: {stats['hits']} unchanged, "
+        f"{stats['misses']} changed ({stats['hit_rate']:.1%} hit rate)")
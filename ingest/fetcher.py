@@ -0,0 +1,129 @@
+import asyncio
+import logging as log
+import os
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Iterable, List, NamedTuple, Optional
+
+import httpx
+
+from ingest.ratelimit import RateLimiter
+from ingest.ultrarequest import UltraRequest
+
+# Max requests in flight per host:
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", 4))
+# Min seconds between request starts per host, the same politeness as the
+# sync fetches' 5s sleep:
+FETCH_INTERVAL = float(os.getenv("FETCH_INTERVAL", 5.0))
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", 30.0))
+
+
+class FetchResult(NamedTuple):
+    request: UltraRequest
+    batch: Optional[List[Dict]]
+    error: Optional[Exception]
+
+
+class HostScheduler:
+    """
+    Spaces request starts to the same host at least ``interval`` seconds
+    apart, without holding a connection or a worker while waiting.
+    """
+
+    def __init__(self, interval: float = FETCH_INTERVAL):
+        self.interval = interval
+        self._next_start: Dict[str, float] = defaultdict(float)
+
+    async def wait(self, host: str) -> None:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        # Reserve the next slot before awaiting, so concurrent
+        # callers queue up behind each other:
+        start = max(now, self._next_start[host])
+        self._next_start[host] = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+class AsyncFetcher:
+    """
+    Drives many ``UltraRequest`` objects concurrently over one pooled,
+    keep-alive ``httpx.AsyncClient``, with a per-host cap on requests in
+    flight and per-host politeness handled by ``HostScheduler``.
+
+    :param limiter: The source's shared ``RateLimiter``, e.g.
+        ``get_limiter("ahotu")``. Each request reserves a token from it
+        instead of using the ``interval`` spacing, so the fetches count
+        against the same limit as fetch tasks and stream mode.
+    :param transport: For tests, e.g. an ``httpx.MockTransport``
+    """
+
+    def __init__(
+            self,
+            concurrency: int = FETCH_CONCURRENCY,
+            interval: float = FETCH_INTERVAL,
+            timeout: float = FETCH_TIMEOUT,
+            limiter: Optional[RateLimiter] = None,
+            transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.concurrency = concurrency
+        self.scheduler = HostScheduler(interval)
+        self.timeout = timeout
+        self.limiter = limiter
+        self.transport = transport
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=self.concurrency * 4,
+            max_keepalive_connections=self.concurrency * 4)
+        return httpx.AsyncClient(limits=limits, timeout=self.timeout, transport=self.transport)
+
+    async def _wait_for_turn(self, host: str) -> None:
+        if self.limiter is None:
+            await self.scheduler.wait(host)
+            return
+        # The Redis bucket is a blocking call, so keep it off the event loop:
+        wait = await asyncio.to_thread(self.limiter.reserve, horizon=None)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def _semaphore(self, host: str) -> asyncio.Semaphore:
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.concurrency)
+        return self._semaphores[host]
+
+    async def fetch_one(self, client: httpx.AsyncClient, request: UltraRequest) -> FetchResult:
+        if request.payload is not None:
+            # Fetched while planning:
+            return FetchResult(request, request.process(request.payload), None)
+        host = httpx.URL(request.url).host
+        async with self._semaphore(host):
+            await self._wait_for_turn(host)
+            try:
+                response = await client.get(request.url, params=request.params)
+                response.raise_for_status()
+                return FetchResult(request, request.process(response.json()), None)
+            except Exception as e:
+                log.warning(f"Failed to fetch {request.url} with {request.params}: {e}")
+                return FetchResult(request, None, e)
+
+    async def stream(self, requests: Iterable[UltraRequest]) -> AsyncIterator[FetchResult]:
+        """
+        Fetch all requests, yielding results as they complete.
+
+        :param requests: Requests as returned by ``Ingest.fetch()``
+        :return: Async iterator of ``FetchResult``, in completion order
+        """
+        self._semaphores = {}
+        async with self._client() as client:
+            tasks = [asyncio.ensure_future(self.fetch_one(client, r)) for r in requests]
+            for task in asyncio.as_completed(tasks):
+                yield await task
+
+    async def gather(self, requests: Iterable[UltraRequest]) -> List[FetchResult]:
+        self._semaphores = {}
+        async with self._client() as client:
+            return await asyncio.gather(*[self.fetch_one(client, r) for r in requests])
+
+    def fetch_all(self, requests: Iterable[UltraRequest]) -> List[FetchResult]:
+        """ Blocking helper, results are returned in request order. """
+        return asyncio.run(self.gather(requests))
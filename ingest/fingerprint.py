@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from events import Event
+from ingest.store import get_redis, redis_configured
+
+# Where fingerprints live: "redis", shared by all workers and kept across
+# restarts, or "sqlite" at FINGERPRINT_DB, for single-machine runs. By
+# default, Redis when it is configured and SQLite otherwise:
+FINGERPRINT_STORE = os.getenv("FINGERPRINT_STORE", "").lower()
+FINGERPRINT_DB = os.getenv(
+    "FINGERPRINT_DB", os.path.expanduser("~/.ultrasearch/fingerprints.db"))
+# Keys per SQLite query, under its default variable limit:
+SQLITE_BATCH = 500
+
+
+def event_fingerprint(event: Event) -> str:
+    """
+    Stable hash of an event's public columns and distances, used to tell
+    whether an event changed since it was last ingested.
+    """
+    distances = sorted(
+        json.dumps(d, sort_keys=True) for d in (event.distances or []))
+    raw = json.dumps([event.todict(schema=True), distances], sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class FingerprintStore(ABC):
+    """
+    Map of ``(source_id, natural key)`` to the event id and fingerprint of
+    the last ingested version of each event.
+    """
+
+    @abstractmethod
+    def get_many(self, source_id: int, keys: Iterable[Tuple]) -> Dict[Tuple, str]:
+        pass
+
+    @abstractmethod
+    def put_many(self, source_id: int, rows: Iterable[Tuple[Optional[Tuple], int, str]]) -> None:
+        pass
+
+    def get(self, source_id: int, key: Optional[Tuple]) -> Optional[str]:
+        if key is None:
+            return None
+        return self.get_many(source_id, [key]).get(key)
+
+    def put(self, source_id: int, key: Optional[Tuple], event_id: int, fingerprint: str) -> None:
+        self.put_many(source_id, [(key, event_id, fingerprint)])
+
+
+class SQLiteFingerprintStore(FingerprintStore):
+    """ For runs on one machine; a pod's file is lost when it restarts. """
+
+    def __init__(self, path: str = FINGERPRINT_DB):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # Several worker processes may share the file:
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            "source_id INTEGER, event_key TEXT, event_id INTEGER, fingerprint TEXT, "
+            "PRIMARY KEY (source_id, event_key))")
+        self._conn.commit()
+
+    def get_many(self, source_id: int, keys: Iterable[Tuple]) -> Dict[Tuple, str]:
+        by_json = {json.dumps(key): key for key in keys if key is not None}
+        names = list(by_json)
+        out = {}
+        with self._lock:
+            for i in range(0, len(names), SQLITE_BATCH):
+                chunk = names[i:i + SQLITE_BATCH]
+                rows = self._conn.execute(
+                    "SELECT event_key, fingerprint FROM fingerprints WHERE source_id = ? "
+                    f"AND event_key IN ({','.join('?' * len(chunk))})",
+                    [source_id] + chunk).fetchall()
+                out.update({by_json[name]: fingerprint for name, fingerprint in rows})
+        return out
+
+    def put_many(self, source_id: int, rows: Iterable[Tuple[Optional[Tuple], int, str]]) -> None:
+        rows = [
+            (source_id, json.dumps(key), event_id, fingerprint)
+            for key, event_id, fingerprint in rows if key is not None]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+
+class RedisFingerprintStore(FingerprintStore):
+    """ One hash per source, of the JSON key to ``[event_id, fingerprint]``. """
+
+    def __init__(self, client):
+        self.client = client
+
+    def get_many(self, source_id: int, keys: Iterable[Tuple]) -> Dict[Tuple, str]:
+        keys: List[Tuple] = [key for key in keys if key is not None]
+        if not keys:
+            return {}
+        values = self.client.hmget(f"fingerprints:{source_id}", [json.dumps(key) for key in keys])
+        return {key: json.loads(value)[1] for key, value in zip(keys, values) if value is not None}
+
+    def put_many(self, source_id: int, rows: Iterable[Tuple[Optional[Tuple], int, str]]) -> None:
+        mapping = {
+            json.dumps(key): json.dumps([event_id, fingerprint])
+            for key, event_id, fingerprint in rows if key is not None}
+        if mapping:
+            self.client.hset(f"fingerprints:{source_id}", mapping=mapping)
+
+
+_store: Optional[FingerprintStore] = None
+
+
+def fingerprint_store() -> FingerprintStore:
+    """ Per-process store for ``FINGERPRINT_STORE``, opened on first use. """
+    global _store
+    if _store is None:
+        kind = FINGERPRINT_STORE or ("redis" if redis_configured() else "sqlite")
+        if kind == "redis":
+            _store = RedisFingerprintStore(get_redis())
+        elif kind == "sqlite":
+            _store = SQLiteFingerprintStore(FINGERPRINT_DB)
+        else:
+            raise ValueError(f"Unknown FINGERPRINT_STORE: {FINGERPRINT_STORE}")
+    return _store
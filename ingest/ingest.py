@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 import logging as log
-from typing import List, Dict
+from typing import Dict, Iterator, List, Tuple
 
 from supabase import Client
 
@@ -16,14 +16,26 @@ class InternalError(Exception):
 
 class Ingest(ABC):
 
+    # Name in the ``sources`` table:
+    source_name: str
+
+    # Columns identifying an event within this source, used to deduplicate
+    # a batch and match its rows to existing events. Bulk uploads resolve
+    # conflicts on ``bulk.EVENT_KEY`` instead:
+    event_key: Tuple[str, ...] = ("name", "start_date", "city", "state")
+
     @abstractmethod
     def fetch(self) -> List[UltraRequest]:
         pass
 
+    def iter_requests(self) -> Iterator[UltraRequest]:
+        """ Requests as they are planned, for sources that can stream them. """
+        yield from self.fetch()
+
     @abstractmethod
-    def parse(self, batch: List[Dict]) -> List[Event]:
+    def parse(self, batch: List[Dict], columnar: bool = False) -> List[Event]:
         pass
 
     @abstractmethod
-    def upload(self, parsed_batch: List[Event], client: Client) -> None:
+    def upload(self, parsed_batch: List[Event], client: Client, bulk: bool = False) -> None:
         pass
@@ -0,0 +1,69 @@
+from operator import itemgetter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from events import Event, EventList
+from ingest.columnar import parse_frame
+from ingest.parser import identity
+
+# ``{field: (source_key, fn)}``, with a None source_key for fields
+# taken from the defaults instead:
+SchemaMapping = Dict[str, Tuple[Optional[str], Callable]]
+
+
+class SourceMapping:
+    """
+    Declarative mapping from a source's raw events to ``Event`` fields,
+    compiled once into a row transformer. Create one per source at module
+    level, so each process compiles it once.
+
+    :param schema_mapping: ``{field: (source_key, fn)}``
+    :param unmapped_defaults: Values for fields with no ``source_key``
+    """
+
+    def __init__(self, schema_mapping: SchemaMapping, unmapped_defaults: Dict):
+        self.schema_mapping = schema_mapping
+        self.unmapped_defaults = unmapped_defaults
+        self.transform = self._compile()
+
+    def _compile(self) -> Callable[[Dict], Dict]:
+        constants = {
+            key: self.unmapped_defaults[key]
+            for key, (source_key, _) in self.schema_mapping.items() if source_key is None}
+        mapped = [
+            (key, source_key, fn)
+            for key, (source_key, fn) in self.schema_mapping.items() if source_key is not None]
+        keys = tuple(key for key, _, _ in mapped)
+        source_keys = [source_key for _, source_key, _ in mapped]
+        if len(source_keys) > 1:
+            # One C-level lookup for all source keys:
+            get = itemgetter(*source_keys)
+        elif source_keys:
+            get_one = itemgetter(source_keys[0])
+
+            def get(event):
+                return (get_one(event),)
+        else:
+            def get(event):
+                return ()
+        converters = [(i, fn) for i, (_, _, fn) in enumerate(mapped) if fn is not identity]
+
+        if not converters:
+            def transform(event: Dict) -> Dict:
+                out = dict(zip(keys, get(event)))
+                out.update(constants)
+                return out
+        else:
+            def transform(event: Dict) -> Dict:
+                values = list(get(event))
+                for i, fn in converters:
+                    values[i] = fn(values[i])
+                out = dict(zip(keys, values))
+                out.update(constants)
+                return out
+        return transform
+
+    def parse(self, batch: List[Dict], columnar: bool = False) -> EventList:
+        if columnar:
+            return parse_frame(batch, self.schema_mapping, self.unmapped_defaults)
+        transform = self.transform
+        return EventList([Event(**transform(event)) for event in batch])
@@ -1,8 +1,34 @@
-from typing import List, Optional, TypedDict
+from functools import lru_cache
+from typing import Iterable, List, Optional, Tuple, TypedDict, Union
+import os
 import re
 
 rcl = re.compile(r"(?:\d+(?:\.\d*)?|\.\d+)")
 rcu = re.compile(r"\D+")
+# Common case in one pass: a single number followed by a unit, e.g. "50k"
+# or "100 miler". Anything else falls back to the rcl/rcu scan:
+rdistance = re.compile(r"^(?P<length>\d+(?:\.\d+)?|\.\d+)(?P<unit>[^\d.]\D*)$")
+
+# Distinct distance strings are few, so cache the parsed result:
+DISTANCE_CACHE_SIZE = int(os.getenv("DISTANCE_CACHE_SIZE", 4096))
+
+UNITS = {
+    **{x: "mile" for x in ["miler", "mile", "m", "mi", "miles", "m run", "mile run"]},
+    **{x: "km" for x in ["k", "km", "kms", "kilometers", "kilometer", "k run", "km run"]},
+    **{x: "hour" for x in ["hour", "hrs", "hr", "hr run", "hour run", "hour night run", "hour day run"]}
+}
+
+VALID_UNITS = frozenset(UNITS.values())
+
+NAMED_DISTANCES = {
+    "marathon": (26.2, "mile"),
+    "half marathon": (13.1, "mile"),
+    "1/2 marathon": (13.1, "mile"),
+    "mile": (1.0, "mile"),
+    "beer mile": (1.0, "mile"),
+    "kilometer": (1.0, "km"),
+    "beer kilometer": (1.0, "km")
+}
 
 
 class UnitError(ValueError):
@@ -18,7 +44,9 @@ def identity(x):
     return x
 
 
-def distance_parser(x: str) -> List:
+def distance_parser(x: Optional[str]) -> List:
+    if x is None:
+        return []
     return [elt.lstrip().rstrip() for elt in x.split(",")]
 
 
@@ -29,32 +57,21 @@ def remap(x: str) -> str:
     :return: The mapped string. Valid options are:
         ``mile``, ``km`` and ``hour``.
     """
-    if x in ["miler", "mile", "m", "mi", "miles", "m run", "mile run"]:
-        return "mile"
-    if x in ["k", "km", "kms", "kilometers", "kilometer", "k run", "km run"]:
-        return "km"
-    if x in ["hour", "hrs", "hr", "hr run", "hour run", "hour night run", "hour day run"]:
-        return "hour"
+    if x in UNITS:
+        return UNITS[x]
     raise UnitError(f"Unknown unit: {x}")
 
 
-def distance_extract(x: str) -> Optional[UnitValuePair]:
-    """
-    Extract the distance and unit from a string.
-
-    :param x: the input string
-    :return: The length and unit pair, or None
-    """
-    x = x.lstrip().rstrip().lower()
-    if x == "marathon":
-        return {"length": 26.2, "unit": "mile"}
-    if x in ["half marathon", "1/2 marathon"]:
-        return {"length": 13.1, "unit": "mile"}
-    if x in ["mile", "beer mile"]:
-        return {"length": 1.0, "unit": "mile"}
-    if x in ["kilometer", "beer kilometer"]:
-        return {"length": 1.0, "unit": "km"}
-    # Extract length and units:
+@lru_cache(maxsize=DISTANCE_CACHE_SIZE)
+def _distance_extract(x: str) -> Optional[Tuple[float, str]]:
+    x = x.strip().lower()
+    if x in NAMED_DISTANCES:
+        return NAMED_DISTANCES[x]
+    m = rdistance.match(x)
+    if m:
+        unit = UNITS.get(m.group("unit").strip())
+        return (float(m.group("length")), unit) if unit else None
+    # Extract length and units, using the last of each:
     lgroups = rcl.findall(x)
     ugroups = rcu.findall(x)
     unit = length = None
@@ -72,7 +89,48 @@ def distance_extract(x: str) -> Optional[UnitValuePair]:
     length = float(length)
     # Check:
     try:
-        unit = remap(unit.lower().lstrip().rstrip())
-        return {"length": length, "unit": unit}
+        return length, remap(unit.strip())
     except UnitError:
         return
+
+
+def distance_extract(x: str) -> Optional[UnitValuePair]:
+    """
+    Extract the distance and unit from a string.
+
+    :param x: the input string
+    :return: The length and unit pair, or None
+    """
+    out = _distance_extract(x)
+    return {"length": out[0], "unit": out[1]} if out else None
+
+
+def distance_normalize(x: Union[str, UnitValuePair]) -> Optional[UnitValuePair]:
+    """
+    Normalize a distance that is either a raw string or a structured
+    length and unit pair from a source that provides one. Structured
+    pairs skip string parsing entirely.
+
+    :param x: the input string or pair
+    :return: The length and unit pair, or None
+    """
+    if isinstance(x, dict):
+        unit = x.get("unit")
+        if (x.get("length") is None) or (unit not in VALID_UNITS):
+            return
+        return {"length": float(x["length"]), "unit": unit}
+    return distance_extract(x)
+
+
+def distance_extract_many(xs: Iterable[Union[str, UnitValuePair]]) -> List[Optional[UnitValuePair]]:
+    """
+    Normalize many distances, parsing each distinct string once.
+
+    :param xs: the input strings or pairs
+    :return: The length and unit pairs (or None), in input order
+    """
+    xs = list(xs)
+    parsed = {x: distance_extract(x) for x in dict.fromkeys(x for x in xs if isinstance(x, str))}
+    return [
+        (dict(parsed[x]) if parsed[x] else None) if isinstance(x, str) else distance_normalize(x)
+        for x in xs]
@@ -0,0 +1,268 @@
+import json
+import logging as log
+import math
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from ingest.store import get_redis
+
+# Where partitionings are remembered between runs: "redis", shared by all
+# workers, or "file" at PARTITION_PLAN, for single-process runs only:
+PARTITION_STORE = os.getenv("PARTITION_STORE", "redis").lower()
+PARTITION_PLAN = os.getenv(
+    "PARTITION_PLAN", os.path.expanduser("~/.ultrasearch/ultrasignup_partitions.json"))
+# Radius, in miles, below which a saturated partition is not split further:
+MIN_RADIUS = float(os.getenv("PARTITION_MIN_RADIUS", 5))
+# Siblings are merged back when together they fill less than this share
+# of a response:
+MERGE_RATIO = 0.5
+
+MILES_PER_DEGREE = 69.0
+# A search at least this wide covers the whole Earth:
+HALF_CIRCUMFERENCE = MILES_PER_DEGREE * 180
+
+
+def _values(x) -> Tuple[int, ...]:
+    if isinstance(x, int):
+        return (x,)
+    return tuple(int(v) for v in str(x).split(","))
+
+
+def _param(values: Tuple[int, ...]):
+    return values[0] if len(values) == 1 else ",".join(str(v) for v in values)
+
+
+def _lat(lat: float) -> float:
+    return round(min(max(lat, -90.0), 90.0), 5)
+
+
+def _lng(lng: float) -> float:
+    return round((lng + 180.0) % 360.0 - 180.0, 5)
+
+
+class Partition(NamedTuple):
+    """
+    One Ultrasignup search: sets of months and distance buckets, within
+    ``mi`` miles of ``lat``/``lng``. Single months and distances are sent
+    as plain numbers, as the fixed grid did; sets as comma separated lists.
+    """
+    months: Tuple[int, ...]
+    dists: Tuple[int, ...]
+    lat: float
+    lng: float
+    mi: float
+    virtual: int = 0
+
+    @classmethod
+    def from_params(cls, params: Dict) -> "Partition":
+        return cls(
+            months=_values(params["m"]),
+            dists=_values(params["dist"]),
+            lat=params["lat"],
+            lng=params["lng"],
+            mi=params["mi"],
+            virtual=params.get("virtual", 0))
+
+    def params(self) -> Dict:
+        return {
+            "virtual": self.virtual,
+            "lat": self.lat,
+            "lng": self.lng,
+            "mi": self.mi,
+            "m": _param(self.months),
+            "dist": _param(self.dists)
+        }
+
+    def key(self) -> str:
+        return json.dumps(self.params(), sort_keys=True)
+
+    def can_split(self) -> bool:
+        return len(self.months) > 1 or len(self.dists) > 1 or self.mi / 2 >= MIN_RADIUS
+
+    def split(self) -> List["Partition"]:
+        """
+        Narrower partitions covering this one: halve the months, then the
+        distance buckets, then the area. A search covering the whole Earth
+        becomes the two hemispheres around its centre and the antipode;
+        smaller circles are covered by four circles around their quadrants.
+        """
+        if len(self.months) > 1:
+            half = len(self.months) // 2
+            return [self._replace(months=self.months[:half]), self._replace(months=self.months[half:])]
+        if len(self.dists) > 1:
+            half = len(self.dists) // 2
+            return [self._replace(dists=self.dists[:half]), self._replace(dists=self.dists[half:])]
+        if self.mi >= HALF_CIRCUMFERENCE:
+            # Slightly wider than a hemisphere, so the two overlap at the equator:
+            mi = round(HALF_CIRCUMFERENCE / 2 * 1.01, 3)
+            return [
+                self._replace(lat=_lat(self.lat), lng=_lng(self.lng), mi=mi),
+                self._replace(lat=_lat(-self.lat), lng=_lng(self.lng + 180), mi=mi)]
+        # Circles through the corners of each quadrant of the bounding square:
+        offset = self.mi / 2
+        d_lat = offset / MILES_PER_DEGREE
+        d_lng = offset / (MILES_PER_DEGREE * max(math.cos(math.radians(self.lat)), 0.01))
+        mi = round(self.mi / math.sqrt(2), 3)
+        return [
+            self._replace(lat=_lat(self.lat + s_lat * d_lat), lng=_lng(self.lng + s_lng * d_lng), mi=mi)
+            for s_lat in (-1, 1) for s_lng in (-1, 1)]
+
+
+class PlanStore(ABC):
+    """
+    Leaf partitions from previous runs, keyed by ``Partition.key()``, each
+    as ``{"params": ..., "count": ..., "ancestors": [params, ...]}``.
+    """
+
+    @abstractmethod
+    def load(self) -> Dict[str, Dict]:
+        pass
+
+    @abstractmethod
+    def update(self, put: Dict[str, Dict], delete: Iterable[str] = ()) -> None:
+        pass
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self.load().get(key)
+
+
+class FilePlanStore(PlanStore):
+    """
+    For a single process, such as ``run_ingest.py``: the lock only orders
+    its threads, and every update rewrites the whole file.
+    """
+
+    def __init__(self, path: str = PARTITION_PLAN):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def update(self, put: Dict[str, Dict], delete: Iterable[str] = ()) -> None:
+        with self._lock:
+            leaves = self.load()
+            for key in delete:
+                leaves.pop(key, None)
+            leaves.update(put)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(leaves, f)
+            os.replace(tmp, self.path)
+
+
+class RedisPlanStore(PlanStore):
+    """
+    For workers, in several processes or on several machines: one hash
+    field per leaf, so updates to different leaves don't race.
+    """
+
+    def __init__(self, client, name: str = "partitions:ultrasignup"):
+        self.client = client
+        self.name = name
+
+    def load(self) -> Dict[str, Dict]:
+        return {k.decode(): json.loads(v) for k, v in self.client.hgetall(self.name).items()}
+
+    def get(self, key: str) -> Optional[Dict]:
+        value = self.client.hget(self.name, key)
+        return json.loads(value) if value is not None else None
+
+    def update(self, put: Dict[str, Dict], delete: Iterable[str] = ()) -> None:
+        pipe = self.client.pipeline()
+        delete = list(delete)
+        if delete:
+            pipe.hdel(self.name, *delete)
+        if put:
+            pipe.hset(self.name, mapping={k: json.dumps(v) for k, v in put.items()})
+        pipe.execute()
+
+
+_store: Optional[PlanStore] = None
+
+
+def partition_store() -> PlanStore:
+    """ Per-process store for ``PARTITION_STORE``. """
+    global _store
+    if _store is None:
+        if PARTITION_STORE == "redis":
+            _store = RedisPlanStore(get_redis())
+        elif PARTITION_STORE == "file":
+            _store = FilePlanStore()
+        else:
+            raise ValueError(f"Unknown PARTITION_STORE: {PARTITION_STORE}")
+    return _store
+
+
+def _ancestors(store: PlanStore, partition: Partition) -> List[Dict]:
+    entry = store.get(partition.key())
+    return entry["ancestors"] if entry else []
+
+
+def record_count(store: PlanStore, partition: Partition, count: int) -> None:
+    """ Remember that ``partition`` returned ``count`` events. """
+    store.update({partition.key(): {
+        "params": partition.params(),
+        "count": count,
+        "ancestors": _ancestors(store, partition)
+    }})
+
+
+def record_split(store: PlanStore, partition: Partition) -> List[Partition]:
+    """ Replace a saturated ``partition`` by its children, and return them. """
+    children = partition.split()
+    ancestors = _ancestors(store, partition) + [partition.params()]
+    store.update(
+        {child.key(): {"params": child.params(), "count": None, "ancestors": ancestors} for child in children},
+        delete=[partition.key()])
+    return children
+
+
+def _merge_sparse(store: PlanStore, leaves: Dict[str, Dict], cap: int) -> Dict[str, Dict]:
+    # Group leaves by parent, and merge complete sibling groups that
+    # together returned well under the cap:
+    groups: Dict[str, List[str]] = {}
+    for key, entry in leaves.items():
+        if entry["ancestors"]:
+            groups.setdefault(json.dumps(entry["ancestors"][-1], sort_keys=True), []).append(key)
+    put, delete = {}, []
+    for parent_key, keys in groups.items():
+        parent = Partition.from_params(json.loads(parent_key))
+        counts = [leaves[key]["count"] for key in keys]
+        if (len(keys) != len(parent.split())) or any(count is None for count in counts):
+            continue
+        if sum(counts) < cap * MERGE_RATIO:
+            put[parent_key] = {
+                "params": parent.params(),
+                "count": sum(counts),
+                "ancestors": leaves[keys[0]]["ancestors"][:-1]
+            }
+            delete.extend(keys)
+    if put:
+        log.info(f"Merging {len(delete)} sparse partitions into {len(put)}")
+        store.update(put, delete=delete)
+        for key in delete:
+            leaves.pop(key)
+        leaves.update(put)
+    return leaves
+
+
+def plan(store: PlanStore, root: Partition, cap: int) -> List[Partition]:
+    """
+    Partitions to request this run: the leaves remembered from previous
+    runs, with sparse siblings merged back, or just ``root`` on the first.
+
+    :param cap: Most events the API returns for one request
+    """
+    leaves = store.load()
+    if not leaves:
+        return [root]
+    leaves = _merge_sparse(store, leaves, cap)
+    return [Partition.from_params(entry["params"]) for entry in leaves.values()]
@@ -0,0 +1,183 @@
+import logging as log
+import os
+import queue
+import threading
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional
+
+from client import ClientPool, client_pool
+from ingest.ingest import Ingest
+from ingest.ratelimit import RateLimiter
+from ingest.ultrarequest import UltraRequest
+
+# Threads per stage:
+PIPELINE_FETCHERS = int(os.getenv("PIPELINE_FETCHERS", 2))
+PIPELINE_PARSERS = int(os.getenv("PIPELINE_PARSERS", 1))
+PIPELINE_UPLOADERS = int(os.getenv("PIPELINE_UPLOADERS", 2))
+# Items waiting between two stages, before the upstream stage blocks:
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 8))
+
+# Tells a stage worker there is no more input:
+_DONE = object()
+
+
+class Pipeline:
+    """
+    Runs fetch, parse and upload for one ``Ingest`` as overlapping thread
+    stages connected by bounded queues, so a slow stage holds back the
+    ones before it instead of letting pages pile up in memory.
+
+    A failed fetch is logged and skipped. A parse or upload error stops
+    the whole pipeline and is raised from ``run()``.
+
+    :param ingest: Any ``Ingest`` implementation
+    :param fetchers: Threads fetching pages
+    :param parsers: Threads parsing fetched pages
+    :param uploaders: Threads uploading parsed pages, each with a client
+        borrowed from ``pool``
+    :param queue_size: Capacity of each queue between stages
+    :param pool: Defaults to the process's ``client_pool()``
+    :param limiter: The source's shared ``RateLimiter``, e.g.
+        ``get_limiter("ahotu")``. Every fetch takes a token from it, so
+        the request rate holds however many fetch threads run. Without
+        one, each fetch sleeps as in sync mode.
+    """
+
+    def __init__(
+            self,
+            ingest: Ingest,
+            fetchers: int = PIPELINE_FETCHERS,
+            parsers: int = PIPELINE_PARSERS,
+            uploaders: int = PIPELINE_UPLOADERS,
+            queue_size: int = PIPELINE_QUEUE_SIZE,
+            pool: Optional[ClientPool] = None,
+            columnar: bool = False,
+            bulk: bool = False,
+            limiter: Optional[RateLimiter] = None):
+        self.ingest = ingest
+        self.concurrency = {"fetch": fetchers, "parse": parsers, "upload": uploaders}
+        self.queue_size = queue_size
+        self.pool = pool if pool is not None else client_pool()
+        self.columnar = columnar
+        self.bulk = bulk
+        self.limiter = limiter
+        self.stats: Counter = Counter()
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def _count(self, name: str) -> None:
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _fail(self, error: BaseException) -> None:
+        with self._stats_lock:
+            if self._error is None:
+                self._error = error
+        self._stop.set()
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        # Wait for room, unless the pipeline is stopping:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _fetch(self, request: UltraRequest):
+        try:
+            batch = request.fetch() if self.limiter is None else request.fetch(limiter=self.limiter)
+        except Exception as e:
+            log.warning(f"Fetch failed for {request.params}: {e}")
+            self._count("fetch_errors")
+            return None
+        self._count("fetched")
+        return batch
+
+    def _parse(self, batch):
+        parsed_batch = self.ingest.parse(batch, columnar=self.columnar)
+        self._count("parsed")
+        return parsed_batch
+
+    def _upload(self, parsed_batch):
+        with self.pool.borrow() as client:
+            self.ingest.upload(parsed_batch, client=client, bulk=self.bulk)
+        self._count("uploaded")
+        return None
+
+    def _work(self, fn: Callable, inq: queue.Queue, outq: Optional[queue.Queue]) -> None:
+        try:
+            while True:
+                item = self._get(inq)
+                if item is _DONE:
+                    return
+                out = fn(item)
+                if (out is not None) and (outq is not None):
+                    if not self._put(outq, out):
+                        return
+        except BaseException as e:
+            self._fail(e)
+
+    def _stage(
+            self,
+            name: str,
+            fn: Callable,
+            inq: queue.Queue,
+            outq: Optional[queue.Queue],
+            downstream: int) -> List[threading.Thread]:
+        workers = [
+            threading.Thread(target=self._work, args=(fn, inq, outq), name=f"{name}-{i}", daemon=True)
+            for i in range(self.concurrency[name])]
+
+        def close():
+            # Once every worker is done, tell the next stage's workers:
+            for worker in workers:
+                worker.join()
+            if outq is not None:
+                for _ in range(downstream):
+                    self._put(outq, _DONE)
+
+        return workers + [threading.Thread(target=close, name=f"{name}-close", daemon=True)]
+
+    def _feed(self, requests: Iterable[UltraRequest], q: queue.Queue) -> None:
+        try:
+            for request in requests:
+                if not self._put(q, request):
+                    return
+        except BaseException as e:
+            self._fail(e)
+            return
+        for _ in range(self.concurrency["fetch"]):
+            self._put(q, _DONE)
+
+    def run(self, requests: Iterable[UltraRequest]) -> Dict[str, int]:
+        """
+        Ingest ``requests``, which may be a lazy iterable.
+
+        :return: Counts of pages fetched, parsed and uploaded, and of
+            failed fetches
+        """
+        requests_q, fetched_q, parsed_q = (queue.Queue(self.queue_size) for _ in range(3))
+        threads = (
+            [threading.Thread(target=self._feed, args=(requests, requests_q), name="feed", daemon=True)] +
+            self._stage("fetch", self._fetch, requests_q, fetched_q, self.concurrency["parse"]) +
+            self._stage("parse", self._parse, fetched_q, parsed_q, self.concurrency["upload"]) +
+            self._stage("upload", self._upload, parsed_q, None, 0))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+        log.info(f"{type(self.ingest).__name__} pipeline done: {dict(self.stats)}")
+        return dict(self.stats)
@@ -0,0 +1,162 @@
+import logging as log
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+
+import redis
+
+from ingest.store import get_redis, redis_configured
+
+# Refill the bucket from the elapsed time on the Redis clock, so every
+# worker agrees on it. With ARGV[3] == 'reserve' the token is taken
+# even if it is not due yet, letting the bucket go negative, unless it
+# would be due more than ARGV[4] seconds from now. Otherwise only a
+# granted call writes the state back. Returns whether a token was taken,
+# and the delay until it (or, if not taken, the next one) is due.
+# Calling TIME before writing needs effects replication (Redis >= 5).
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local horizon = tonumber(ARGV[4])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+if tokens < 1 then
+    local wait = (1 - tokens) / rate
+    if (ARGV[3] ~= 'reserve') or ((horizon >= 0) and (wait > horizon)) then
+        return {0, tostring(wait)}
+    end
+end
+tokens = tokens - 1
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 1)
+if tokens >= 0 then
+    return {1, '0'}
+end
+return {1, tostring(-tokens / rate)}
+"""
+
+# Default politeness: one request every 5s per source, across all workers:
+DEFAULT_RATE = 0.2
+DEFAULT_BURST = 1
+# Furthest ahead, in seconds, a token may be reserved. A task holding a
+# reservation waits as an ETA task, which the broker redelivers if it is
+# unacknowledged for too long (RabbitMQ's consumer_timeout, 30 minutes):
+RESERVE_HORIZON = float(os.getenv("RATE_RESERVE_HORIZON", 300))
+
+
+class RateLimiter(ABC):
+    """
+    Token bucket for one source.
+
+    :param name: Source name, e.g. ``ultrasignup``
+    :param rate: Tokens added per second
+    :param burst: Bucket capacity
+    """
+
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+
+    @abstractmethod
+    def _call(self, mode: str, horizon: Optional[float] = None) -> Tuple[bool, float]:
+        """ See ``TOKEN_BUCKET_SCRIPT``; ``horizon`` None for no limit. """
+        pass
+
+    def try_acquire(self) -> float:
+        """
+        Take a token if one is available.
+
+        :return: 0 if a token was taken, else the seconds until one is due
+        """
+        return self._call('try')[1]
+
+    def reserve(self, horizon: Optional[float] = RESERVE_HORIZON) -> Optional[float]:
+        """
+        Take the next token, even if it is not due yet.
+
+        :param horizon: Don't reserve a token due further ahead than this;
+            None for no limit
+        :return: Seconds until the reserved token is due; the caller
+            owns it and should start its request no earlier than that.
+            None if nothing was reserved, because of ``horizon``.
+        """
+        taken, wait = self._call('reserve', horizon)
+        return wait if taken else None
+
+    def acquire(self, timeout: Optional[float] = None) -> None:
+        """ Block until a token is taken. """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            if (deadline is not None) and (time.monotonic() + wait > deadline):
+                raise TimeoutError(f"No {self.name} token within {timeout}s")
+            log.info(f"Rate limited, waiting {wait:.2f}s for a {self.name} token")
+            time.sleep(wait)
+
+
+class TokenBucket(RateLimiter):
+    """
+    Cluster-wide token bucket, stored in Redis.
+
+    :param client: Redis client
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, client: redis.Redis):
+        super().__init__(name, rate, burst)
+        self.key = f"ratelimit:{name}"
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def _call(self, mode: str, horizon: Optional[float] = None) -> Tuple[bool, float]:
+        taken, wait = self._script(
+            keys=[self.key], args=[self.rate, self.burst, mode, -1 if horizon is None else horizon])
+        return bool(taken), float(wait)
+
+
+class LocalTokenBucket(RateLimiter):
+    """ Token bucket shared by the threads of one process, without Redis. """
+
+    def __init__(self, name: str, rate: float, burst: int):
+        super().__init__(name, rate, burst)
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._ts = time.monotonic()
+
+    def _call(self, mode: str, horizon: Optional[float] = None) -> Tuple[bool, float]:
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.burst, self._tokens + (now - self._ts) * self.rate)
+            if tokens < 1:
+                wait = (1 - tokens) / self.rate
+                if (mode != 'reserve') or ((horizon is not None) and (wait > horizon)):
+                    return False, wait
+            self._tokens, self._ts = tokens - 1, now
+            return True, max(0.0, -self._tokens / self.rate)
+
+
+_limiters: Dict[str, RateLimiter] = {}
+
+
+def get_limiter(source: str) -> RateLimiter:
+    """
+    Per-process limiter for a source, configured by
+    ``RATE_LIMIT_<SOURCE>`` (requests/second) and ``RATE_BURST_<SOURCE>``.
+    Shared by all workers through Redis when it is configured, else only
+    by this process's threads.
+    """
+    if source not in _limiters:
+        rate = float(os.getenv(f"RATE_LIMIT_{source.upper()}", DEFAULT_RATE))
+        burst = int(os.getenv(f"RATE_BURST_{source.upper()}", DEFAULT_BURST))
+        if redis_configured():
+            _limiters[source] = TokenBucket(source, rate=rate, burst=burst, client=get_redis())
+        else:
+            _limiters[source] = LocalTokenBucket(source, rate=rate, burst=burst)
+    return _limiters[source]
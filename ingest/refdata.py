@@ -0,0 +1,67 @@
+import logging as log
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from supabase import Client
+
+# Seconds before the cached tables are reloaded:
+REFDATA_TTL = float(os.getenv("REFDATA_TTL", 3600))
+
+
+class ReferenceData:
+    """
+    Worker-resident cache of the ``distance_units`` and ``sources`` tables.
+
+    Both tables are tiny and seeded once (see ``ingest/seed.py``), so they
+    are loaded once per process and refreshed after ``ttl`` seconds. A
+    lookup miss triggers a single refresh before raising.
+    """
+
+    def __init__(self, ttl: float = REFDATA_TTL):
+        self.ttl = ttl
+        self.units: Dict[str, int] = {}
+        self.sources: Dict[str, int] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def refresh(self, client: Client) -> None:
+        units = client.table("distance_units").select("id,unit_name").execute()
+        sources = client.table("sources").select("id,name").execute()
+        with self._lock:
+            self.units = {unit["unit_name"]: unit["id"] for unit in units.data}
+            self.sources = {source["name"]: source["id"] for source in sources.data}
+            self._loaded_at = time.monotonic()
+        log.info(
+            f"Loaded {len(self.units)} distance units and "
+            f"{len(self.sources)} sources")
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._loaded_at = None
+
+    def is_stale(self) -> bool:
+        return (self._loaded_at is None) or (time.monotonic() - self._loaded_at > self.ttl)
+
+    def _lookup(self, table: str, name: str, client: Client) -> int:
+        if self.is_stale():
+            self.refresh(client)
+        value = getattr(self, table).get(name)
+        if value is None:
+            # Could be newly seeded, reload once before giving up:
+            self.refresh(client)
+            value = getattr(self, table).get(name)
+        if value is None:
+            raise ValueError(f"Unknown {table[:-1]}: {name}")
+        return value
+
+    def unit_id(self, unit_name: str, client: Client) -> int:
+        return self._lookup("units", unit_name, client)
+
+    def source_id(self, source_name: str, client: Client) -> int:
+        return self._lookup("sources", source_name, client)
+
+
+# One cache per worker process:
+reference_data = ReferenceData()
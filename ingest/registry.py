@@ -0,0 +1,117 @@
+import importlib
+import logging as log
+import os
+from types import ModuleType
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+FETCH_QUEUE = 'fetch'
+PARSE_QUEUE = 'parse'
+UPLOAD_QUEUE = 'upload'
+
+# Sources to register tasks for and ingest, e.g. "ahotu"; all by default:
+ENABLED_SOURCES = [s for s in os.getenv("SOURCES", "").split(",") if s]
+# Route each source to its own queues, e.g. "fetch.ahotu", so a worker
+# only loads the sources it serves:
+PER_SOURCE_QUEUES = os.getenv("PER_SOURCE_QUEUES", "false").lower() == "true"
+
+
+class SourceSpec(NamedTuple):
+    """
+    Where a source's stages live. Modules are only imported when a stage
+    is first needed, so a worker pays for the sources it serves.
+
+    :param name: Task name prefix, e.g. "ahotu"
+    :param module: Module holding the stage functions and ``ingest``
+    :param ingest: Name of the ``Ingest`` subclass in ``module``
+    :param fetch_split: Optional fetch stage returning ``(batch, partitions)``,
+        with partitions to query instead when the request was too broad
+    """
+    name: str
+    module: str
+    ingest: str
+    fetch: str = "fetch_data"
+    parse: str = "parse_data"
+    upload: str = "upload_data"
+    fetch_split: Optional[str] = None
+
+
+SOURCES: Dict[str, SourceSpec] = {}
+
+
+def register_source(spec: SourceSpec) -> SourceSpec:
+    SOURCES[spec.name] = spec
+    return spec
+
+
+register_source(SourceSpec(
+    name="ultrasignup", module="ingest.ultrasignup", ingest="UltrasignupIngest",
+    fetch_split="fetch_or_split"))
+register_source(SourceSpec(name="ahotu", module="ingest.ahotu", ingest="AhotuIngest"))
+
+
+def enabled() -> List[str]:
+    if not ENABLED_SOURCES:
+        return list(SOURCES)
+    unknown = set(ENABLED_SOURCES) - set(SOURCES)
+    if unknown:
+        raise ValueError(f"Unknown sources: {sorted(unknown)}")
+    return ENABLED_SOURCES
+
+
+def load(source: str) -> ModuleType:
+    """ Import a source's module, on first use. """
+    return importlib.import_module(SOURCES[source].module)
+
+
+def stage(source: str, name: str) -> Optional[Callable]:
+    """ A source's stage function, e.g. ``stage("ahotu", "parse")``. """
+    function_name = getattr(SOURCES[source], name)
+    if function_name is None:
+        return None
+    return getattr(load(source), function_name)
+
+
+def ingest_class(source: str):
+    return getattr(load(source), SOURCES[source].ingest)
+
+
+def queue(stage_queue: str, source: str) -> str:
+    return f"{stage_queue}.{source}" if PER_SOURCE_QUEUES else stage_queue
+
+
+def stage_queue(name: str) -> str:
+    """ The stage queue a ``queue()`` name belongs to, e.g. "fetch" for "fetch.ahotu". """
+    return name.split(".", 1)[0]
+
+
+def source_routes(source: str) -> Dict[str, Dict]:
+    """ Routes for the tasks generated for ``source``. """
+    return {
+        f"{source}_{suffix}": {"queue": queue(stage_queue, source)}
+        for suffix, stage_queue in [
+            ("fetcher", FETCH_QUEUE),
+            ("fetch_parser", FETCH_QUEUE),
+            ("parser", PARSE_QUEUE),
+            ("uploader", UPLOAD_QUEUE),
+            ("upload_flusher", UPLOAD_QUEUE)]}
+
+
+def task_routes(sources: Iterable[str]) -> Dict[str, Dict]:
+    return {name: route for source in sources for name, route in source_routes(source).items()}
+
+
+def sources_for_queues(queues: Iterable[str]) -> List[str]:
+    """ Enabled sources with a task routed to any of ``queues``. """
+    queues = set(queues)
+    return [
+        source for source in enabled()
+        if queues & {route["queue"] for route in source_routes(source).values()}]
+
+
+def preload(queues: Iterable[str]) -> List[str]:
+    """ Import the sources a worker consuming ``queues`` will run. """
+    sources = sources_for_queues(queues)
+    for source in sources:
+        load(source)
+    log.info(f"Preloaded sources: {sources}")
+    return sources
@@ -0,0 +1,354 @@
+import argparse
+import json
+import logging as log
+import os
+import re
+from datetime import date
+from difflib import SequenceMatcher
+from typing import Dict, FrozenSet, Hashable, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from ingest.bulk import upsert_rows
+from ingest.existence import PAGE_SIZE, normalize_date
+from ingest.parser import distance_extract
+
+# Geohash characters; 4 gives cells of about 39 x 20 km:
+GEOHASH_PRECISION = int(os.getenv("RESOLVE_GEOHASH_PRECISION", 4))
+# Most days two listings of the same race may disagree by:
+DATE_WINDOW = int(os.getenv("RESOLVE_DATE_WINDOW", 1))
+# Name similarity, from 0 to 1, at which two candidates are the same race:
+NAME_THRESHOLD = float(os.getenv("RESOLVE_NAME_THRESHOLD", 0.8))
+# Links written per request:
+LINK_BATCH_SIZE = int(os.getenv("RESOLVE_LINK_BATCH_SIZE", 500))
+
+COLUMNS = ("id", "source_id", "name", "start_date", "city", "state", "country", "url", "latitude", "longitude")
+
+rstrip = re.compile(r"[^a-z0-9 ]+")
+# Years and edition numbers, e.g. "2023" or "10th", vary between listings:
+rnoise = re.compile(r"\b(?:(?:19|20)\d\d|\d+(?:st|nd|rd|th))\b")
+# Distances in names, e.g. "Marathon", "100", "100K" or "50 Miler". The
+# word after a number is only part of the distance when it is a unit:
+rnamed_distance = re.compile(r"\b(?:half marathon|1/2 marathon|marathon)\b")
+rname_distance = re.compile(r"\b(\d+(?:\.\d+)?)(?:\s*([a-z]+))?")
+STOPWORDS = frozenset(("the", "a", "of", "and", "annual", "edition", "race", "run", "endurance", "ultra"))
+# Miles per unit, and how far apart two lengths may be and still match:
+MILES = {"mile": 1.0, "km": 0.621371}
+DISTANCE_TOLERANCE = 0.02
+
+Distance = Tuple[float, Optional[str]]
+
+
+def cell_size(precision: int = GEOHASH_PRECISION) -> Tuple[float, float]:
+    """ Height and width of a geohash cell, in degrees. """
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def cell(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> Tuple[int, int]:
+    """
+    Row and column of the geohash cell holding a point. The same grid as
+    the geohash string, but neighbours are plain arithmetic.
+    """
+    d_lat, d_lng = cell_size(precision)
+    rows, cols = round(180.0 / d_lat), round(360.0 / d_lng)
+    return (
+        min(int((latitude + 90.0) / d_lat), rows - 1),
+        int((longitude + 180.0) / d_lng) % cols)
+
+
+def neighbourhood(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> FrozenSet[Tuple[int, int]]:
+    """ The cell of a point and the eight around it, wrapping at 180 degrees. """
+    d_lat, d_lng = cell_size(precision)
+    rows, cols = round(180.0 / d_lat), round(360.0 / d_lng)
+    row, col = cell(latitude, longitude, precision)
+    return frozenset(
+        (r, (col + j) % cols)
+        for r in (row - 1, row, row + 1) if 0 <= r < rows for j in (-1, 0, 1))
+
+
+class NameTokens(NamedTuple):
+    words: Tuple[str, ...]
+    # Length and unit of each distance in the name; the unit is None for
+    # a bare number, e.g. "Western States 100":
+    distances: FrozenSet[Distance]
+
+
+def name_tokens(name: Optional[str]) -> NameTokens:
+    distances = []
+
+    def named(m):
+        out = distance_extract(m.group(0))
+        distances.append((out["length"], out["unit"]))
+        return " "
+
+    def number(m):
+        length, word = m.group(1), m.group(2)
+        out = distance_extract(length + word) if word else None
+        if out:
+            distances.append((out["length"], out["unit"]))
+            return " "
+        distances.append((float(length), None))
+        return " " + (word or "")
+
+    text = rnoise.sub(" ", (name or "").lower())
+    text = rname_distance.sub(number, rnamed_distance.sub(named, text))
+    text = rstrip.sub(" ", text)
+    words = tuple(sorted(t for t in text.split() if t not in STOPWORDS))
+    return NameTokens(words, frozenset(distances))
+
+
+def same_distance(a: Distance, b: Distance) -> bool:
+    (la, ua), (lb, ub) = a, b
+    if ua is None or ub is None:
+        return la == lb
+    if ua in MILES and ub in MILES:
+        ma, mb = la * MILES[ua], lb * MILES[ub]
+        return abs(ma - mb) <= DISTANCE_TOLERANCE * max(ma, mb)
+    return ua == ub and la == lb
+
+
+def distances_match(a: FrozenSet[Distance], b: FrozenSet[Distance]) -> bool:
+    """ Whether two names share a distance, or either gives none. """
+    if not a or not b:
+        return True
+    return any(same_distance(x, y) for x in a for y in b)
+
+
+def name_similarity(a: NameTokens, b: NameTokens) -> float:
+    """
+    Similarity of two ``name_tokens``: 0 when their distances differ, or
+    else the better of their word overlap and the edit similarity of the
+    sorted words, so both reordered and misspelt names score high.
+    """
+    if not distances_match(a.distances, b.distances):
+        return 0.0
+    a, b = a.words, b.words
+    if not a or not b:
+        return 0.0
+    sa, sb = set(a), set(b)
+    jaccard = len(sa & sb) / len(sa | sb)
+    if jaccard == 1.0:
+        return jaccard
+    matcher = SequenceMatcher(None, " ".join(a), " ".join(b))
+    if matcher.quick_ratio() <= jaccard:
+        return jaccard
+    return max(jaccard, matcher.ratio())
+
+
+class DisjointSet:
+    """ Union-find over ``0..n-1``, with path halving and union by size. """
+
+    def __init__(self, n: int = 0):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def add(self) -> int:
+        self.parent.append(len(self.parent))
+        self.size.append(1)
+        return len(self.parent) - 1
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a: int, b: int) -> int:
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+    def groups(self) -> List[List[int]]:
+        out: Dict[int, List[int]] = {}
+        for x in range(len(self.parent)):
+            out.setdefault(self.find(x), []).append(x)
+        return list(out.values())
+
+
+class Resolution(NamedTuple):
+    # Indexes of the rows of each race, including races listed once:
+    clusters: List[List[int]]
+    # Index of each row's canonical row:
+    canonical: List[int]
+    comparisons: int
+
+
+class Resolver:
+    """
+    Incremental entity resolution. Each added row is only compared with
+    earlier rows in its blocks: the geohash cells around it, crossed with
+    the ``window``-day date buckets around its start date. Rows are linked
+    when their names are at least ``threshold`` similar, and linked rows
+    are merged with union-find, so duplicates chain to one race.
+
+    Rows without a start date are never linked. Rows without coordinates
+    are blocked by their city instead, or failing that their state or
+    country, and rows with none of these are never linked.
+
+    :param cross_source: Only link rows from different sources, and never
+        two rows of one source into a race; a source's own rows are
+        already deduplicated by their natural key
+    """
+
+    def __init__(
+            self,
+            precision: int = GEOHASH_PRECISION,
+            window: int = DATE_WINDOW,
+            threshold: float = NAME_THRESHOLD,
+            cross_source: bool = True):
+        self.precision = precision
+        self.window = window
+        self.threshold = threshold
+        self.cross_source = cross_source
+        self.rows: List[Dict] = []
+        self.sets = DisjointSet()
+        self.comparisons = 0
+        self._blocks: Dict[Tuple[Hashable, int], List[int]] = {}
+        self._days: List[Optional[int]] = []
+        self._tokens: List[NameTokens] = []
+        # Sources of each race, kept at its union-find root:
+        self._sources: List[FrozenSet] = []
+
+    def _day(self, row: Dict) -> Optional[int]:
+        start_date = normalize_date(row.get("start_date"))
+        return date.fromisoformat(start_date).toordinal() if start_date else None
+
+    def _cells(self, row: Dict) -> Tuple[Optional[Hashable], FrozenSet]:
+        latitude, longitude = row.get("latitude"), row.get("longitude")
+        if latitude is None or longitude is None:
+            for level in ("city", "state", "country"):
+                place = " ".join(rstrip.sub(" ", (row.get(level) or "").lower()).split())
+                if place:
+                    return (level, place), frozenset(((level, place),))
+            return None, frozenset()
+        latitude, longitude = float(latitude), float(longitude)
+        return cell(latitude, longitude, self.precision), neighbourhood(latitude, longitude, self.precision)
+
+    def candidates(self, day: int, cells: Iterable) -> Iterable[int]:
+        # Buckets are window + 1 days wide, so the adjacent ones cover it:
+        bucket = day // (self.window + 1)
+        for neighbour in cells:
+            for b in (bucket - 1, bucket, bucket + 1):
+                yield from self._blocks.get((neighbour, b), ())
+
+    def add(self, row: Dict) -> int:
+        """ Add a row, linking it to matching earlier rows, and return its index. """
+        i = self.sets.add()
+        self.rows.append(row)
+        day = self._day(row)
+        tokens = name_tokens(row.get("name"))
+        self._days.append(day)
+        self._tokens.append(tokens)
+        self._sources.append(frozenset((row.get("source_id"),)))
+        home, cells = self._cells(row)
+        if day is None or home is None:
+            return i
+        for j in self.candidates(day, cells):
+            if abs(self._days[j] - day) > self.window:
+                continue
+            root_i, root_j = self.sets.find(i), self.sets.find(j)
+            if root_i == root_j:
+                continue
+            if self.cross_source and self._sources[root_i] & self._sources[root_j]:
+                continue
+            self.comparisons += 1
+            if name_similarity(tokens, self._tokens[j]) >= self.threshold:
+                root = self.sets.union(root_i, root_j)
+                self._sources[root] = self._sources[root_i] | self._sources[root_j]
+        self._blocks.setdefault((home, day // (self.window + 1)), []).append(i)
+        return i
+
+    def resolution(self) -> Resolution:
+        clusters = self.sets.groups()
+        canonical = [0] * len(self.rows)
+        for cluster in clusters:
+            first = canonical_row(self.rows, cluster)
+            for i in cluster:
+                canonical[i] = first
+        return Resolution(clusters, canonical, self.comparisons)
+
+
+def canonical_row(rows: Sequence[Dict], cluster: Sequence[int]) -> int:
+    """ The most complete row of a cluster, then the lowest source id. """
+    def rank(i):
+        row = rows[i]
+        filled = sum(row.get(key) not in (None, "") for key in COLUMNS)
+        return -filled, row.get("source_id") or 0, i
+    return min(cluster, key=rank)
+
+
+def resolve(rows: Iterable[Dict], **kwargs) -> Resolution:
+    """ Resolve rows, e.g. ``Event.todict()`` or ``events`` table rows. """
+    resolver = Resolver(**kwargs)
+    for row in rows:
+        resolver.add(row)
+    return resolver.resolution()
+
+
+def links(rows: Sequence[Dict], resolution: Resolution) -> Dict[int, int]:
+    """ ``{id: canonical id}`` for every duplicate row, by ``id`` column. """
+    return {
+        rows[i]["id"]: rows[c]["id"]
+        for i, c in enumerate(resolution.canonical) if i != c}
+
+
+def load_events(client) -> List[Dict]:
+    """ All rows of the ``events`` table needed to resolve them. """
+    rows: List[Dict] = []
+    start = 0
+    while True:
+        out = client.table("events").select(",".join(COLUMNS)) \
+            .order("id") \
+            .range(start, start + PAGE_SIZE - 1) \
+            .execute()
+        rows.extend(out.data)
+        if len(out.data) < PAGE_SIZE:
+            break
+        start += PAGE_SIZE
+    return rows
+
+
+def upload_links(
+        client, rows: Sequence[Dict], out: Dict[int, int], batch_size: int = LINK_BATCH_SIZE) -> None:
+    """
+    Write ``links()`` to the ``event_links`` table, in batches, and drop
+    the links of resolved rows that are no longer duplicates.
+
+    :param rows: All the resolved rows
+    """
+    link_rows = [{"event_id": i, "canonical_event_id": c} for i, c in out.items()]
+    for start in range(0, len(link_rows), batch_size):
+        upsert_rows(client, "event_links", link_rows[start:start + batch_size], on_conflict=("event_id",))
+    stale = [row["id"] for row in rows if row["id"] not in out]
+    for start in range(0, len(stale), batch_size):
+        client.table("event_links").delete().in_("event_id", stale[start:start + batch_size]).execute()
+
+
+if __name__ == "__main__":
+    from client import client_pool
+
+    log.basicConfig(level=log.INFO)
+    parser = argparse.ArgumentParser(description="Link duplicate events across sources")
+    parser.add_argument(
+        "--dry-run", metavar="PATH", nargs="?", const="event_links.json",
+        help="write {id: canonical id} to PATH (default event_links.json) instead of the event_links table")
+    args = parser.parse_args()
+
+    with client_pool().borrow() as client:
+        rows = load_events(client)
+        resolution = resolve(rows)
+        out = links(rows, resolution)
+        log.info(
+            f"Resolved {len(rows)} events into {len(resolution.clusters)} races "
+            f"with {resolution.comparisons} comparisons, {len(out)} duplicates")
+        if args.dry_run:
+            with open(args.dry_run, "w") as f:
+                json.dump(out, f, indent=2)
+        else:
+            upload_links(client, rows, out)
@@ -0,0 +1,61 @@
+import logging as log
+import os
+from typing import Dict, Optional
+
+# Store fetch and parse results too, though the next stage gets them in
+# its message; mostly useful for debugging:
+STORE_INTERMEDIATE_RESULTS = os.getenv("STORE_INTERMEDIATE_RESULTS", "false").lower() == "true"
+# Compression for stored results: "zlib", or "none" for plain JSON:
+RESULT_COMPRESSION = os.getenv("RESULT_COMPRESSION", "zlib").lower()
+# Seconds to keep a stored result, per queue; at most Celery's default
+# of a day:
+RESULT_EXPIRES = {
+    queue: int(os.getenv(f"RESULT_EXPIRES_{queue.upper()}", default))
+    for queue, default in [("fetch", 3600), ("parse", 3600), ("upload", 24 * 3600)]
+}
+# Seconds to keep per-run byte counts:
+STATS_TTL = 7 * 24 * 3600
+
+
+def apply_result_policy(backend, task_id: str, queue: Optional[str], run_id: Optional[str]) -> Optional[int]:
+    """
+    Expire a stored result after its queue's ``RESULT_EXPIRES``, and add
+    its size to the run's counts.
+
+    :param backend: A Celery Redis result backend; others are skipped
+    :return: Bytes stored for the result, if any
+    """
+    client = getattr(backend, "client", None)
+    if client is None or not hasattr(backend, "get_key_for_task"):
+        return None
+    key = backend.get_key_for_task(task_id)
+    size = client.strlen(key)
+    if not size:
+        # Ignored result
+        return None
+    pipe = client.pipeline()
+    if queue in RESULT_EXPIRES:
+        pipe.expire(key, RESULT_EXPIRES[queue])
+    if run_id is not None:
+        name = f"results:run:{run_id}"
+        pipe.hincrby(name, f"{queue}:bytes", size)
+        pipe.hincrby(name, f"{queue}:count", 1)
+        pipe.expire(name, STATS_TTL)
+    pipe.execute()
+    return size
+
+
+def result_report(client, run_id: str) -> Dict[str, Dict[str, int]]:
+    """ Result bytes and counts stored by a run, per queue. """
+    report: Dict[str, Dict[str, int]] = {}
+    for field, value in client.hgetall(f"results:run:{run_id}").items():
+        queue, stat = field.decode().rsplit(":", 1)
+        report.setdefault(queue, {})[stat] = int(value)
+    return report
+
+
+def log_report(run_id: str, report: Dict[str, Dict[str, int]]) -> None:
+    total = sum(stats.get("bytes", 0) for stats in report.values())
+    log.info(f"Result backend usage for run {run_id}: {total} bytes")
+    for queue, stats in sorted(report.items()):
+        log.info(f"  {queue}: {stats.get('count', 0)} results, {stats.get('bytes', 0)} bytes")
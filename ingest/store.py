@@ -0,0 +1,33 @@
+import os
+from typing import Optional
+
+import redis
+
+_client: Optional[redis.Redis] = None
+
+
+def _url() -> Optional[str]:
+    return os.getenv("REDIS_URL", os.getenv("RESULT_BACKEND"))
+
+
+def redis_configured() -> bool:
+    """ Whether ``REDIS_URL`` or a redis ``RESULT_BACKEND`` is set. """
+    url = _url()
+    return bool(url) and url.startswith("redis")
+
+
+def redis_url() -> str:
+    url = _url()
+    if not redis_configured():
+        raise ValueError(
+            "'REDIS_URL' or a redis 'RESULT_BACKEND' "
+            "environment variable must be set")
+    return url
+
+
+def get_redis() -> redis.Redis:
+    """ Per-process Redis client for ingest state (rate limits, caches). """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(redis_url())
+    return _client
@@ -0,0 +1,75 @@
+import itertools
+import logging as log
+import os
+import time
+from typing import Iterable, List, NamedTuple, Optional
+
+from celery import Celery
+from celery.canvas import Signature, _chain
+from celery.result import AsyncResult
+
+# Chains published per producer checkout:
+SUBMIT_BATCH_SIZE = int(os.getenv("SUBMIT_BATCH_SIZE", 1000))
+
+
+class Submitted(NamedTuple):
+    count: int
+    seconds: float
+    # Only kept when asked for:
+    results: Optional[List[AsyncResult]]
+
+
+def _chain_tasks(sig: Signature) -> List[Signature]:
+    # ``chain(a | b | c)`` wraps a single, nested chain:
+    if isinstance(sig, _chain):
+        return [task for inner in sig.tasks for task in _chain_tasks(inner)]
+    return [sig]
+
+
+def ignore_intermediate_results(sig: Signature) -> Signature:
+    """
+    Don't store results for all but the last task of a chain, however its
+    chains are nested. Each stage's result already travels to the next
+    stage in its message.
+    """
+    for task in _chain_tasks(sig)[:-1]:
+        task.set(ignore_result=True)
+    return sig
+
+
+def submit_chains(
+        app: Celery,
+        chains: Iterable[Signature],
+        batch_size: int = SUBMIT_BATCH_SIZE,
+        keep_results: bool = False,
+        ignore_intermediate: bool = False) -> Submitted:
+    """
+    Publish chains in batches, each over one producer (and so one broker
+    connection and channel), consuming ``chains`` lazily.
+
+    :param chains: Any iterable of signatures, e.g. a generator, so
+        memory stays flat however many there are
+    :param keep_results: Return each chain's ``AsyncResult``
+    :param ignore_intermediate: See ``ignore_intermediate_results``
+    """
+    chains = iter(chains)
+    results = [] if keep_results else None
+    count = 0
+    started = time.monotonic()
+    while True:
+        batch = list(itertools.islice(chains, batch_size))
+        if not batch:
+            break
+        with app.producer_or_acquire() as producer:
+            for sig in batch:
+                if ignore_intermediate:
+                    ignore_intermediate_results(sig)
+                result = sig.apply_async(producer=producer)
+                if keep_results:
+                    results.append(result)
+                count += 1
+                if count == 1:
+                    log.info(f"First chain submitted after {time.monotonic() - started:.1f}s")
+        elapsed = time.monotonic() - started
+        log.info(f"Submitted {count} chains ({count / elapsed:.0f}/s)")
+    return Submitted(count, time.monotonic() - started, results)
@@ -1,18 +1,23 @@
 import json
+import logging as log
 import os
+from typing import Dict
 
 import httpcore
 import httpx
-from celery import Celery
+from celery import Celery, Task, chain, signature
+from celery.signals import celeryd_after_setup, task_postrun, worker_process_init
 
-from events import event_list_dumps
+from events import event_list_dumps, event_list_load
 
-from ingest.ultrasignup import fetch_data as fetch_ultrasignup_data
-from ingest.ultrasignup import parse_data as parse_ultrasignup_data
-from ingest.ultrasignup import upload_data as upload_ultrasignup_data
-from ingest.ahotu import fetch_data as fetch_ahotu_data
-from ingest.ahotu import parse_data as parse_ahotu_data
-from ingest.ahotu import upload_data as upload_ahotu_data
+from ingest import fetchcache, registry
+from ingest.claimcheck import check_in, check_out, release
+from ingest.coalesce import COALESCE_SIZE, COALESCE_UPLOADS, COALESCE_WINDOW, Coalescer, combine
+from codec import PACKED_CONTENT_TYPE, PACKED_PAYLOADS, packb, unpackb
+from ingest.fetchcache import FetchCache, log_stats
+from ingest.ratelimit import RESERVE_HORIZON, get_limiter
+from ingest.results import RESULT_COMPRESSION, STORE_INTERMEDIATE_RESULTS, apply_result_policy
+from ingest.store import get_redis
 
 from kombu import serialization
 
@@ -24,10 +29,17 @@ serialization.register(
     content_type='json',
     content_encoding='utf-8',
 )
-
-FETCH_QUEUE = 'fetch'
-PARSE_QUEUE = 'parse'
-UPLOAD_QUEUE = 'upload'
+serialization.register(
+    'ultrasearch_packed',
+    packb,
+    unpackb,
+    content_type=PACKED_CONTENT_TYPE,
+    content_encoding='binary',
+)
+# Serializers for the fetch->parse and parse->upload messages. All are
+# always accepted, so workers can be switched over one at a time:
+PARSE_SERIALIZER = 'ultrasearch_packed' if PACKED_PAYLOADS else 'event_parser_serializer'
+UPLOAD_SERIALIZER = 'ultrasearch_packed' if PACKED_PAYLOADS else 'json'
 
 app = Celery(
     'foo',
@@ -35,77 +47,272 @@ app = Celery(
     backend=os.getenv('RESULT_BACKEND'),
     accept_content=[
         'json',
-        'event_parser_serializer'
+        'event_parser_serializer',
+        'ultrasearch_packed'
     ],
-    task_routes={
-        'ultrasignup_fetcher': {'queue': FETCH_QUEUE},
-        'ahotu_fetcher': {'queue': FETCH_QUEUE},
-        'ultrasignup_parser': {'queue': PARSE_QUEUE},
-        'ahotu_parser': {'queue': PARSE_QUEUE},
-        'ultrasignup_uploader': {'queue': UPLOAD_QUEUE},
-        'ahotu_uploader': {'queue': UPLOAD_QUEUE}
-    }
+    # Generated per source, see ``ingest.registry``:
+    task_routes=registry.task_routes(registry.enabled()),
+    # result_compression only applies to task messages, so stored results
+    # are compressed by their serializer instead:
+    result_serializer='json' if RESULT_COMPRESSION == 'none' else 'ultrasearch_packed'
 )
+# Fetch and parse results reach the next stage in its message, so by
+# default they are not stored:
+IGNORE_INTERMEDIATE = not STORE_INTERMEDIATE_RESULTS
+
+
+@task_postrun.connect
+def on_task_postrun(task_id=None, task=None, **kwargs):
+    # Per-queue expiry, and result bytes per run (run_id is a message header).
+    # Per-source queues, e.g. "fetch.ahotu", count as their stage queue:
+    queue = (task.request.delivery_info or {}).get('routing_key')
+    if queue is not None:
+        queue = registry.stage_queue(queue)
+    apply_result_policy(task.backend, task_id, queue, getattr(task.request, 'run_id', None))
+
+
+@celeryd_after_setup.connect
+def preload_sources(sender=None, instance=None, **kwargs):
+    # Import the sources this worker's queues serve before forking, so the
+    # pool processes share them rather than each importing on first task:
+    registry.preload(instance.app.amqp.queues.consume_from)
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    # Each worker process gets its own clients, created after the fork.
+    # Imported here, so importing the tasks doesn't load supabase:
+    from client import init_pool
+    init_pool()
+
+
+# Skip parse and upload for pages unchanged since their last upload:
+FETCH_CACHE = os.getenv("FETCH_CACHE", "false").lower() == "true"
+
+
+def fetch_cache():
+    return FetchCache(get_redis()) if FETCH_CACHE else None
+
+
+def wait_for_turn(task, source, reserved):
+    """
+    Reserve a politeness token for a fetch. If it is not due yet, re-queue
+    the task with a countdown instead of sleeping in the worker slot, so
+    the slot is free for parse tasks in the meantime. Countdowns never
+    exceed ``RESERVE_HORIZON``.
+    """
+    if reserved:
+        return
+    wait = get_limiter(source).reserve(horizon=RESERVE_HORIZON)
+    if wait is None:
+        # The backlog is too deep to hold a reservation until it is due,
+        # so check back later without one:
+        raise task.retry(countdown=RESERVE_HORIZON, kwargs={**task.request.kwargs, "reserved": False})
+    if wait:
+        raise task.retry(countdown=wait, kwargs={**task.request.kwargs, "reserved": True})
 
-# =============================================================================
-# Ultrasignup tasks:
-# =============================================================================
 
+def finish_fetch(task, batch, cache, run_id, parse_data=None):
+    if (cache is not None) and (run_id is not None):
+        log_stats(run_id, cache.record(run_id, hit=batch is None))
+    if batch is None:
+        # Unchanged page, stop the chain here:
+        stop_chain(task)
+        return None
+    if parse_data is not None:
+        # Fused fetch and parse, saving a broker round trip:
+        batch = parse_data(batch)
+    # Large payloads go to the claim check store, not through the broker:
+    return check_in(batch)
 
-@app.task(name='ultrasignup_fetcher')
-def ultrasignup_fetch(url, request_params):
-    return fetch_ultrasignup_data(
-        url=url,
-        request_params=json.loads(request_params))
 
+def stop_chain(task):
+    task.request.chain = None
+    task.request.callbacks = None
 
-@app.task(
-    name='ultrasignup_parser',
-    serializer='event_parser_serializer')
-def ahotu_parser(batch):
-    return parse_ultrasignup_data(batch)
 
+def resubmit_partitions(task, url, partitions):
+    """
+    Submit the rest of this task's chain again for each partition, each
+    starting with this task for the partition's params.
+    """
+    rest = [signature(sig) for sig in reversed(task.request.chain or [])]
+    for partition in partitions:
+        params = partition.params()
+        stages = [task.signature(
+            kwargs={**task.request.kwargs, "request_params": json.dumps(params), "reserved": False},
+            headers={"run_id": getattr(task.request, "run_id", None)})]
+        for sig in rest:
+            if "fetch_key" in sig.kwargs:
+                # Cache entries are per request:
+                stages.append(sig.clone(kwargs={"fetch_key": fetchcache.fetch_key(url, params)}))
+            else:
+                stages.append(sig.clone())
+        chain(*stages).apply_async()
+    stop_chain(task)
+
+
+def fetch_request(task, source, url, request_params, cache):
+    """
+    Fetch one request. A source with a ``fetch_split`` stage may split a
+    too-broad request instead, replacing this task's chain by one per
+    narrower partition.
+
+    :return: The batch, and whether the request was split instead
+    """
+    params = json.loads(request_params)
+    fetch_split = registry.stage(source, "fetch_split")
+    if fetch_split is None:
+        fetch_data = registry.stage(source, "fetch")
+        return fetch_data(url=url, request_params=params, sleep=0, cache=cache), False
+    batch, partitions = fetch_split(url, params, sleep=0, cache=cache)
+    if partitions:
+        resubmit_partitions(task, url, partitions)
+        return None, True
+    return batch, False
+
+
+def parse_claimed(parse_data, batch):
+    # The fetched page is only needed by the parser, so it is released here:
+    out = check_in(parse_data(check_out(batch)))
+    release(batch)
+    return out
+
+
+def finish_upload(batch, key):
+    # Only now, so a retried upload can still check out its batch:
+    release(batch)
+    cache = fetch_cache()
+    if (cache is not None) and (key is not None):
+        cache.commit(key)
+
+
+def coalesce_upload(source, batch, key, flusher):
+    """
+    Buffer a parsed page instead of uploading it, and schedule ``flusher``
+    once the buffer is full, or when the first page starts the window.
+    """
+    rows = event_list_load(check_out(batch)).todicts()
+    buffered, window_started = Coalescer(source, get_redis()).add(rows, key)
+    release(batch)
+    if buffered >= COALESCE_SIZE:
+        flusher.delay()
+    elif window_started:
+        flusher.apply_async(countdown=COALESCE_WINDOW)
+    return len(rows)
+
+
+def flush_coalesced(task, source, upload_data):
+    # The task id is stable across retries, so a retry re-uploads the same
+    # pages, in order, rather than whatever is buffered by then:
+    coalescer = Coalescer(source, get_redis())
+    items = coalescer.claim(task.request.id)
+    if not items:
+        # Already flushed on size
+        return None
+    rows, fetch_keys = combine(items)
+    try:
+        out = upload_data(rows)
+    except Exception:
+        if task.request.retries >= task.max_retries:
+            # Out of retries: hand the pages to the next flush, rather than
+            # leaving them claimed by this one:
+            pages = coalescer.requeue(task.request.id, len(rows))
+            log.error(
+                f"Flushing {len(rows)} coalesced {source} events failed for good, "
+                f"requeued {pages} pages")
+            task.apply_async(countdown=COALESCE_WINDOW)
+        raise
+    for key in fetch_keys:
+        finish_upload(None, key)
+    coalescer.done(task.request.id)
+    return out
 
-@app.task(
-    name='ultrasignup_uploader',
-    auto_retry_for=(
-        Exception,
-    ),
-    # https://docs.celeryq.dev/en/latest/userguide/tasks.html?highlight=retry#Task.max_retries
-    max_retries=3,
-    # https://docs.celeryq.dev/en/latest/userguide/tasks.html?highlight=retry#Task.retry_backoff
-    retry_backoff=True,
-    # https://docs.celeryq.dev/en/latest/userguide/tasks.html?highlight=retry#Task.max_retries
-    retry_jitter=True)
-def ahotu_uploader(batch):
-    return upload_ultrasignup_data(batch)
 
 # =============================================================================
-# Ahotu tasks:
+# Source tasks:
 # =============================================================================
 
+# Tasks generated for each source, by stage:
+SOURCE_TASKS: Dict[str, Dict[str, Task]] = {}
+
+
+def register_source_tasks(source: str) -> Dict[str, Task]:
+    """
+    Register the fetch, parse and upload tasks for ``source``, named
+    ``<source>_fetcher`` and so on. Its module is only imported when one
+    of them first runs, or when a worker preloads it.
+    """
+    if source in SOURCE_TASKS:
+        return SOURCE_TASKS[source]
 
-@app.task(name='ahotu_fetcher')
-def ahotu_fetch(url, request_params):
-    return fetch_ahotu_data(
-        url=url,
-        request_params=json.loads(request_params))
+    # Politeness retries may repeat while the backlog is deep, so they are not capped:
+    @app.task(name=f'{source}_fetcher', bind=True, ignore_result=IGNORE_INTERMEDIATE, max_retries=None)
+    def fetch(self, url, request_params, run_id=None, reserved=False):
+        # Politeness is shared by all fetch workers, rather than a sleep in each:
+        wait_for_turn(self, source, reserved)
+        cache = fetch_cache()
+        batch, split = fetch_request(self, source, url, request_params, cache)
+        if split:
+            return None
+        return finish_fetch(self, batch, cache, run_id)
 
+    @app.task(name=f'{source}_fetch_parser', bind=True, ignore_result=IGNORE_INTERMEDIATE, max_retries=None)
+    def fetch_parse(self, url, request_params, run_id=None, reserved=False):
+        wait_for_turn(self, source, reserved)
+        cache = fetch_cache()
+        batch, split = fetch_request(self, source, url, request_params, cache)
+        if split:
+            return None
+        return finish_fetch(self, batch, cache, run_id, parse_data=registry.stage(source, "parse"))
 
-@app.task(
-    name='ahotu_parser',
-    serializer='event_parser_serializer')
-def ahotu_parser(batch):
-    return parse_ahotu_data(batch)
+    @app.task(
+        name=f'{source}_parser',
+        serializer=PARSE_SERIALIZER,
+        ignore_result=IGNORE_INTERMEDIATE)
+    def parse(batch):
+        return parse_claimed(registry.stage(source, "parse"), batch)
+
+    @app.task(
+        name=f'{source}_upload_flusher',
+        bind=True,
+        autoretry_for=(
+            Exception,
+        ),
+        max_retries=3,
+        retry_backoff=True,
+        retry_jitter=True)
+    def upload_flush(self):
+        return flush_coalesced(self, source, registry.stage(source, "upload"))
+
+    @app.task(
+        name=f'{source}_uploader',
+        serializer=UPLOAD_SERIALIZER,
+        autoretry_for=(
+            Exception,
+        ),
+        # https://docs.celeryq.dev/en/latest/userguide/tasks.html?highlight=retry#Task.max_retries
+        max_retries=3,
+        # https://docs.celeryq.dev/en/latest/userguide/tasks.html?highlight=retry#Task.retry_backoff
+        retry_backoff=True,
+        # https://docs.celeryq.dev/en/latest/userguide/tasks.html?highlight=retry#Task.max_retries
+        retry_jitter=True)
+    def upload(batch, fetch_key=None):
+        if COALESCE_UPLOADS:
+            return coalesce_upload(source, batch, fetch_key, upload_flush)
+        out = registry.stage(source, "upload")(check_out(batch))
+        finish_upload(batch, fetch_key)
+        return out
+
+    SOURCE_TASKS[source] = {
+        "fetch": fetch,
+        "fetch_parse": fetch_parse,
+        "parse": parse,
+        "upload": upload,
+        "upload_flush": upload_flush
+    }
+    return SOURCE_TASKS[source]
 
 
-@app.task(
-    name='ahotu_uploader',
-    auto_retry_for=(
-        Exception,
-    ),
-    max_retries=3,
-    retry_backoff=True,
-    retry_jitter=True)
-def ahotu_uploader(batch):
-    return upload_ahotu_data(batch)
+for _source in registry.enabled():
+    register_source_tasks(_source)
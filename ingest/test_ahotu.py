@@ -0,0 +1,30 @@
+from ingest import ahotu
+
+
+class FakeResponse:
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+def test_iter_requests_reuses_first_page(monkeypatch):
+    calls = []
+
+    def fake_get(url, params=None):
+        calls.append(params)
+        return FakeResponse({"total_pages": 3, "races": [{"id": 1}]})
+
+    monkeypatch.setenv("SOURCE_AHOTU", "http://example.com")
+    monkeypatch.setattr(ahotu.httpx, "get", fake_get)
+    ingest = ahotu.AhotuIngest()
+    requests = ingest.iter_requests()
+    first = next(requests)
+    # Planned from page 1, without fetching the rest:
+    assert len(calls) == 1
+    assert first.fetch() == [{"id": 1}]
+    assert len(calls) == 1
+    assert [r.params["page"] for r in requests] == [2, 3]
+    assert ingest.params.get("page") is None
@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+from events import Event
+from ingest import bulk
+from ingest.fingerprint import SQLiteFingerprintStore
+
+
+def test_bulk_upload_matches_ids_by_key(monkeypatch):
+    calls = []
+
+    def upsert_rows(client, table, rows, on_conflict, ignore_duplicates=False):
+        calls.append((table, rows, on_conflict))
+        if table == "events":
+            # Returned out of order, with dates as the database formats them:
+            data = [
+                {**row, "id": 100 + i, "start_date": "2023-06-0%d" % (i + 1)}
+                for i, row in enumerate(rows)]
+            return SimpleNamespace(data=data[::-1])
+        return SimpleNamespace(data=rows)
+
+    monkeypatch.setattr(bulk, "upsert_rows", upsert_rows)
+    monkeypatch.setattr(bulk, "fingerprint_store", lambda: SQLiteFingerprintStore(":memory:"))
+    monkeypatch.setattr(bulk.reference_data, "unit_id", lambda unit, client=None: 1)
+
+    events = [
+        Event(name="A 50", start_date="6/1/2023", city="X", state="CA", country="USA", distances=["50 mi"]),
+        Event(name="B 100", start_date="6/2/2023", city="Y", state="CA", country="USA", distances=["100 mi"]),
+    ]
+    bulk.bulk_upload(events, client=None, key=("name", "start_date", "city", "state"), source_id=1)
+
+    table, rows, on_conflict = calls[0]
+    assert table == "events"
+    assert on_conflict == bulk.EVENT_KEY
+    assert all(row["source_id"] == 1 for row in rows)
+    distances = {row["distance"]: row["event_id"] for row in calls[1][1]}
+    assert distances == {50: 100, 100: 101}
@@ -0,0 +1,57 @@
+import json
+import os
+
+import fakeredis
+import pytest
+
+from ingest import claimcheck
+from ingest.claimcheck import (
+    FileClaimStore, RedisClaimStore, approx_size, check_in, check_out, is_claim, release)
+
+rows = [{"name": f"Event {i}", "distances": ["50K"]} for i in range(100)]
+
+
+@pytest.fixture(params=["redis", "file"])
+def store(request, tmp_path):
+    if request.param == "redis":
+        return RedisClaimStore(fakeredis.FakeRedis())
+    return FileClaimStore(str(tmp_path))
+
+
+def test_small_payload_passes_through(store):
+    assert check_in(rows[:1], store, threshold=1 << 20) == rows[:1]
+
+
+def test_small_payload_is_not_packed(store, monkeypatch):
+    def packb(payload):
+        raise AssertionError("packed a payload below the threshold")
+
+    monkeypatch.setattr(claimcheck, "packb", packb)
+    assert check_in(rows, store, threshold=1 << 20) == rows
+    assert check_in("x" * 100, store, threshold=1 << 20) == "x" * 100
+
+
+def test_approx_size():
+    exact = len(json.dumps(rows))
+    assert 0.9 * exact < approx_size(rows) < 1.1 * exact
+    assert approx_size(rows[:3]) == len(json.dumps(rows[:3]))
+    assert approx_size("abc") == 3
+
+
+def test_claim_round_trip(store):
+    ref = check_in(rows, store, threshold=0)
+    assert is_claim(ref)
+    assert check_out(ref, store) == rows
+    # Released once consumed:
+    release(ref, store)
+    with pytest.raises(KeyError):
+        check_out(ref, store)
+
+
+def test_file_store_sweep(tmp_path):
+    store = FileClaimStore(str(tmp_path), ttl=60)
+    ref = check_in(rows, store, threshold=0)
+    old = os.path.join(str(tmp_path), f"{ref['__claim__']}.claim")
+    os.utime(old, (0, 0))
+    assert store.sweep() == 1
+    assert not os.listdir(str(tmp_path))
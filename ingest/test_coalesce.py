@@ -0,0 +1,49 @@
+import fakeredis
+
+from ingest.coalesce import COALESCE_CLAIM_TTL, Coalescer, combine
+
+
+def page(i, n=2):
+    return [{"name": f"Event {i}.{j}"} for j in range(n)]
+
+
+def test_add_counts_and_starts_window():
+    coalescer = Coalescer("ahotu", fakeredis.FakeRedis(), window=10)
+    assert coalescer.add(page(0), "k0") == (2, True)
+    assert coalescer.add(page(1), "k1") == (4, False)
+
+
+def test_claim_is_fifo_and_retry_safe():
+    coalescer = Coalescer("ahotu", fakeredis.FakeRedis(), window=10)
+    for i in range(3):
+        coalescer.add(page(i), f"k{i}")
+    items = coalescer.claim("flush-1")
+    rows, fetch_keys = combine(items)
+    assert [row["name"] for row in rows] == [row["name"] for i in range(3) for row in page(i)]
+    assert fetch_keys == ["k0", "k1", "k2"]
+
+    # Pages arriving meanwhile start a new buffer and window:
+    assert coalescer.add(page(3), "k3") == (2, True)
+    # A retried flush gets the same pages back:
+    assert coalescer.claim("flush-1") == items
+    coalescer.done("flush-1")
+    assert combine(coalescer.claim("flush-2"))[1] == ["k3"]
+
+
+def test_claim_empty():
+    coalescer = Coalescer("ultrasignup", fakeredis.FakeRedis())
+    assert coalescer.claim("flush-1") == []
+
+
+def test_claim_expires_and_requeues():
+    coalescer = Coalescer("ahotu", fakeredis.FakeRedis(), window=10)
+    coalescer.add(page(0), "k0")
+    coalescer.add(page(1), "k1")
+    items = coalescer.claim("flush-1")
+    assert 0 < coalescer.client.ttl(f"{coalescer.processing_prefix}:flush-1") <= COALESCE_CLAIM_TTL
+    coalescer.add(page(2), "k2")
+    # Back ahead of the page that arrived since:
+    assert coalescer.requeue("flush-1", 4) == 2
+    assert coalescer.add(page(3), "k3")[0] == 8
+    assert coalescer.claim("flush-2")[:2] == items
+    assert not coalescer.client.exists(f"{coalescer.processing_prefix}:flush-1")
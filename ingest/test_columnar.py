@@ -0,0 +1,59 @@
+import pytest
+
+from ingest import ahotu, ultrasignup
+from ingest.ahotu import has_virtual_tag
+from ingest.parser import distance_parser
+
+# Shaped like the sources' API responses, including the gaps they have:
+ULTRASIGNUP_BATCH = [
+    {
+        "EventId": 101, "EventName": "Rocky Raccoon 100", "EventWebsite": "https://example.com/rr",
+        "EventDate": "2/3/2024", "Distances": "100 Miler, 100K, 50 Miler", "City": "Huntsville",
+        "State": "TX", "Latitude": "30.6", "Longitude": "-95.5", "VirtualEvent": False
+    },
+    {
+        "EventId": 102, "EventName": "Virtual 50K", "EventWebsite": None,
+        "EventDate": "3/1/2024", "Distances": None, "City": None,
+        "State": None, "Latitude": None, "Longitude": None, "VirtualEvent": True
+    },
+    {
+        "EventId": 103, "EventName": "Wrapped", "EventWebsite": "https://example.com/w",
+        "EventDate": "4/1/2024", "Distances": "50K", "City": "Nowhere",
+        "State": "NV", "Latitude": 120.0, "Longitude": -200.0, "VirtualEvent": False
+    },
+]
+
+AHOTU_BATCH = [
+    {
+        "id": 1, "event_name_en": "Ultra Trail du Mont Blanc", "registration_url": "https://example.com/utmb",
+        "start_date": "2024-08-26", "activities": [{"distance": 171, "distance_unit_id": 1}],
+        "country": "France", "city": "Chamonix",
+        "lonlat": {"type": "Point", "coordinates": [6.87, 45.92]}, "tags": ["trail", "ultra"]
+    },
+    {
+        "id": 2, "event_name_en": "Virtual 100K", "registration_url": None,
+        "start_date": "2024-05-01", "activities": [{"distance": 100000, "distance_unit_id": 2}],
+        "country": None, "city": None, "lonlat": None, "tags": ["virtual"]
+    },
+    {
+        "id": 3, "event_name_en": "No tags", "registration_url": None,
+        "start_date": "2024-06-01", "activities": [{"distance": 24, "distance_unit_id": 5}],
+        "country": "USA", "city": "Boulder", "lonlat": {"type": "Point"}, "tags": None
+    },
+]
+
+
+@pytest.mark.parametrize("mapping, batch", [
+    (ultrasignup.MAPPING, ULTRASIGNUP_BATCH),
+    (ahotu.MAPPING, AHOTU_BATCH)
+], ids=["ultrasignup", "ahotu"])
+def test_columnar_matches_row_wise(mapping, batch):
+    rows = mapping.parse(batch)
+    columns = mapping.parse(batch, columnar=True)
+    assert columns == rows
+    assert [e.todict() for e in columns] == [e.todict() for e in rows]
+
+
+def test_missing_values():
+    assert has_virtual_tag(None) is False
+    assert distance_parser(None) == []
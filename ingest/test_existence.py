@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+
+from events import Event
+from ingest.existence import EventIndex, KnownEvents, normalize_date, normalize_key
+
+KEY = ("name", "start_date", "city", "state")
+
+
+class FakeQuery:
+    """ Just enough of a PostgREST select for ``EventIndex.build``. """
+
+    def __init__(self, rows, calls):
+        self.rows = rows
+        self.calls = calls
+        self.filters = []
+        self.bounds = (0, None)
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row[column] == value)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: row[column] >= value)
+        return self
+
+    def lte(self, column, value):
+        self.filters.append(lambda row: row[column] <= value)
+        return self
+
+    def order(self, column):
+        self.rows = sorted(self.rows, key=lambda row: row[column])
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end + 1)
+        return self
+
+    def execute(self):
+        self.calls.append(self.bounds)
+        rows = [row for row in self.rows if all(f(row) for f in self.filters)]
+        return SimpleNamespace(data=rows[slice(*self.bounds)])
+
+
+class FakeClient:
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    def table(self, name):
+        return FakeQuery(self.rows, self.calls)
+
+
+def row(id, name, start_date, source_id=1):
+    return dict(id=id, name=name, start_date=start_date, city="X", state="CA", source_id=source_id)
+
+
+def event(name, start_date):
+    return Event(name=name, start_date=start_date, city="X", state="CA")
+
+
+def test_normalize():
+    assert normalize_date("6/1/2023") == "2023-06-01"
+    assert normalize_date("2023-06-01T00:00:00") == "2023-06-01"
+    assert normalize_date(None) is None
+    assert normalize_key({"name": "A", "start_date": "nope"}, ("name", "start_date")) is None
+
+
+def test_index_hits_and_authoritative_misses():
+    client = FakeClient([row(1, "A", "2023-06-01"), row(2, "B", "2023-06-03"), row(3, "A", "2023-06-01", source_id=2)])
+    batch = [event("A", "6/1/2023"), event("C", "6/2/2023"), event("B", "2023-06-03")]
+    index = EventIndex.build(client, batch, key=KEY, source_id=1, known=KnownEvents())
+    assert index.get(batch[0]) == 1
+    assert index.get(batch[2]) == 2
+    # Inside the queried window, so a miss means a new event:
+    assert index.get(batch[1]) is None
+    assert index.covers(batch[1])
+    assert not index.covers(event("D", "2023-07-01"))
+    assert not index.covers(event("E", "not a date"))
+
+
+def test_index_pages_and_remembers(monkeypatch):
+    monkeypatch.setattr("ingest.existence.PAGE_SIZE", 2)
+    known = KnownEvents()
+    client = FakeClient([row(i, f"R{i}", "2023-06-01") for i in range(5)])
+    batch = [event(f"R{i}", "2023-06-01") for i in range(5)]
+    index = EventIndex.build(client, batch, key=KEY, source_id=1, known=known)
+    assert [index.get(e) for e in batch] == list(range(5))
+    assert len(client.calls) == 3
+    # Every key is known to this worker now, so no query:
+    EventIndex.build(client, batch, key=KEY, source_id=1, known=known)
+    assert len(client.calls) == 3
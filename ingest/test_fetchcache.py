@@ -0,0 +1,71 @@
+import json
+
+import fakeredis
+import httpx
+import pytest
+
+from ingest import fetchcache
+from ingest.fetchcache import FetchCache, fetch_key
+
+URL = "https://example.com/events"
+PARAMS = {"m": 1, "dist": 2}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """ Serves ``body``, honouring ``If-None-Match`` when ``etag`` is set. """
+    state = {"body": [{"EventId": 1}], "etag": None, "requests": []}
+
+    def get(url, params=None, headers=None):
+        state["requests"].append(headers)
+        request = httpx.Request("GET", url)
+        if state["etag"] and headers.get("If-None-Match") == state["etag"]:
+            return httpx.Response(304, request=request)
+        response_headers = {"etag": state["etag"]} if state["etag"] else {}
+        return httpx.Response(
+            200, content=json.dumps(state["body"]).encode(), headers=response_headers, request=request)
+
+    monkeypatch.setattr(fetchcache.httpx, "get", get)
+    return state
+
+
+@pytest.fixture
+def cache():
+    return FetchCache(fakeredis.FakeRedis())
+
+
+def test_fetch_key_ignores_param_order():
+    assert fetch_key(URL, {"a": 1, "b": 2}) == fetch_key(URL, {"b": 2, "a": 1})
+    assert fetch_key(URL, {"a": 1}) != fetch_key(URL, {"a": 2})
+
+
+def test_unchanged_only_after_commit(server, cache):
+    assert cache.fetch(URL, PARAMS) == server["body"]
+    # The upload has not succeeded yet, so the page is fetched again:
+    assert cache.fetch(URL, PARAMS) == server["body"]
+    cache.commit(fetch_key(URL, PARAMS))
+    assert cache.fetch(URL, PARAMS) is None
+    # A changed body is returned, and pending until committed:
+    server["body"] = [{"EventId": 2}]
+    assert cache.fetch(URL, PARAMS) == server["body"]
+    assert cache.fetch(URL, PARAMS) == server["body"]
+
+
+def test_conditional_request(server, cache):
+    server["etag"] = '"v1"'
+    cache.fetch(URL, PARAMS)
+    cache.commit(fetch_key(URL, PARAMS))
+    assert cache.fetch(URL, PARAMS) is None
+    assert server["requests"][-1] == {"If-None-Match": '"v1"'}
+
+
+def test_commit_without_pending(cache):
+    cache.commit("nothing")
+
+
+def test_hit_rate(cache):
+    assert cache.stats("run")["hit_rate"] == 0.0
+    cache.record("run", hit=True)
+    cache.record("run", hit=False)
+    stats = cache.record("run", hit=True)
+    assert stats == {"hits": 2, "misses": 1, "hit_rate": pytest.approx(2 / 3)}
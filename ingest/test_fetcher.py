@@ -0,0 +1,82 @@
+import asyncio
+
+import httpx
+
+from ingest.fetcher import AsyncFetcher
+from ingest.ratelimit import LocalTokenBucket
+from ingest.ultrarequest import UltraRequest
+
+
+class Request(UltraRequest):
+
+    def __init__(self, url, params, payload=None):
+        super().__init__(params, payload)
+        self.url = url
+
+    def fetch(self, limiter=None):
+        raise NotImplementedError
+
+
+class Server:
+    """ Records when each request starts and how many are in flight. """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.starts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, request):
+        loop = asyncio.get_running_loop()
+        self.starts.append((request.url.host, loop.time()))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        return httpx.Response(200, json=[{"page": request.url.params["page"]}])
+
+
+def requests(host, n):
+    return [Request(f"http://{host}/events", {"page": i}) for i in range(n)]
+
+
+def gaps(server, host):
+    times = [t for h, t in server.starts if h == host]
+    return [b - a for a, b in zip(times, times[1:])]
+
+
+def test_host_scheduler_spaces_starts():
+    server = Server()
+    fetcher = AsyncFetcher(interval=0.05, transport=httpx.MockTransport(server))
+    results = fetcher.fetch_all(requests("a.example.com", 3) + requests("b.example.com", 2))
+    assert [r.batch for r in results[:3]] == [[{"page": str(i)}] for i in range(3)]
+    assert all(gap >= 0.045 for gap in gaps(server, "a.example.com"))
+    # Hosts are paced independently:
+    a, b = [min(t for h, t in server.starts if h == host) for host in ("a.example.com", "b.example.com")]
+    assert abs(a - b) < 0.045
+
+
+def test_per_host_cap():
+    server = Server(delay=0.05)
+    fetcher = AsyncFetcher(concurrency=2, interval=0, transport=httpx.MockTransport(server))
+    results = fetcher.fetch_all(requests("a.example.com", 6))
+    assert all(r.error is None for r in results)
+    assert server.max_in_flight == 2
+
+
+def test_limiter_paces_requests():
+    server = Server()
+    limiter = LocalTokenBucket("test", rate=20.0, burst=1)
+    fetcher = AsyncFetcher(interval=0, limiter=limiter, transport=httpx.MockTransport(server))
+    fetcher.fetch_all(requests("a.example.com", 3))
+    assert all(gap >= 0.04 for gap in gaps(server, "a.example.com"))
+
+
+def test_prefetched_payload_skips_request():
+    server = Server()
+    fetcher = AsyncFetcher(transport=httpx.MockTransport(server))
+    prefetched = Request("http://a.example.com/events", {"page": 1}, payload=[{"page": "1"}])
+    [result] = fetcher.fetch_all([prefetched])
+    assert result.batch == [{"page": "1"}]
+    assert server.starts == []
+
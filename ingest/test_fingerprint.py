@@ -0,0 +1,59 @@
+import fakeredis
+import pytest
+
+from events import Event
+from ingest.fingerprint import RedisFingerprintStore, SQLiteFingerprintStore, event_fingerprint
+
+j1 = {
+    "source_id": 1,
+    "name": "Event 1",
+    "start_date": "2020-01-01",
+    "city": "New York",
+    "state": "NY",
+    "country": "USA",
+    "latitude": 40.7,
+    "longitude": -74.0,
+    "distances": ["50K", "100 Miler"]
+}
+
+
+def test_fingerprint_stable():
+    assert event_fingerprint(Event(**j1)) == event_fingerprint(Event(**j1))
+    reordered = Event(**{**j1, "distances": ["100 Miler", "50K"]})
+    assert event_fingerprint(reordered) == event_fingerprint(Event(**j1))
+
+
+def test_fingerprint_changes():
+    base = event_fingerprint(Event(**j1))
+    assert event_fingerprint(Event(**{**j1, "city": "Brooklyn"})) != base
+    assert event_fingerprint(Event(**{**j1, "distances": ["50K"]})) != base
+    # Fields outside the public schema do not matter:
+    assert event_fingerprint(Event(**{**j1, "event_foreign_id": 123})) == base
+
+
+@pytest.mark.parametrize("store", [
+    SQLiteFingerprintStore(":memory:"),
+    RedisFingerprintStore(fakeredis.FakeRedis())
+], ids=["sqlite", "redis"])
+def test_store_round_trip(store):
+    key = ("Event 1", "2020-01-01", "New York", "NY")
+    assert store.get(1, key) is None
+    store.put(1, key, 10, "abc")
+    assert store.get(1, key) == "abc"
+    assert store.get(2, key) is None
+    store.put_many(1, [(key, 10, "def"), (None, 11, "ghi")])
+    assert store.get(1, key) == "def"
+    assert store.get(1, None) is None
+    other = ("Event 2", "2020-01-02", "Boston", "MA")
+    store.put(1, other, 12, "jkl")
+    assert store.get_many(1, [key, other, ("missing",)]) == {key: "def", other: "jkl"}
+
+
+def test_store_defaults_to_sqlite_without_redis(monkeypatch, tmp_path):
+    from ingest import fingerprint
+
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    monkeypatch.delenv("RESULT_BACKEND", raising=False)
+    monkeypatch.setattr(fingerprint, "_store", None)
+    monkeypatch.setattr(fingerprint, "FINGERPRINT_DB", str(tmp_path / "fingerprints.db"))
+    assert isinstance(fingerprint.fingerprint_store(), SQLiteFingerprintStore)
@@ -0,0 +1,27 @@
+from ingest.mapping import SourceMapping
+from ingest.parser import identity
+
+mapping = SourceMapping(
+    schema_mapping={
+        "source_id": (None, identity),
+        "name": ("Name", identity),
+        "city": ("City", str.title),
+        "latitude": ("Lat", float),
+        "country": (None, identity)
+    },
+    unmapped_defaults={"source_id": 9, "country": "USA"})
+
+
+def test_transform():
+    row = mapping.transform({"Name": "Race", "City": "new york", "Lat": "40.5", "Other": 1})
+    assert row == {"source_id": 9, "name": "Race", "city": "New York", "latitude": 40.5, "country": "USA"}
+
+
+def test_parse_row_and_columnar_agree():
+    batch = [{"Name": f"Race {i}", "City": "boulder", "Lat": i} for i in range(3)]
+    assert mapping.parse(batch) == mapping.parse(batch, columnar=True)
+
+
+def test_single_field():
+    single = SourceMapping({"name": ("Name", identity)}, {})
+    assert single.transform({"Name": "Race"}) == {"name": "Race"}
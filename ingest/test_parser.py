@@ -1,4 +1,4 @@
-from ingest.parser import distance_extract
+from ingest.parser import distance_extract, distance_extract_many, distance_normalize
 
 
 def test_distance_extract():
@@ -39,6 +39,38 @@ def test_special():
     assert distance_extract("1/2 marathon") == {"unit": "mile", "length": 13.1}
 
 
+def test_distance_extract_many():
+    assert distance_extract_many(["50K", "marathon", "50K", "unknown"]) == [
+        {"unit": "km", "length": 50},
+        {"unit": "mile", "length": 26.2},
+        {"unit": "km", "length": 50},
+        None
+    ]
+    assert distance_extract_many([]) == []
+
+
+def test_cached_results_are_copies():
+    first = distance_extract("100 Miler")
+    first["length"] = 0
+    assert distance_extract("100 Miler") == {"unit": "mile", "length": 100}
+
+
+def test_fallback_matches_last_number_and_unit():
+    assert distance_extract("2x 50k") == {"unit": "km", "length": 50}
+    assert distance_extract("100 Mile - 5 Person Relay") is None
+    assert distance_extract("12 hour 9AM") is None
+
+
+def test_distance_normalize():
+    assert distance_normalize({"length": 50, "unit": "km"}) == {"unit": "km", "length": 50.0}
+    assert distance_normalize({"length": 50, "unit": "furlong"}) is None
+    assert distance_normalize("50K") == {"unit": "km", "length": 50}
+    assert distance_extract_many([{"length": 26.2, "unit": "mile"}, "50K"]) == [
+        {"unit": "mile", "length": 26.2},
+        {"unit": "km", "length": 50}
+    ]
+
+
 # 55k run
 # 100-mile Solo Event
 # 99-mile Relay Event
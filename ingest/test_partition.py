@@ -0,0 +1,87 @@
+import fakeredis
+import pytest
+
+from ingest.partition import (
+    HALF_CIRCUMFERENCE, FilePlanStore, Partition, RedisPlanStore, plan, record_count, record_split)
+
+root = Partition(months=tuple(range(1, 13)), dists=(1, 2, 3), lat=30, lng=-100, mi=400)
+
+
+def test_params_round_trip():
+    assert Partition.from_params(root.params()) == root
+    single = root._replace(months=(5,), dists=(2,))
+    assert single.params()["m"] == 5
+    assert single.params()["dist"] == 2
+
+
+def test_split_order():
+    months = root.split()
+    assert [p.months for p in months] == [tuple(range(1, 7)), tuple(range(7, 13))]
+    single_month = root._replace(months=(1,))
+    assert [p.dists for p in single_month.split()] == [(1,), (2, 3)]
+    geo = root._replace(months=(1,), dists=(1,)).split()
+    assert len(geo) == 4
+    assert all(p.mi < root.mi for p in geo)
+    assert sorted({p.lat > root.lat for p in geo}) == [False, True]
+
+
+@pytest.fixture(params=["file", "redis"])
+def store(request, tmp_path):
+    if request.param == "file":
+        return FilePlanStore(str(tmp_path / "plan.json"))
+    return RedisPlanStore(fakeredis.FakeRedis())
+
+
+def test_plan_remembers_and_merges(store):
+    assert plan(store, root, cap=100) == [root]
+
+    children = record_split(store, root)
+    assert set(plan(store, root, cap=100)) == set(children)
+    # Dense siblings are kept:
+    record_count(store, children[0], 60)
+    record_count(store, children[1], 30)
+    assert set(plan(store, root, cap=100)) == set(children)
+    # Sparse siblings are merged back into their parent:
+    record_count(store, children[0], 10)
+    assert plan(store, root, cap=100) == [root]
+
+
+def test_fetch_partitioned_splits_saturated(tmp_path, monkeypatch):
+    from ingest import ultrasignup
+
+    store = FilePlanStore(str(tmp_path / "plan.json"))
+    monkeypatch.setattr(ultrasignup, "partition_store", lambda: store)
+
+    def fake_fetch(url, request_params, sleep=5, cache=None, limiter=None):
+        months = Partition.from_params(request_params).months
+        # 20 events per month, so only two months fit under the cap:
+        payload = [{"EventId": m * 100 + i} for m in months for i in range(20)][:ultrasignup.RESULT_CAP]
+        return ultrasignup.process_response(payload, request_params)
+
+    monkeypatch.setattr(ultrasignup, "fetch_data", fake_fetch)
+    batch = ultrasignup.fetch_partitioned("http://example.com", root.params(), sleep=0)
+    assert len(batch) == 12 * 20
+    leaves = plan(store, root, cap=ultrasignup.RESULT_CAP)
+    assert sorted(m for p in leaves for m in p.months) == list(range(1, 13))
+
+
+def test_split_world():
+    from ingest.ultrasignup import ROOT_PARTITION
+
+    leaves, queue = [], [ROOT_PARTITION]
+    while queue:
+        partition = queue.pop()
+        if len(partition.months) > 1 or len(partition.dists) > 1:
+            queue.extend(partition.split())
+        else:
+            leaves.append(partition)
+    assert len(leaves) == 12 * 12
+    hemispheres = leaves[0].split()
+    assert len(hemispheres) == 2
+    assert all(p.mi < HALF_CIRCUMFERENCE for p in hemispheres)
+    assert {(p.lat, p.lng) for p in hemispheres} == {(30, -100), (-30, 80)}
+    circles = hemispheres
+    for _ in range(3):
+        circles = [child for p in circles for child in p.split()]
+        assert all(-90 <= p.lat <= 90 and -180 <= p.lng < 180 for p in circles)
+    assert len(circles) == 2 * 4 ** 3
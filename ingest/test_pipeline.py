@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+from client import ClientPool
+from ingest.pipeline import Pipeline
+
+
+class FakeRequest:
+
+    def __init__(self, i, fail=False):
+        self.params = {"page": i}
+        self.fail = fail
+
+    def fetch(self, limiter=None):
+        if limiter is not None:
+            limiter.acquire()
+        time.sleep(0.01)
+        if self.fail:
+            raise IOError("unreachable")
+        return [{"page": self.params["page"]}]
+
+
+class FakeIngest:
+
+    def __init__(self, fail_upload=False):
+        self.uploaded = []
+        self.fail_upload = fail_upload
+        self._lock = threading.Lock()
+
+    def parse(self, batch, columnar=False):
+        return batch
+
+    def upload(self, parsed_batch, client, bulk=False):
+        if self.fail_upload:
+            raise ValueError("bad batch")
+        with self._lock:
+            self.uploaded.extend(parsed_batch)
+
+
+def pool():
+    return ClientPool(size=2, factory=object)
+
+
+def test_pipeline_uploads_everything():
+    ingest = FakeIngest()
+    requests = [FakeRequest(i, fail=(i == 3)) for i in range(20)]
+    stats = Pipeline(ingest, fetchers=4, uploaders=2, queue_size=2, pool=pool()).run(iter(requests))
+    assert sorted(row["page"] for row in ingest.uploaded) == [i for i in range(20) if i != 3]
+    assert stats == {"fetched": 19, "parsed": 19, "uploaded": 19, "fetch_errors": 1}
+
+
+def test_pipeline_stops_on_upload_error():
+    requests = [FakeRequest(i) for i in range(50)]
+    with pytest.raises(ValueError):
+        Pipeline(FakeIngest(fail_upload=True), queue_size=1, pool=pool()).run(requests)
+
+
+class CountingLimiter:
+
+    def __init__(self):
+        self.tokens = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        with self._lock:
+            self.tokens += 1
+
+
+def test_pipeline_fetches_share_the_limiter():
+    limiter = CountingLimiter()
+    requests = [FakeRequest(i) for i in range(10)]
+    Pipeline(FakeIngest(), fetchers=4, pool=pool(), limiter=limiter).run(requests)
+    assert limiter.tokens == 10
@@ -0,0 +1,53 @@
+import fakeredis
+import pytest
+
+from ingest import ratelimit
+from ingest.ratelimit import LocalTokenBucket, TokenBucket
+
+
+@pytest.fixture(params=["redis", "local"])
+def bucket(request):
+    if request.param == "redis":
+        return TokenBucket("test", rate=1.0, burst=2, client=fakeredis.FakeRedis())
+    return LocalTokenBucket("test", rate=1.0, burst=2)
+
+
+def test_try_acquire_burst(bucket):
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    wait = bucket.try_acquire()
+    assert 0 < wait <= 1
+
+
+def test_reserve_queues_ahead(bucket):
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    waits = [bucket.reserve() for _ in range(3)]
+    assert waits == sorted(waits)
+    assert waits[-1] == pytest.approx(3, abs=0.1)
+
+
+def test_reserve_horizon(bucket):
+    for _ in range(5):
+        bucket.reserve(horizon=None)
+    # The next token is due in ~4s, past the horizon, so nothing is taken:
+    assert bucket.reserve(horizon=2) is None
+    assert bucket.reserve(horizon=2) is None
+    assert bucket.reserve(horizon=10) == pytest.approx(4, abs=0.1)
+
+
+def test_acquire_timeout(bucket):
+    bucket.reserve(horizon=None)
+    bucket.reserve(horizon=None)
+    bucket.reserve(horizon=None)
+    with pytest.raises(TimeoutError):
+        bucket.acquire(timeout=0.5)
+
+
+def test_get_limiter_without_redis(monkeypatch):
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    monkeypatch.delenv("RESULT_BACKEND", raising=False)
+    monkeypatch.setattr(ratelimit, "_limiters", {})
+    limiter = ratelimit.get_limiter("test")
+    assert isinstance(limiter, LocalTokenBucket)
+    assert ratelimit.get_limiter("test") is limiter
@@ -0,0 +1,69 @@
+import pytest
+
+from ingest.refdata import ReferenceData
+
+
+class FakeResponse:
+
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeTable:
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def select(self, columns):
+        return self
+
+    def execute(self):
+        self.client.calls += 1
+        return FakeResponse(self.client.tables[self.name])
+
+
+class FakeClient:
+
+    def __init__(self):
+        self.calls = 0
+        self.tables = {
+            "distance_units": [{"id": 1, "unit_name": "mile"}, {"id": 2, "unit_name": "km"}],
+            "sources": [{"id": 1, "name": "UltraSignup"}, {"id": 2, "name": "Ahotu"}]
+        }
+
+    def table(self, name):
+        return FakeTable(self, name)
+
+
+def test_lookups_are_cached():
+    client = FakeClient()
+    refdata = ReferenceData(ttl=3600)
+    assert refdata.unit_id("km", client=client) == 2
+    assert refdata.unit_id("mile", client=client) == 1
+    assert refdata.source_id("Ahotu", client=client) == 2
+    assert client.calls == 2
+
+
+def test_miss_refreshes_once():
+    client = FakeClient()
+    refdata = ReferenceData(ttl=3600)
+    refdata.unit_id("km", client=client)
+    client.tables["distance_units"].append({"id": 3, "unit_name": "hour"})
+    assert refdata.unit_id("hour", client=client) == 3
+    assert client.calls == 4
+    with pytest.raises(ValueError):
+        refdata.unit_id("furlong", client=client)
+    assert client.calls == 6
+
+
+def test_invalidate_and_ttl():
+    client = FakeClient()
+    refdata = ReferenceData(ttl=3600)
+    refdata.source_id("UltraSignup", client=client)
+    refdata.invalidate()
+    refdata.source_id("UltraSignup", client=client)
+    assert client.calls == 4
+    refdata.ttl = 0
+    refdata.source_id("UltraSignup", client=client)
+    assert client.calls == 6
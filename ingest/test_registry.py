@@ -0,0 +1,39 @@
+import pytest
+
+from ingest import registry
+
+
+def test_routes_shared_stage_queues():
+    routes = registry.task_routes(["ultrasignup", "ahotu"])
+    assert len(routes) == 10
+    assert routes["ahotu_parser"] == {"queue": "parse"}
+    assert routes["ultrasignup_upload_flusher"] == {"queue": "upload"}
+
+
+def test_per_source_queues(monkeypatch):
+    monkeypatch.setattr(registry, "PER_SOURCE_QUEUES", True)
+    routes = registry.source_routes("ahotu")
+    assert routes["ahotu_fetcher"] == {"queue": "fetch.ahotu"}
+    assert routes["ahotu_fetch_parser"] == {"queue": "fetch.ahotu"}
+    assert registry.sources_for_queues(["parse.ahotu", "celery"]) == ["ahotu"]
+    assert registry.stage_queue(routes["ahotu_uploader"]["queue"]) == "upload"
+
+
+def test_shared_queues_need_every_source():
+    assert registry.sources_for_queues(["upload"]) == ["ultrasignup", "ahotu"]
+    assert registry.sources_for_queues(["celery"]) == []
+
+
+def test_enabled(monkeypatch):
+    monkeypatch.setattr(registry, "ENABLED_SOURCES", ["ahotu"])
+    assert registry.enabled() == ["ahotu"]
+    monkeypatch.setattr(registry, "ENABLED_SOURCES", ["nope"])
+    with pytest.raises(ValueError):
+        registry.enabled()
+
+
+def test_stage_lookup():
+    from ingest.ultrasignup import fetch_or_split, parse_data
+    assert registry.stage("ultrasignup", "parse") is parse_data
+    assert registry.stage("ultrasignup", "fetch_split") is fetch_or_split
+    assert registry.stage("ahotu", "fetch_split") is None
@@ -0,0 +1,133 @@
+import pytest
+
+from ingest import resolve as resolve_module
+from ingest.resolve import (
+    DisjointSet, cell, cell_size, links, name_similarity, name_tokens, neighbourhood, resolve, upload_links)
+
+
+def row(id, source_id, name, start_date, latitude=39.1, longitude=-120.2, **kwargs):
+    return dict(
+        id=id, source_id=source_id, name=name, start_date=start_date,
+        latitude=latitude, longitude=longitude, **kwargs)
+
+
+def test_cells():
+    assert cell_size(4) == (0.17578125, 0.3515625)
+    cells = neighbourhood(57.64911, 10.40744, 4)
+    assert len(cells) == 9
+    assert cell(57.7, 10.1, 4) in cells
+    # Wraps at the antimeridian, and stops at the poles:
+    assert cell(10.0, -179.9, 4) in neighbourhood(10.0, 179.9, 4)
+    assert len(neighbourhood(90.0, 0.0, 4)) == 6
+
+
+def test_name_similarity():
+    a = name_tokens("The 10th Annual Western States 100")
+    assert name_similarity(a, name_tokens("Western States 100 2023")) == 1.0
+    assert name_similarity(a, name_tokens("Westren States 100 Mile")) >= 0.8
+    assert name_similarity(a, name_tokens("Lake Tahoe 50K")) < 0.5
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Rocky Raccoon 50", "Rocky Raccoon 100"),
+    ("Javelina Jundred 100K", "Javelina Jundred 100M"),
+    ("Boston Marathon", "Boston Half Marathon"),
+])
+def test_name_similarity_distances_differ(a, b):
+    assert name_similarity(name_tokens(a), name_tokens(b)) == 0.0
+
+
+def test_name_tokens_distances():
+    assert name_tokens("Western States 100 Mile Endurance Run") == (("states", "western"), {(100.0, "mile")})
+    assert name_tokens("Three Peaks 50K").distances == {(50.0, "km")}
+    assert name_tokens("Boston Marathon").distances == {(26.2, "mile")}
+    assert name_tokens("The 10th Annual Canyons").distances == set()
+    # A bare number matches that length in any unit, and units convert:
+    assert name_similarity(name_tokens("Canyons 100"), name_tokens("Canyons 100K")) == 1.0
+    assert name_similarity(name_tokens("Canyons 100K"), name_tokens("Canyons 62.1 Miles")) == 1.0
+
+
+def test_disjoint_set():
+    sets = DisjointSet(4)
+    sets.union(0, 1)
+    sets.union(2, 1)
+    assert sorted(map(sorted, sets.groups())) == [[0, 1, 2], [3]]
+
+
+def test_links_duplicates_across_sources():
+    rows = [
+        row(1, 1, "Western States 100", "2023-06-24", city="Olympic Valley"),
+        row(2, 2, "Western States 100 Mile Endurance Run", "6/24/2023", latitude=39.15, longitude=-120.25),
+        row(3, 2, "Western States 100", "2023-06-26"),
+        row(4, 2, "Western States 100", "2023-06-24", latitude=45.0),
+        row(5, 1, "Lake Tahoe 50K", "2023-06-24"),
+    ]
+    resolution = resolve(rows)
+    # Only the second row is close enough in date, place and name:
+    assert links(rows, resolution) == {2: 1}
+    assert len(resolution.clusters) == 4
+
+
+def test_same_source_not_linked_by_default():
+    rows = [row(1, 1, "Canyons 100K", "2023-04-22"), row(2, 1, "Canyons 100K", "2023-04-22")]
+    assert links(rows, resolve(rows)) == {}
+    assert links(rows, resolve(rows, cross_source=False)) == {2: 1}
+
+
+def test_one_row_per_source_in_a_race():
+    rows = [
+        row(1, 1, "Rocky Raccoon 100", "2023-02-04"),
+        row(2, 2, "Rocky Raccoon 100", "2023-02-04"),
+        row(3, 1, "Rocky Raccoon 50", "2023-02-04"),
+        row(4, 1, "Rocky Raccoon 100", "2023-02-05"),
+    ]
+    resolution = resolve(rows)
+    # The second source's listing can only join one of the first's:
+    assert links(rows, resolution) == {2: 1}
+    assert len(resolution.clusters) == 3
+
+
+def test_without_coordinates_blocks_by_place():
+    rows = [
+        row(1, 1, "Leadville Trail 100 Run", "2023-08-19", latitude=None, city="Leadville", state="CO"),
+        row(2, 2, "Leadville Trail 100", "2023-08-19", latitude=None, city="LEADVILLE", country="USA"),
+        row(3, 2, "Leadville Trail 100", "2023-08-19", latitude=None, city="Boulder"),
+        row(4, 2, "Leadville Trail 100", "2023-08-19", latitude=None),
+    ]
+    assert links(rows, resolve(rows)) == {2: 1}
+
+
+def test_canonical_is_most_complete():
+    rows = [
+        row(1, 2, "Javelina Jundred", "2023-10-28"),
+        row(2, 1, "Javelina Jundred", "2023-10-28", url="https://example.com", city="Fountain Hills"),
+    ]
+    assert links(rows, resolve(rows)) == {1: 2}
+
+
+def test_upload_links(monkeypatch):
+    upserts, deletes = [], []
+
+    class Query:
+
+        def delete(self):
+            return self
+
+        def in_(self, column, values):
+            deletes.append((column, values))
+            return self
+
+        def execute(self):
+            pass
+
+    client = type("Client", (), {"table": lambda self, name: Query()})()
+    monkeypatch.setattr(
+        resolve_module, "upsert_rows",
+        lambda client, table, rows, on_conflict: upserts.append((table, rows, on_conflict)))
+    rows = [{"id": i} for i in range(1, 6)]
+    upload_links(client, rows, {2: 1, 3: 1, 5: 4}, batch_size=2)
+    assert upserts == [
+        ("event_links", [{"event_id": 2, "canonical_event_id": 1}, {"event_id": 3, "canonical_event_id": 1}], ("event_id",)),
+        ("event_links", [{"event_id": 5, "canonical_event_id": 4}], ("event_id",)),
+    ]
+    assert deletes == [("event_id", [1, 4])]
@@ -0,0 +1,46 @@
+import json
+
+import fakeredis
+
+from codec import COMPRESSED, FORMAT_JSON
+from ingest.results import RESULT_EXPIRES, apply_result_policy, result_report
+
+
+class FakeBackend:
+
+    def __init__(self):
+        self.client = fakeredis.FakeRedis()
+
+    def get_key_for_task(self, task_id):
+        return f"celery-task-meta-{task_id}".encode()
+
+
+def test_result_policy_expires_and_counts():
+    backend = FakeBackend()
+    backend.client.set(b"celery-task-meta-t1", b"x" * 100)
+    backend.client.set(b"celery-task-meta-t2", b"x" * 50)
+    assert apply_result_policy(backend, "t1", "upload", "run1") == 100
+    apply_result_policy(backend, "t2", "upload", "run1")
+    assert 0 < backend.client.ttl(b"celery-task-meta-t1") <= RESULT_EXPIRES["upload"]
+    assert result_report(backend.client, "run1") == {"upload": {"bytes": 150, "count": 2}}
+
+
+def test_result_policy_skips_ignored_results():
+    backend = FakeBackend()
+    assert apply_result_policy(backend, "missing", "fetch", "run1") is None
+    assert result_report(backend.client, "run1") == {}
+
+
+def test_stored_results_are_compressed():
+    from celery.backends.redis import RedisBackend
+
+    from ingest.tasks import app
+
+    backend = RedisBackend(app=app, url="redis://localhost:6379/0")
+    backend.client = fakeredis.FakeRedis()
+    result = [{"EventId": i, "EventName": f"Trail Race {i}"} for i in range(200)]
+    backend.store_result("t1", result, "SUCCESS")
+    stored = backend.client.get(backend.get_key_for_task("t1"))
+    assert stored[:2] == FORMAT_JSON + COMPRESSED
+    assert len(stored) < len(json.dumps(result))
+    assert backend.get_result("t1") == result
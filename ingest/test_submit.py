@@ -0,0 +1,47 @@
+from celery import Celery, chain, signature
+
+from ingest.submit import _chain_tasks, ignore_intermediate_results, submit_chains
+
+app = Celery("test_submit", broker="memory://", backend="cache+memory://")
+
+
+@app.task(name="stage")
+def stage(x=None):
+    return x
+
+
+def chains(n):
+    return (chain(stage.s(i), stage.s(), stage.s()) for i in range(n))
+
+
+def test_submit_chains_streams_without_results():
+    submitted = submit_chains(app, chains(25), batch_size=10)
+    assert submitted.count == 25
+    assert submitted.results is None
+
+
+def test_submit_chains_keeps_results_when_asked():
+    submitted = submit_chains(app, chains(5), batch_size=2, keep_results=True)
+    assert len(submitted.results) == 5
+
+
+def test_ignore_intermediate_results():
+    sig = ignore_intermediate_results(chain(stage.s(1), stage.s(), stage.s()))
+    assert [task.options.get("ignore_result") for task in sig.tasks] == [True, True, None]
+
+
+def test_ignore_intermediate_results_nested():
+    sig = ignore_intermediate_results(chain(stage.s(1) | stage.s() | stage.s()))
+    assert len(sig.tasks) == 1
+    assert [task.options.get("ignore_result") for task in sig.tasks[0].tasks] == [True, True, None]
+
+
+def test_ignore_intermediate_results_ingest_chain():
+    # Built as run_celery.ingest_chain builds them:
+    stages = [signature("stage", kwargs={"x": 1}), signature("stage"), signature("stage")]
+    for s in stages:
+        s.set(headers={"run_id": "run"})
+    sig = ignore_intermediate_results(chain(*stages))
+    tasks = _chain_tasks(sig)
+    assert [task.options.get("ignore_result") for task in tasks] == [True, True, None]
+    assert all(task.options["headers"] == {"run_id": "run"} for task in tasks)
@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+
+from ingest import tasks
+
+
+def test_import_does_not_load_supabase():
+    # In a fresh interpreter, as other tests may have imported it already:
+    code = (
+        "import sys, ingest.tasks; "
+        "print(any(m.split('.')[0] in ('client', 'supabase', 'postgrest') for m in sys.modules))")
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert out.stdout.strip() == "False"
+
+
+def test_result_policy_uses_stage_queue(monkeypatch):
+    calls = []
+    monkeypatch.setattr(tasks, "apply_result_policy", lambda *args: calls.append(args))
+    request = SimpleNamespace(delivery_info={"routing_key": "upload.ultrasignup"}, run_id="run1")
+    tasks.on_task_postrun(task_id="t1", task=SimpleNamespace(request=request, backend=None))
+    assert calls == [(None, "t1", "upload", "run1")]
+
+
+def test_flush_requeues_when_out_of_retries(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(tasks, "get_redis", lambda: client)
+    coalescer = tasks.Coalescer("ahotu", client)
+    coalescer.add([{"name": "A"}, {"name": "B"}], "k0")
+    scheduled = []
+    task = SimpleNamespace(
+        request=SimpleNamespace(id="flush-1", retries=3), max_retries=3,
+        apply_async=lambda countdown: scheduled.append(countdown))
+
+    def upload_data(rows):
+        raise RuntimeError("down")
+
+    with pytest.raises(RuntimeError):
+        tasks.flush_coalesced(task, "ahotu", upload_data)
+    assert scheduled == [tasks.COALESCE_WINDOW]
+    assert [item["rows"] for item in coalescer.claim("flush-2")] == [[{"name": "A"}, {"name": "B"}]]
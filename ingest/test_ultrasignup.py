@@ -0,0 +1,124 @@
+from types import SimpleNamespace
+
+import pytest
+
+from events import Event
+from ingest import ultrasignup
+from ingest.fingerprint import SQLiteFingerprintStore, event_fingerprint
+
+SOURCE_ID = 91
+
+
+class FakeQuery:
+    """ Just enough of a PostgREST query for the row-wise upload. """
+
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.filters = []
+        self.write = None
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: row.get(column) >= value)
+        return self
+
+    def lte(self, column, value):
+        self.filters.append(lambda row: row.get(column) <= value)
+        return self
+
+    def match(self, values):
+        for column, value in values.items():
+            self.eq(column, value)
+        return self
+
+    def order(self, column):
+        return self
+
+    def range(self, start, end):
+        return self
+
+    def insert(self, row):
+        self.write = ("insert", row)
+        return self
+
+    def update(self, row):
+        self.write = ("update", row)
+        return self
+
+    def execute(self):
+        rows = self.db.tables.setdefault(self.name, [])
+        if self.write is None:
+            return SimpleNamespace(data=[row for row in rows if all(f(row) for f in self.filters)])
+        op, values = self.write
+        self.db.writes.append((self.name, op))
+        if op == "insert":
+            row = {**values, "id": len(rows) + 1}
+            rows.append(row)
+            return SimpleNamespace(data=[row])
+        matched = [row for row in rows if all(f(row) for f in self.filters)]
+        for row in matched:
+            row.update(values)
+        return SimpleNamespace(data=matched)
+
+
+class FakeClient:
+
+    def __init__(self, events):
+        self.tables = {"events": events, "event_distances": []}
+        self.writes = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+def event(name):
+    return Event(
+        name=name, start_date="2023-06-01", city="X", state="CA", country="USA",
+        distances=["50 mi"])
+
+
+@pytest.fixture
+def upload(monkeypatch):
+    store = SQLiteFingerprintStore(":memory:")
+    monkeypatch.setenv("SOURCE_ULTRASIGNUP", "http://example.com")
+    monkeypatch.setattr(ultrasignup, "fingerprint_store", lambda: store)
+    monkeypatch.setattr(ultrasignup.reference_data, "source_id", lambda name, client=None: SOURCE_ID)
+    monkeypatch.setattr(ultrasignup.reference_data, "unit_id", lambda unit, client=None: 1)
+    ingest = ultrasignup.UltrasignupIngest()
+    return store, ingest
+
+
+def test_row_wise_upload_skips_unchanged(upload):
+    store, ingest = upload
+    unchanged, changed, new = event("Unchanged 50"), event("Changed 50"), event("New 50")
+    client = FakeClient([
+        {"id": 1, "source_id": SOURCE_ID, "name": "Unchanged 50", "start_date": "2023-06-01", "city": "X", "state": "CA"},
+        {"id": 2, "source_id": SOURCE_ID, "name": "Changed 50", "start_date": "2023-06-01", "city": "X", "state": "CA"},
+    ])
+    store.put(SOURCE_ID, ("Unchanged 50", "2023-06-01", "X", "CA"), 1, event_fingerprint(unchanged))
+    store.put(SOURCE_ID, ("Changed 50", "2023-06-01", "X", "CA"), 2, "stale")
+
+    ingest.upload([unchanged, changed, new], client=client)
+
+    # Nothing is written for the unchanged event:
+    assert client.writes == [
+        ("events", "update"),
+        ("event_distances", "insert"),
+        ("events", "insert"),
+        ("event_distances", "insert"),
+    ]
+    assert client.tables["events"][2]["name"] == "New 50"
+    assert [row["event_id"] for row in client.tables["event_distances"]] == [2, 3]
+    # Both are remembered, so the next upload skips all three:
+    for e in (changed, new):
+        assert store.get(SOURCE_ID, (e.name, "2023-06-01", "X", "CA")) == event_fingerprint(e)
+    client.writes.clear()
+    ingest.upload([unchanged, changed, new], client=client)
+    assert client.writes == []
@@ -3,9 +3,25 @@ from abc import ABC, abstractmethod
 
 class UltraRequest(ABC):
 
-    def __init__(self, params):
+    def __init__(self, params, payload=None):
         self.params = params
+        # Response body already fetched while planning, if any:
+        self.payload = payload
 
     @abstractmethod
-    def fetch(self):
+    def fetch(self, limiter=None):
+        """
+        :param limiter: Shared ``RateLimiter`` to take a token from before
+            each request, instead of sleeping
+        """
         pass
+
+    def process(self, payload):
+        """
+        Turn a decoded response body into a batch for parsing. Shared
+        by ``fetch()`` and the async fetch engine.
+
+        :param payload: JSON-decoded response body
+        :return: The batch of raw events
+        """
+        return payload
@@ -2,32 +2,139 @@ import copy
 import logging as log
 import os
 import time
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 
 import httpx
 from supabase import Client
 
-from client import connect
-from events import Event, EventList, event_list_dumps, event_list_loads
+from client import client_pool
+from events import Event, EventList, event_list_dumps, event_list_load
+from ingest.bulk import bulk_upload
+from codec import PACKED_PAYLOADS
+from ingest.mapping import SourceMapping
 from ingest.ultrarequest import UltraRequest
+from ingest.existence import EventIndex
+from ingest.fetchcache import FetchCache
+from ingest.fingerprint import event_fingerprint, fingerprint_store
 from ingest.ingest import Ingest
-from ingest.parser import distance_parser, distance_extract, identity
+from ingest.ratelimit import RateLimiter
+from ingest.refdata import reference_data
+from ingest.parser import distance_parser, distance_normalize, identity
+from ingest.partition import Partition, partition_store, plan, record_count, record_split
+
+
+# Most events the API returns for one query (there is no pagination):
+RESULT_CAP = 100
+# Plan queries adaptively instead of the fixed month x distance grid:
+ADAPTIVE_PARTITIONS = os.getenv("ADAPTIVE_PARTITIONS", "false").lower() == "true"
+ROOT_PARTITION = Partition(
+    months=tuple(range(1, 13)), dists=tuple(range(1, 13)), lat=30, lng=-100, mi=50000)
 
 
 class InternalError(Exception):
     pass
 
 
-def fetch_data(url, request_params, sleep=5) -> Dict:
+class SaturatedError(InternalError):
+    """ A query hit the result cap, so its response may be missing events. """
+
+    def __init__(self, message, request_params, payload):
+        super().__init__(message)
+        self.request_params = request_params
+        self.payload = payload
+
+
+def process_response(payload, request_params) -> Dict:
+    if len(payload) >= RESULT_CAP:
+        raise SaturatedError(
+            f"Ultrasignup API returned more than {RESULT_CAP - 1} events for "
+            f"month {request_params['m']} and distance {request_params['dist']}",
+            request_params, payload)
+    return payload
+
+
+def split_saturated(error: SaturatedError) -> List[Partition]:
+    """
+    Narrower partitions to query instead of a saturated one, remembered
+    for later runs. Empty if it cannot be split further, in which case
+    the capped response is all there is.
+    """
+    partition = Partition.from_params(error.request_params)
+    if not partition.can_split():
+        log.warning(f"Keeping capped response, partition is at its narrowest: {error}")
+        record_count(partition_store(), partition, len(error.payload))
+        return []
+    children = record_split(partition_store(), partition)
+    log.info(f"{error}, splitting into {len(children)} partitions")
+    return children
+
+
+def fetch_partitioned(
+        url, request_params, sleep=5, cache: Optional[FetchCache] = None,
+        limiter: Optional[RateLimiter] = None) -> Optional[Dict]:
+    """
+    Like ``fetch_data``, but splits a saturated partition and fetches its
+    children instead, until every response is under the cap.
+    """
+    try:
+        batch = fetch_data(url, request_params, sleep=sleep, cache=cache, limiter=limiter)
+    except SaturatedError as e:
+        children = split_saturated(e)
+        if not children:
+            return e.payload
+        batches = [
+            fetch_partitioned(url, child.params(), sleep=sleep, cache=cache, limiter=limiter)
+            for child in children]
+        batches = [batch for batch in batches if batch is not None]
+        return [event for batch in batches for event in batch] if batches else None
+    if batch is not None:
+        record_count(partition_store(), Partition.from_params(request_params), len(batch))
+    return batch
+
+
+def fetch_or_split(
+        url, request_params, sleep=5,
+        cache: Optional[FetchCache] = None) -> Tuple[Optional[Dict], List[Partition]]:
+    """
+    Fetch one query. With ``ADAPTIVE_PARTITIONS``, a saturated query is
+    split instead, for the caller to fetch each partition separately.
+
+    :return: The batch, or None and the partitions to fetch instead
+    """
+    try:
+        batch = fetch_data(url, request_params, sleep=sleep, cache=cache)
+    except SaturatedError as e:
+        if not ADAPTIVE_PARTITIONS:
+            raise
+        children = split_saturated(e)
+        if not children:
+            return e.payload, []
+        return None, children
+    if ADAPTIVE_PARTITIONS and (batch is not None):
+        record_count(partition_store(), Partition.from_params(request_params), len(batch))
+    return batch, []
+
+
+def fetch_data(
+        url, request_params, sleep=5, cache: Optional[FetchCache] = None,
+        limiter: Optional[RateLimiter] = None) -> Optional[Dict]:
+    """
+    :param cache: If given, fetch conditionally and return None when the
+        page is unchanged since its last upload.
+    :param limiter: If given, take a token from it instead of sleeping
+    """
     # Be polite:
-    if sleep:
+    if limiter is not None:
+        limiter.acquire()
+    elif sleep:
         time.sleep(sleep)
-    tmp = httpx.get(url, params=request_params).json()
-    if len(tmp) == 100:
-        raise InternalError(
-            f"Ultrasignup API returned more than 100 events for "
-            "month {month} and distance {dist}")
-    return tmp
+    if cache is None:
+        payload = httpx.get(url, params=request_params).json()
+    else:
+        payload = cache.fetch(url, request_params)
+        if payload is None:
+            return None
+    return process_response(payload, request_params)
 
 
 def parse_data(batch):
@@ -36,19 +143,20 @@ def parse_data(batch):
     each time, instead of sending as an argument.
 
     :param batch:
-    :return: Needs to be JSON, hence the event_list_dumps() call.
+    :return: JSON text, or plain rows when payloads are packed
     """
-    return event_list_dumps(UltrasignupIngest().parse(batch))
+    events = UltrasignupIngest().parse(
+        batch, columnar=os.getenv("COLUMNAR_PARSE", "false").lower() == "true")
+    return events.todicts() if PACKED_PAYLOADS else event_list_dumps(events)
 
 
 def upload_data(event_list):
-    # Since tasks are run parallel potentially across different machines
-    # we open new db connections for each, but control connections
-    # via concurrency of the queue. For the fetch and parse tasks,
-    # we have no restrictions on the queue concurrency.
-    client = connect()
-    return UltrasignupIngest().upload(
-        event_list_loads(event_list), client=client)
+    # Clients are reused across tasks in a worker process; the number of
+    # connections is still controlled by the upload queue's concurrency.
+    with client_pool().borrow() as client:
+        return UltrasignupIngest().upload(
+            event_list_load(event_list), client=client,
+            bulk=os.getenv("BULK_UPLOAD", "false").lower() == "true")
 
 
 class UltrasignupRequest(UltraRequest):
@@ -61,47 +169,63 @@ class UltrasignupRequest(UltraRequest):
             raise ValueError("'SOURCE_ULTRASIGNUP' environment variable must be set")
         self.params = params
 
-    def fetch(self) -> Dict:
+    def fetch(self, limiter: Optional[RateLimiter] = None) -> Dict:
         """
         Later: return UltrasignupResponse. Error handling left to caller
 
         :return:
         """
-        return fetch_data(self.url, self.params)
+        if ADAPTIVE_PARTITIONS:
+            return fetch_partitioned(self.url, self.params, limiter=limiter)
+        return fetch_data(self.url, self.params, limiter=limiter)
+
+    def process(self, payload) -> Dict:
+        return process_response(payload, self.params)
+
+
+MAPPING = SourceMapping(
+    schema_mapping={
+        "source_id": (None, identity),
+        "name": ("EventName", identity),
+        "event_foreign_id": ("EventId", identity),
+        "url": ("EventWebsite", identity),
+        "start_date": ("EventDate", identity),
+        "distances": ("Distances", distance_parser),
+        "country": (None, identity),
+        "city": ("City", identity),
+        "state": ("State", identity),
+        "latitude": ("Latitude", identity),
+        "longitude": ("Longitude", identity),
+        "virtual": ("VirtualEvent", identity)
+    },
+    unmapped_defaults={
+        "country": "USA",
+        "source_id": 1
+    })
 
 
 class UltrasignupIngest(Ingest):
 
+    # Name in the ``sources`` table:
+    source_name = "UltraSignup"
+    mapping = MAPPING
+
     def __init__(self):
         self.url = os.getenv("SOURCE_ULTRASIGNUP")
         if not self.url:
             raise ValueError("'SOURCE_ULTRASIGNUP' environment variable must be set")
 
-        # Class constants:
-        self.__unmapped_defaults = {
-            "country": "USA",
-            "source_id": 1
-        }
-        self.__schema_mapping = {
-            "source_id": (None, identity),
-            "name": ("EventName", identity),
-            "event_foreign_id": ("EventId", identity),
-            "url": ("EventWebsite", identity),
-            "start_date": ("EventDate", identity),
-            "distances": ("Distances", distance_parser),
-            "country": (None, identity),
-            "city": ("City", identity),
-            "state": ("State", identity),
-            "latitude": ("Latitude", identity),
-            "longitude": ("Longitude", identity),
-            "virtual": ("VirtualEvent", identity)
-        }
-
     def fetch(self) -> List[UltrasignupRequest]:
         """
 
         :return:
         """
+        if ADAPTIVE_PARTITIONS:
+            # Start coarse, or from the partitions remembered from previous
+            # runs; saturated ones are split as they are fetched:
+            partitions = plan(partition_store(), ROOT_PARTITION, cap=RESULT_CAP)
+            log.info(f"Planned {len(partitions)} partitions")
+            return [UltrasignupRequest(partition.params()) for partition in partitions]
         params = {
             "virtual": 0,
             "lat": 30,
@@ -122,71 +246,77 @@ class UltrasignupIngest(Ingest):
                 request_list.append(UltrasignupRequest(tmp_params))
         return request_list
 
-    def parse(self, batch: List[Dict]) -> EventList:
-        tmp_parsed_data = []
-        for event in batch:
-            parsed_event = {}
-            for key, value in self.__schema_mapping.items():
-                if value[0] is None:
-                    # Not a mapped field:
-                    parsed_event[key] = self.__unmapped_defaults[key]
-                else:
-                    # Remap the field:
-                    parsed_event[key] = value[1](event[value[0]])
-            tmp_parsed_data.append(parsed_event)
-        return EventList([Event(**tmp_event) for tmp_event in tmp_parsed_data])
+    def parse(self, batch: List[Dict], columnar: bool = False) -> EventList:
+        return self.mapping.parse(batch, columnar=columnar)
 
-    def upload(self, parsed_batch: List[Event], client: Client):
-        # Go event-by-event for now:
+    def upload(self, parsed_batch: List[Event], client: Client, bulk: bool = False):
+        if bulk:
+            return bulk_upload(
+                parsed_batch, client=client, key=self.event_key,
+                source_id=reference_data.source_id(self.source_name, client=client))
+        # Go event-by-event:
         new_events = 0
+        updated_events = 0
         new_distances = 0
+        fingerprints = fingerprint_store()
+        source_id = reference_data.source_id(self.source_name, client=client)
+        # One range query covering the batch instead of two selects per event:
+        index = EventIndex.build(
+            client, parsed_batch, key=self.event_key, source_id=source_id)
+        stored = fingerprints.get_many(source_id, [index.event_key(event) for event in parsed_batch])
         for event in parsed_batch:
             # Check if the event already exists (event_foreign_id is not unique)
             event_distances = event.distances
-            echeck = client.table("events").select("id").match(
-                {
-                    "name": event.name,
-                    "start_date": event.start_date,
-                    "city": event.city,
-                    "state": event.state
-                }
-            ).execute()
+            event_id = index.get(event)
+            if (event_id is None) and not index.covers(event):
+                # Outside the indexed window, confirm against the db before inserting:
+                echeck = client.table("events").select("id").match(
+                    {
+                        "name": event.name,
+                        "start_date": event.start_date,
+                        "city": event.city,
+                        "state": event.state
+                    }
+                ).execute()
+                if len(echeck.data):
+                    event_id = echeck.data[0]["id"]
+                    index.add(event, event_id)
             # If it does, then diff it, it has changes, then update
-            if not len(echeck.data):
+            fingerprint = event_fingerprint(event)
+            if event_id is None:
                 # If it does not, then insert it
                 log.info(
                     f"Event: {event.name} in {event.city}, "
                     f"{event.state} on {event.start_date} detected")
-                out = client.table("events").insert(event.todict(schema=True)).execute()
+                out = client.table("events").insert(
+                    {**event.todict(schema=True), "source_id": source_id}).execute()
+                event_id = out.data[0]["id"]
+                index.add(event, event_id)
                 new_events += 1
             else:
-                # It already exists, pass for now, later check
+                # It already exists, skip it if unchanged since the last ingest:
+                if stored.get(index.event_key(event)) == fingerprint:
+                    log.info(
+                        f"Event: {event.name} in {event.city}, "
+                        f"{event.state} on {event.start_date} unchanged")
+                    continue
                 log.info(
                     f"Event: {event.name} in {event.city}, "
-                    f"{event.state} on {event.start_date} already found")
+                    f"{event.state} on {event.start_date} changed, updating")
+                client.table("events").update(
+                    {**event.todict(schema=True), "source_id": source_id}
+                ).eq("id", event_id).execute()
+                updated_events += 1
             # Now, the event exists, time to process the distances:
-            # First, get the event id:
-            event_id_response = client.table("events").select("id").match(
-                {
-                    "name": event.name,
-                    "start_date": event.start_date,
-                    "city": event.city,
-                    "state": event.state
-                }
-            ).execute()
-            event_id = event_id_response.data[0]["id"]
             for event_distance in event_distances:
                 # Do we have this distance already?
-                dist = distance_extract(event_distance)
+                dist = distance_normalize(event_distance)
                 if dist is None:
                     log.info(f"Unable to process distance: {event_distance}")
                     continue
                 else:
                     log.info(f"Parsed distance: {event_distance}")
-                unit_id = client.table("distance_units").select("id").match({"unit_name": dist["unit"]}).execute()
-                if not len(unit_id.data):
-                    raise ValueError(f"Unknown unit: {dist['unit']}")
-                unit_id = unit_id.data[0]["id"]
+                unit_id = reference_data.unit_id(dist["unit"], client=client)
                 # Query first to see if it exists
                 distance_exists_query = client.table("event_distances").select("id").match({
                     "event_id": event_id,
@@ -206,7 +336,10 @@ class UltrasignupIngest(Ingest):
                     }).execute()
                     new_distances += 1
                     # Validate the insert
+            # Remember this version so the next ingest can skip it if unchanged:
+            fingerprints.put(source_id, index.event_key(event), event_id, fingerprint)
         # Summarize:
         log.info(f"Inserted {new_events} new events")
+        log.info(f"Updated {updated_events} changed events")
         log.info(f"Inserted {new_distances} new distances")
         return
@@ -1,56 +1,104 @@
+import argparse
+import itertools
 import json
+import os
+from datetime import datetime
 
 from celery import chain, signature
 
-from ingest.ultrasignup import UltrasignupIngest
-from ingest.ahotu import AhotuIngest
+from ingest import registry
+from ingest.claimcheck import CLAIM_CHECK, CLAIM_CHECK_THRESHOLD
+from ingest.fetchcache import fetch_key
+from ingest.results import log_report, result_report
+from ingest.submit import SUBMIT_BATCH_SIZE, submit_chains
 from client import connect
 
-## Note: this import is required, even though app is not used
+## Note: this import is required, it also registers the tasks
 from ingest.tasks import app
 
+# Sources to fetch and parse in one task, e.g. "ultrasignup,ahotu":
+FUSED_SOURCES = [s for s in os.getenv("FUSED_SOURCES", "").split(",") if s]
+# Keep an AsyncResult per submitted chain:
+KEEP_RESULTS = os.getenv("KEEP_RESULTS", "false").lower() == "true"
+# Only store the result of each chain's last task:
+IGNORE_INTERMEDIATE_RESULTS = os.getenv("IGNORE_INTERMEDIATE_RESULTS", "false").lower() == "true"
+
+
+def ingest_chain(source, batch, run_id, fused=False):
+    """
+    Task chain for one request: fetch, parse and upload, or with ``fused``
+    a single fetch+parse task on the fetch queue, then upload.
+    """
+    fetch_kwargs = {
+        "url": batch.url,
+        "request_params": json.dumps(batch.params),
+        "run_id": run_id
+    }
+    upload = signature(
+        f'{source}_uploader',
+        kwargs={"fetch_key": fetch_key(batch.url, batch.params)})
+    if fused:
+        stages = [signature(f'{source}_fetch_parser', kwargs=fetch_kwargs), upload]
+    elif batch.payload is not None:
+        # Fetched while planning, so start at the parser:
+        stages = [signature(f'{source}_parser', args=(batch.process(batch.payload),)), upload]
+    else:
+        stages = [
+            signature(f'{source}_fetcher', kwargs=fetch_kwargs),
+            signature(f'{source}_parser'),
+            upload]
+    for stage in stages:
+        # Lets workers attribute result backend usage to this run:
+        stage.set(headers={"run_id": run_id})
+    return chain(*stages)
+
 
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--report", metavar="RUN_ID",
+        help="print the result backend usage of a previous run, then exit")
+    args = parser.parse_args()
+    if args.report:
+        # The counts are kept beside the results, in the result backend:
+        backend_client = getattr(app.backend, "client", None)
+        if backend_client is None:
+            raise SystemExit("--report needs a Redis result backend (RESULT_BACKEND)")
+        report = result_report(backend_client, args.report)
+        log_report(args.report, report)
+        print(json.dumps(report, indent=2))
+        raise SystemExit(0)
+
     client = connect()
 
-    active = {
-        "ultrasignup": {
-            "run": True,
-            "ingest": UltrasignupIngest
-        },
-        "ahotu": {
-            "run": True,
-            "ingest": AhotuIngest
-        }
-    }
+    # Set SOURCES to ingest only some, e.g. "ahotu":
+    sources = registry.enabled()
     max_batches = 50000
+    run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
 
-    print(f"Config: {active}")
+    print(f"Sources: {sources} (fused: {FUSED_SOURCES})")
     print(f"Max batches: {max_batches}")
+    print(f"Run id: {run_id}")
+    # Workers swap payloads over the threshold for references, so the
+    # chains below carry those instead of whole pages:
+    print(f"Claim check: {CLAIM_CHECK} (threshold {CLAIM_CHECK_THRESHOLD} bytes)")
 
-    for source in ["ultrasignup", "ahotu"]:
-        if not active[source]["run"]:
-            continue
-
-        uti = active[source]["ingest"]()
-        uti_requests = uti.fetch()
+    for source in sources:
+        uti = registry.ingest_class(source)()
 
-        # Submit all tasks to celery, workers will start to churn through
-        # these immediately. Number of workers controls parallelism.
+        # Submit tasks to celery as requests are planned, workers will start
+        # to churn through these immediately. Number of workers controls
+        # parallelism.
         print(f"Submitting {source} fetch tasks to celery")
-        results = []
-        for i, batch in enumerate(uti_requests):
-            results.append(chain(
-                signature(
-                    f'{source}_fetcher',
-                    kwargs={
-                        "url": batch.url,
-                        "request_params": json.dumps(batch.params)
-                    }) |
-                signature(f'{source}_parser') |
-                signature(f'{source}_uploader')
-            )())
-            if (i + 1) >= max_batches:
-                break
-        print(f"All {source} tasks submitted ({len(uti_requests)} task chains)")
+        chains = (
+            ingest_chain(source, batch, run_id, fused=source in FUSED_SOURCES)
+            for batch in itertools.islice(uti.iter_requests(), max_batches))
+        submitted = submit_chains(
+            app, chains,
+            batch_size=SUBMIT_BATCH_SIZE,
+            keep_results=KEEP_RESULTS,
+            ignore_intermediate=IGNORE_INTERMEDIATE_RESULTS)
+        print(
+            f"All {source} tasks submitted ({submitted.count} task chains "
+            f"in {submitted.seconds:.1f}s)")
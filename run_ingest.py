@@ -1,31 +1,79 @@
-from ingest.ultrasignup import UltrasignupIngest
-from ingest.ahotu import AhotuIngest
-from client import connect
+import argparse
+import asyncio
+import itertools
+import logging as log
+import os
+
+from ingest import registry
+from ingest.fetcher import AsyncFetcher
+from ingest.pipeline import (
+    PIPELINE_FETCHERS, PIPELINE_PARSERS, PIPELINE_QUEUE_SIZE, PIPELINE_UPLOADERS, Pipeline)
+from ingest.ratelimit import get_limiter
+from client import CLIENT_POOL_SIZE, client_pool, init_pool
+
+
+def run_sync(ingest, client, max_batches):
+    requests = ingest.iter_requests()
+    for i, batch in enumerate(requests):
+        parsed_batch = ingest.parse(batch.fetch())
+        ingest.upload(parsed_batch, client=client)
+        if i >= max_batches:
+            break
+
+
+async def run_async(source, ingest, client, max_batches):
+    # Fetches run concurrently, parse and upload each page as it lands.
+    # Uploads use the blocking client, so keep them off the event loop.
+    # Fetches share the source's rate limit, like fetch tasks:
+    requests = itertools.islice(ingest.iter_requests(), max_batches + 1)
+    async for result in AsyncFetcher(limiter=get_limiter(source)).stream(requests):
+        if result.error is not None:
+            continue
+        parsed_batch = ingest.parse(result.batch)
+        await asyncio.to_thread(ingest.upload, parsed_batch, client)
+
+
+def run_stream(source, ingest, max_batches, args):
+    # Fetch, parse and upload overlap, each stage with its own threads.
+    # The fetch threads share the source's rate limit, like fetch tasks:
+    pipeline = Pipeline(
+        ingest,
+        fetchers=args.fetchers,
+        parsers=args.parsers,
+        uploaders=args.uploaders,
+        queue_size=args.queue_size,
+        columnar=os.getenv("COLUMNAR_PARSE", "false").lower() == "true",
+        bulk=os.getenv("BULK_UPLOAD", "false").lower() == "true",
+        limiter=get_limiter(source))
+    return pipeline.run(itertools.islice(ingest.iter_requests(), max_batches + 1))
 
 
 # Press the green button in the gutter to run the script.
 if __name__ == '__main__':
 
-    ultrasignup = True
-    ahotu = True
-    max_batches = 4
-
-    client = connect()
-
-    if ultrasignup:
-        uti = UltrasignupIngest()
-        uti_requests = uti.fetch()
-        for i, batch in enumerate(uti_requests):
-            parsed_batch = uti.parse(batch.fetch())
-            uti.upload(parsed_batch, client=client)
-            if i >= max_batches:
-                break
-
-    if ahotu:
-        ahi = AhotuIngest()
-        ahotu_requests = ahi.fetch()
-        for i, batch in enumerate(ahotu_requests):
-            parsed_batch = ahi.parse(batch.fetch())
-            ahi.upload(parsed_batch, client=client)
-            if i >= max_batches:
-                break
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--mode", choices=["sync", "async", "stream"], default="sync",
+        help=(
+            "sync: fetch one page at a time; async: fetch pages concurrently; "
+            "stream: overlap fetch, parse and upload in thread stages"))
+    parser.add_argument("--max-batches", type=int, default=4)
+    parser.add_argument("--fetchers", type=int, default=PIPELINE_FETCHERS, help="stream mode fetch threads")
+    parser.add_argument("--parsers", type=int, default=PIPELINE_PARSERS, help="stream mode parse threads")
+    parser.add_argument("--uploaders", type=int, default=PIPELINE_UPLOADERS, help="stream mode upload threads")
+    parser.add_argument("--queue-size", type=int, default=PIPELINE_QUEUE_SIZE, help="stream mode queue capacity")
+    args = parser.parse_args()
+
+    for source in registry.enabled():
+        ingest_cls = registry.ingest_class(source)
+        log.info(f"Running {ingest_cls.__name__} in {args.mode} mode")
+        if args.mode == "stream":
+            # One client per upload thread:
+            init_pool(size=max(args.uploaders, CLIENT_POOL_SIZE))
+            run_stream(source, ingest_cls(), args.max_batches, args)
+            continue
+        with client_pool().borrow() as client:
+            if args.mode == "async":
+                asyncio.run(run_async(source, ingest_cls(), client, args.max_batches))
+            else:
+                run_sync(ingest_cls(), client, args.max_batches)
@@ -0,0 +1,46 @@
+import httpx
+import pytest
+
+from client import ClientPool
+
+
+class FakeClient:
+
+    def __init__(self):
+        self.closed = False
+
+
+def test_pool_reuses_clients():
+    made = []
+    pool = ClientPool(size=2, factory=lambda: made.append(FakeClient()) or made[-1])
+    with pool.borrow() as c1:
+        pass
+    with pool.borrow() as c2:
+        assert c2 is c1
+    assert len(made) == 1
+
+
+def test_pool_is_bounded():
+    pool = ClientPool(size=1, factory=FakeClient, timeout=0.01)
+    with pool.borrow():
+        with pytest.raises(TimeoutError):
+            with pool.borrow():
+                pass
+
+
+def test_pool_replaces_broken_clients():
+    pool = ClientPool(size=1, factory=FakeClient)
+    with pytest.raises(httpx.ConnectError):
+        with pool.borrow() as c1:
+            raise httpx.ConnectError("boom")
+    with pool.borrow() as c2:
+        assert c2 is not c1
+
+
+def test_pool_health_checks_idle_clients(monkeypatch):
+    pool = ClientPool(size=1, factory=FakeClient, max_idle=0)
+    monkeypatch.setattr(pool, "_healthy", lambda client: False)
+    with pool.borrow() as c1:
+        pass
+    with pool.borrow() as c2:
+        assert c2 is not c1
@@ -1,6 +1,9 @@
 import json
 
-from events import Event, EventList, event_dumps, event_loads, event_list_dumps, event_list_loads
+from events import (
+    Event, EventList, event_dumps, event_loads, event_list_dumps, event_list_loads,
+    event_list_load, event_list_packb, event_list_unpackb)
+import codec
 
 
 j1 = {
@@ -57,9 +60,46 @@ def test_event_list_round_trip():
     assert el1 == el2
 
 
+def test_event_list_packed_round_trip(monkeypatch):
+    el1 = EventList([Event(**j1), Event(**j2)])
+    assert event_list_unpackb(event_list_packb(el1)) == el1
+    # Compressed above the threshold:
+    monkeypatch.setattr(codec, "COMPRESS_THRESHOLD", 0)
+    packed = event_list_packb(el1)
+    assert packed[1:2] == codec.COMPRESSED
+    assert event_list_unpackb(packed) == el1
+
+
+def test_event_list_load_any_form():
+    el1 = EventList([Event(**j1), Event(**j2)])
+    assert event_list_load(event_list_dumps(el1)) == el1
+    assert event_list_load(event_list_packb(el1)) == el1
+    assert event_list_load(el1.todicts()) == el1
+
+
 def test_event_list_iterable():
     e1 = Event(**j1)
     e2 = Event(**j2)
     el1 = EventList([e1, e2])
     for e in el1:
         assert e in el1
+
+
+def test_event_todict_schema():
+    e1 = Event(**j1, distances=["50K"], event_foreign_id=7, foo="bar")
+    assert e1.todict(schema=True) == {k: v for k, v in j1.items() if k in Event.SCHEMA}
+    assert e1.todict()["foo"] == "bar"
+    assert e1.foo == "bar"
+    assert e1.url is None
+
+
+def test_event_list_columns():
+    e1 = Event(**j1)
+    e2 = Event(**j2)
+    el1 = EventList([e1, e2])
+    el2 = EventList.from_columns(el1.to_columns())
+    assert el2.columnar
+    assert len(el2) == 2
+    assert el2[1] == e2
+    assert el1 == el2
+    assert event_list_dumps(el1) == event_list_dumps(el2)